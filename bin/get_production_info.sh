@@ -1,10 +1,17 @@
 #!/bin/sh
 
-BASEURL="https://cn.dataone.org/cn/v1"
+BASEURL="https://cn.dataone.org/cn"
 DESTDIR=/home/vieglais/sync/production_history/history
 DEST=${DESTDIR}/$(date +"%Y%m%d")
+#Registry documents are copied from the shared metadata cache, which only
+#downloads them again when they have changed on the CN
+CACHE="/usr/bin/python -m d1state.metadata_cache -b ${BASEURL}"
+#d1state is in plotcounts/src next to this script's folder, unless
+#PLOTCOUNTS_SRC is set
+SRC=${PLOTCOUNTS_SRC:-$(cd "$(dirname "$0")/../plotcounts/src" && pwd)}
+export PYTHONPATH=${SRC}
 
-/usr/bin/curl -s "${BASEURL}/node" > ${DEST}_nodes.xml
-/usr/bin/curl -s "${BASEURL}/formats" > ${DEST}_formats.xml
+${CACHE} nodes ${DEST}_nodes.xml
+${CACHE} formats ${DEST}_formats.xml
 
 
@@ -6,12 +6,19 @@ each of the following types of count:
 1. From CN.listObjects(count=0, formatId=formatId) to provide total number of 
    objects of that format.
 
-2. From an unauthenticated CN.query() with query matching the formatId to 
-   provide the number of publicly readable objects of that format.
+2. From a single unauthenticated CN.query() pivoted on formatType,formatId
+   to provide the number of publicly readable objects of each format and
+   of each type.
 
-3. From an unauthenticated CN.query() with query matching the formatId and
-   with no obsoletedBy entry provide the number of publicly readable objects 
-   of that format that have not been obsoleted.
+3. From a single unauthenticated CN.query() pivoted on formatType,formatId
+   and restricted to entries with no obsoletedBy to provide the number of
+   publicly readable objects of each format and of each type that have not
+   been obsoleted.
+
+The d1state package is imported from the folder given by the PLOTCOUNTS_SRC
+environment variable, or else from the src folder next to this script (after
+resolving symlinks, so ~/bin/objectcounts.py may link to the copy in
+~/.dataone/plotcounts).
 
 Configuration information is read from ~/.dataone/cache.conf which is a YAML
 file similar to::
@@ -29,13 +36,20 @@ file similar to::
 Where:
 
 :base_url: Is the CN base url for the environment to be examined.
-:store_file: Full path to the destination XSLX file, created if not present
+:store_file: Full path to the destination XSLX file, written with --export
+:count_store: Optional folder holding the count history (default is 
+              ~/.dataone/plotcounts/objectcounts)
 :html_dest: Path to HTML summary page generated (overwritten if present)
 :html_template: Path of a String.Template file used to generate the html_dest
 :pickle_file: Optional path of a location for a cache of downloaded content
 
-The output is a new or updated spreadsheet that contains at least two 
-worksheets.
+Each run appends a row of totals to summary.csv in the count_store folder, and
+with --detail the per format counts to detail.csv, so a run takes the same 
+time however long the history is. The first run seeds count_store from an 
+existing store_file.
+
+When run with -e or --export, the history is written to store_file as a 
+spreadsheet that contains at least two worksheets.
 
 **Summary** contains the totals for different object types (DATA, METADATA, 
 RESOURCE) for the categories listed above. Column names are::
@@ -69,23 +83,32 @@ format.
 '''
 
 import os
+import sys
+import csv
 import logging
 from yaml import load, Loader
 from openpyxl import Workbook, load_workbook
-from d1_client import cnclient, cnclient_1_1
-from openpyxl.cell import get_column_letter
 from datetime import datetime
 from optparse import OptionParser
 from string import Template
 import pickle
 import pprint
-
-def getObjectFormats(base_url):
+#d1state is in src next to this script, unless PLOTCOUNTS_SRC is set
+sys.path.insert(0, os.environ.get('PLOTCOUNTS_SRC',
+                                  os.path.join(os.path.dirname(
+                                    os.path.realpath(__file__)), "src")))
+from d1state import solr
+from d1state import workers
+from d1state.connections import ConnectionPool
+from d1state.metadata_cache import MetadataCache
+
+def getObjectFormats(base_url, metadata=None, pool=None):
   '''
   returns a dictionary of formatIds
   '''
-  client = cnclient.CoordinatingNodeClient( base_url )
-  formats = client.listFormats()
+  if metadata is None:
+    metadata = MetadataCache(base_url, pool=pool)
+  formats = metadata.listFormats()
   #A dictionary, keyed by formatId, each entry a list of:
   # 0: formatName
   # 1: formatType
@@ -101,57 +124,72 @@ def getObjectFormats(base_url):
   return res
 
 
-def escapeQueryTerm(term):
-  '''
-  + - && || ! ( ) { } [ ] ^ " ~ * ? : \
+def pivotCounts(client, fq=None):
+  '''Returns ({formatId: count}, {formatType: count}) for the public objects
+  matching fq from a single request pivoted on formatType,formatId.
   '''
-  reserved = ['+','-','&','|','!','(',')','{','}','[',']','^','"','~','*','?',':',]
-  term = term.replace(u'\\',u'\\\\')
-  for c in reserved:
-    term = term.replace(c,u"\%s" % c)
-  return term
-
-
-
-def getHitCount(client, q):
-  queryEngine = "solr"
-  query='/'
-  solrQuery = q
-  maxrecords = 0
-  fields = 'id'
-  results = eval(client.query(queryEngine, query=query, 
-                              q=q,
-                              wt='python', 
-                              fl=fields, 
-                              rows=maxrecords).read())
-  nHits = results['response']['numFound']
-  return nHits
-
-
-def countObjects(base_url, formats):
+  tree = solr.countByPivot(client, ['formatType', 'formatId'], fq=fq)
+  for ftype, n, nsum in solr.checkPivot(tree):
+    logging.warn("{0} total {1:d} != sum of formats {2:d}".format(ftype, n, nsum))
+  by_format = {}
+  by_type = {}
+  for ftype, (n, children) in tree.iteritems():
+    by_type[ftype] = n
+    for formatId, (m, leaves) in children.iteritems():
+      by_format[formatId] = by_format.get(formatId, 0) + m
+  return by_format, by_type
+
+
+def countObjects(base_url, formats, pool=None, max_workers=10):
   '''
   Populates the format dictionary with the number of objects as reported by the CN
+  
+  The two public counts come from one SOLR request each, pivoted on
+  formatType,formatId, which also gives the per type totals stored in
+  formats['type_totals']. The listObjects totals are retrieved concurrently
+  by up to max_workers threads.
+  '''
+  if pool is None:
+    pool = ConnectionPool(base_url)
+
+  def listObjectsTotal(formatId):
+    try:
+      res = pool.client('v1.1').listObjects(count=0, objectFormat=formatId)
+      return res.total
+    except Exception as e:
+      logging.error("listObjects failed for {0:s}: {1}".format(formatId, e))
+      return None
+
+  #Public counts for all formats, one pivoted request per column
+  oldclient = pool.client('v1')
+  pub, pub_types = pivotCounts(oldclient)
+  pub_no, pub_no_types = pivotCounts(oldclient, fq="-obsoletedBy:[* TO *]")
+  formats['type_totals'] = {3: pub_types,
+                            4: pub_no_types}
+  formatIds = formats['formats'].keys()
+  totals = workers.mapConcurrent(listObjectsTotal, formatIds, 
+                                 max_workers=max_workers)
+  failed = [formatId for formatId, n in zip(formatIds, totals) if n is None]
+  if len(failed) > 0:
+    raise Exception("listObjects failed for: {0:s}".format(", ".join(failed)))
+  for formatId, total in zip(formatIds, totals):
+    formats['formats'][formatId][2] = total
+    formats['formats'][formatId][3] = pub.get(formatId, 0)
+    formats['formats'][formatId][4] = pub_no.get(formatId, 0)
+    logging.info("{0:s} : {1:d}, {2:d}, {3:d}".format(formatId, 
+                                                      formats['formats'][formatId][2], 
+                                                      formats['formats'][formatId][3],
+                                                      formats['formats'][formatId][4] ))
+
+
+def getTotalsByType(formats, ctime=datetime.utcnow(), type_totals=None):
+  '''Returns the totals by type for each count column of formats.
+
+  The public columns are summed per format by registered type unless
+  type_totals ({column: {formatType: count}}, as recorded by countObjects)
+  provides the totals reported by SOLR, in which case those are used and
+  any difference from the summed values is logged.
   '''
-  oldclient = cnclient.CoordinatingNodeClient( base_url )
-  client = cnclient_1_1.CoordinatingNodeClient( base_url )
-  for formatId in formats['formats'].keys():
-    res = client.listObjects(count=0, objectFormat=formatId)
-    formats['formats'][formatId][2] = res.total
-    q = "formatId:\"{0:s}\"".format(escapeQueryTerm(formatId))
-    formats['formats'][formatId][3] = getHitCount(oldclient, q)
-    q = "formatId:\"{0:s}\" AND -obsoletedBy:[* TO *]".format(escapeQueryTerm(formatId))
-    formats['formats'][formatId][4] = getHitCount(oldclient, q)
-    print "{0:s} : {1:d}, {2:d}, {3:d}".format(formatId, 
-                                               formats['formats'][formatId][2], 
-                                               formats['formats'][formatId][3],
-                                               formats['formats'][formatId][4] )
-
-
-def rc(row, col):
-  return "{0:s}{1:d}".format(get_column_letter(col), row)
-
-
-def getTotalsByType(formats, ctime=datetime.utcnow()):
   res = {'date:': ctime.strftime("%Y-%m-%d %H:%M:%S.0+00:00"),
          'total':0,
          'data':0,
@@ -195,68 +233,156 @@ def getTotalsByType(formats, ctime=datetime.utcnow()):
       res['resource'] += formats[formatId][2]
       res['resource_pub'] += formats[formatId][3]
       res['resource_pub_no'] += formats[formatId][4]
+  if not type_totals is None:
+    for col, suffix in [[3, '_pub'], [4, '_pub_no']]:
+      if not col in type_totals:
+        continue
+      total = 0
+      for ftype, key in [['DATA', 'data'],
+                         ['METADATA', 'metadata'],
+                         ['RESOURCE', 'resource']]:
+        n = type_totals[col].get(ftype, 0)
+        if n != res[key + suffix]:
+          logging.warn("{0}{1}: formatType total {2:d}, formats sum {3:d}"\
+                       .format(key, suffix, n, res[key + suffix]))
+        res[key + suffix] = n
+        total += n
+      res['total' + suffix] = total
   return res
 
 
-def populateWorksheet(ws, formats, label=''):
-  ws.cell('A1').value = "Summary"
-  ws.cell('B1').value = label
-  ws.cell('B2').value = "Data"
-  ws.cell('C2').value = "Metadata"
-  ws.cell('D2').value = "Resource"
-  ws.cell('E2').value = "Total"
-  ws.cell('F2').value = "pub_Data"
-  ws.cell('G2').value = "pub_Metadata"
-  ws.cell('H2').value = "pub_Resource"
-  ws.cell('I2').value = "pub_Total"
-  ws.cell('J2').value = "pubno_Data"
-  ws.cell('K2').value = "pubno_Metadata"
-  ws.cell('L2').value = "pubno_Resource"
-  ws.cell('M2').value = "pubno_Total"
-  ws.cell('A3').value = "Total"
-  
-  counts = getTotalsByType(formats['formats'])
-  crow = 3
-  for colname in counts['cols'].keys():
-    ws.cell('{0:s}{1:d}'.format(counts['cols'][colname], crow)).value = counts[colname]
-  
-  ws.cell('A5').value = "formatId"     #1
-  ws.cell('B5').value = "type"         #2
-  ws.cell('C5').value = "count"        #3
-  ws.cell('D5').value = "pub_count"    #4
-  ws.cell('E5').value = "pub_no_count" #5
-  crow = 6
-  for formatId in formats['formats'].keys():
-    ws.cell(rc(crow,1)).value = formatId
-    ws.cell(rc(crow,2)).value = formats['formats'][formatId][1]
-    ws.cell(rc(crow,3)).value = formats['formats'][formatId][2]
-    ws.cell(rc(crow,4)).value = formats['formats'][formatId][3]
-    ws.cell(rc(crow,5)).value = formats['formats'][formatId][4]
-    crow += 1
-
-
-def updateSummarySheet(ws, ctime, formats):
-  crow = ws.get_highest_row()
-  if crow == 1:
-    ws.cell("A1").value = "Date"
-    ws.cell('B1').value = "Data"
-    ws.cell('C1').value = "Metadata"
-    ws.cell('D1').value = "Resource"
-    ws.cell('E1').value = "Total"
-    ws.cell('F1').value = "pub_Data"
-    ws.cell('G1').value = "pub_Metadata"
-    ws.cell('H1').value = "pub_Resource"
-    ws.cell('I1').value = "pub_Total"
-    ws.cell('J1').value = "pubno_Data"
-    ws.cell('K1').value = "pubno_Metadata"
-    ws.cell('L1').value = "pubno_Resource"
-    ws.cell('M1').value = "pubno_Total"
-  crow = crow + 1
-  #ws.cell("A{0:d}".format(crow)).value = ctime.strftime("%Y-%m-%d")
-  ws.cell("A{0:d}".format(crow)).value = ctime
-  counts = getTotalsByType(formats['formats'])
-  for colname in counts['cols'].keys():
-    ws.cell('{0:s}{1:d}'.format(counts['cols'][colname], crow)).value = counts[colname]
+#Order of the count columns (B..M) in the Summary sheet and summary.csv
+SUMMARY_COLUMNS = [['data', 'Data'],
+                   ['metadata', 'Metadata'],
+                   ['resource', 'Resource'],
+                   ['total', 'Total'],
+                   ['data_pub', 'pub_Data'],
+                   ['metadata_pub', 'pub_Metadata'],
+                   ['resource_pub', 'pub_Resource'],
+                   ['total_pub', 'pub_Total'],
+                   ['data_pub_no', 'pubno_Data'],
+                   ['metadata_pub_no', 'pubno_Metadata'],
+                   ['resource_pub_no', 'pubno_Resource'],
+                   ['total_pub_no', 'pubno_Total'],
+                  ]
+DETAIL_COLUMNS = ["formatId", "type", "count", "pub_count", "pub_no_count"]
+STORE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def appendCounts(count_store, ctime, formats, detail=False):
+  '''Appends the totals for a run to summary.csv in the count_store folder and,
+  if detail is True, the per format counts to detail.csv. 
+  '''
+  if not os.path.isdir(count_store):
+    os.makedirs(count_store)
+  counts = getTotalsByType(formats['formats'],
+                           type_totals=formats.get('type_totals'))
+  tstamp = ctime.strftime(STORE_DATE_FORMAT)
+  fname = os.path.join(count_store, "summary.csv")
+  is_new = not os.path.exists(fname)
+  dest = file(fname, "ab")
+  writer = csv.writer(dest)
+  if is_new:
+    writer.writerow(["Date"] + [c[1] for c in SUMMARY_COLUMNS])
+  writer.writerow([tstamp] + [counts[c[0]] for c in SUMMARY_COLUMNS])
+  dest.close()
+  if detail:
+    fname = os.path.join(count_store, "detail.csv")
+    is_new = not os.path.exists(fname)
+    dest = file(fname, "ab")
+    writer = csv.writer(dest)
+    if is_new:
+      writer.writerow(["Date"] + DETAIL_COLUMNS)
+    for formatId in formats['formats'].keys():
+      row = formats['formats'][formatId]
+      writer.writerow([tstamp, formatId.encode("utf-8"), row[1], 
+                       row[2], row[3], row[4]])
+    dest.close()
+
+
+def _readStore(count_store, name):
+  fname = os.path.join(count_store, name)
+  if not os.path.exists(fname):
+    return
+  src = file(fname, "rb")
+  reader = csv.reader(src)
+  reader.next()
+  for row in reader:
+    yield [datetime.strptime(row[0], STORE_DATE_FORMAT)] + row[1:]
+  src.close()
+
+
+def exportWorkbook(count_store, store_file):
+  '''Writes the counts held in count_store to the spreadsheet store_file, 
+  streaming rows with a write-only workbook.
+  '''
+  wb = Workbook(write_only=True)
+  ws = wb.create_sheet(title="Summary")
+  ws.append(["Date"] + [c[1] for c in SUMMARY_COLUMNS])
+  totals = {}
+  for row in _readStore(count_store, "summary.csv"):
+    values = [int(v) for v in row[1:]]
+    ws.append([row[0]] + values)
+    totals[row[0]] = dict(zip([c[0] for c in SUMMARY_COLUMNS], values))
+  #One sheet per detail run, in the layout of the original detail sheets
+  ws = None
+  ctime = None
+  for row in _readStore(count_store, "detail.csv"):
+    if row[0] != ctime:
+      ctime = row[0]
+      ws = wb.create_sheet(title=ctime.strftime("%Y-%m-%d"))
+      label = "Sheet generated at: {0:s}".format(ctime.strftime("%Y-%m-%d %H:%M:%S.0+00:00"))
+      ws.append(["Summary", label])
+      ws.append([None] + [c[1] for c in SUMMARY_COLUMNS])
+      ws.append(["Total"] + [totals.get(ctime, {}).get(c[0]) 
+                             for c in SUMMARY_COLUMNS])
+      ws.append([])
+      ws.append(DETAIL_COLUMNS)
+    ws.append([row[1].decode("utf-8"), row[2]] + [int(v) for v in row[3:]])
+  wb.save(store_file)
+
+
+def importWorkbook(store_file, count_store):
+  '''Seeds an empty count_store from an existing spreadsheet written by 
+  earlier versions of this script.
+  '''
+  wb = load_workbook(filename=store_file, read_only=True)
+  if not os.path.isdir(count_store):
+    os.makedirs(count_store)
+  dest = file(os.path.join(count_store, "summary.csv"), "wb")
+  writer = csv.writer(dest)
+  writer.writerow(["Date"] + [c[1] for c in SUMMARY_COLUMNS])
+  ws = wb["Summary"]
+  for row in list(ws.rows)[1:]:
+    values = [cell.value for cell in row]
+    if len(values) < 13 or not isinstance(values[0], datetime):
+      continue
+    writer.writerow([values[0].strftime(STORE_DATE_FORMAT)] + values[1:13])
+  dest.close()
+  dest = file(os.path.join(count_store, "detail.csv"), "wb")
+  writer = csv.writer(dest)
+  writer.writerow(["Date"] + DETAIL_COLUMNS)
+  for name in wb.sheetnames:
+    if name == "Summary":
+      continue
+    try:
+      ctime = datetime.strptime(name, "%Y-%m-%d")
+    except ValueError:
+      continue
+    rows = list(wb[name].rows)
+    #B1 holds the time the sheet was generated
+    label = None
+    if len(rows) > 0 and len(rows[0]) > 1:
+      label = rows[0][1].value
+    if not label is None and label.startswith("Sheet generated at: "):
+      ctime = datetime.strptime(label[20:39], "%Y-%m-%d %H:%M:%S")
+    for row in rows[5:]:
+      values = [cell.value for cell in row]
+      if len(values) < 5 or values[0] is None:
+        continue
+      writer.writerow([ctime.strftime(STORE_DATE_FORMAT), 
+                       values[0].encode("utf-8")] + values[1:5])
+  dest.close()
 
 
 def generateHtml(fnDest, formats, template_source):
@@ -265,7 +391,8 @@ def generateHtml(fnDest, formats, template_source):
   import locale
   locale.setlocale(locale.LC_ALL, 'en_US.utf8')
   #get counts
-  counts = getTotalsByType(formats['formats'])
+  counts = getTotalsByType(formats['formats'],
+                           type_totals=formats.get('type_totals'))
   #create string representations for substitution
   scounts = {}
   for k in counts.keys():
@@ -280,7 +407,8 @@ def generateHtml(fnDest, formats, template_source):
   fout.close()
 
 
-def getObjectCounts(base_url, cache_name=None, try_cache=True):
+def getObjectCounts(base_url, cache_name=None, try_cache=True, max_workers=10,
+                    pool=None, metadata=None):
   formats = None
   if try_cache:
     if not cache_name is None:
@@ -293,8 +421,11 @@ def getObjectCounts(base_url, cache_name=None, try_cache=True):
         return formats
       except:
         logging.info("Failed to load from cache.")
-  formats = getObjectFormats(base_url)
-  countObjects(base_url, formats)
+  if pool is None:
+    pool = ConnectionPool(base_url)
+  formats = getObjectFormats(base_url, metadata=metadata, pool=pool)
+  countObjects(base_url, formats, pool=pool, max_workers=max_workers)
+  logging.info("Connections: {0}".format(pool.getStats()))
   return formats
 
 
@@ -304,6 +435,67 @@ def saveObjectCounts(formats, cache_name):
   dst.close()
 
 
+def loadConfig(config_file):
+  '''Returns the plotcounts settings from the YAML config_file, with defaults
+  for those not set.
+  '''
+  config = load(file(config_file, 'r'), Loader=Loader)
+  res = {}
+  res['store_file'] = os.path.join(os.environ['HOME'], ".dataone/plotcounts/plotcounts.xlsx")
+  try:
+    res['store_file'] = config['plotcounts']['store_file']
+  except KeyError:
+    pass
+  res['pickle_file'] = os.path.join(os.environ['HOME'], ".dataone/plotcounts/.objectcounts.pickle")
+  try:
+    res['pickle_file'] = config['plotcounts']['pickle_file']
+  except KeyError:
+    pass
+  res['base_url'] = "https://cn.dataone.org/cn"
+  try:
+    res['base_url'] = config['plotcounts']['base_url']
+  except KeyError:
+    pass
+  res['html_dest'] = os.path.join(os.environ['HOME'], ".dataone/plotcounts/objectcounts.html")
+  try:
+    res['html_dest'] = config['plotcounts']['html_dest']
+  except KeyError:
+    pass
+  res['html_template'] = os.path.join(os.environ['HOME'], ".dataone/plotcounts/objectcounts.template")
+  try:
+    res['html_template'] = config['plotcounts']['html_template']
+  except KeyError:
+    pass
+  res['count_store'] = os.path.join(os.environ['HOME'], ".dataone/plotcounts/objectcounts")
+  try:
+    res['count_store'] = config['plotcounts']['count_store']
+  except KeyError:
+    pass
+  return res
+
+
+def main(config, detail=False, try_cache=False, max_workers=10, export=False,
+         pool=None, metadata=None):
+  '''Counts objects, appends the counts to the count store and generates the
+  HTML summary. pool and metadata may be provided to reuse connections and
+  the registry cache across runs, e.g. by collector.py.
+  '''
+  #Seed the count history from the spreadsheet if starting afresh
+  if not os.path.exists(os.path.join(config['count_store'], "summary.csv")) and \
+     os.path.exists(config['store_file']):
+    logging.info("Importing count history from {0:s}".format(config['store_file']))
+    importWorkbook(config['store_file'], config['count_store'])
+
+  ctime = datetime.utcnow()
+  formats = getObjectCounts( config['base_url'], config['pickle_file'], try_cache,
+                             max_workers=max_workers, pool=pool,
+                             metadata=metadata )
+  saveObjectCounts( formats, config['pickle_file'] )
+  appendCounts(config['count_store'], ctime, formats, detail=detail)
+  if export:
+    exportWorkbook(config['count_store'], config['store_file'])
+  generateHtml(config['html_dest'], formats, config['html_template'])
+
 
 if __name__ == "__main__": 
   CONFIG = os.path.join(os.environ['HOME'],".dataone/cache.conf")
@@ -320,6 +512,12 @@ if __name__ == "__main__":
   parser.add_option("-x","--nodownload", dest="doDownload",
                     help="Don't download new data if a cache is available (False)",
                     default=False, action="store_true")
+  parser.add_option("-w","--workers", dest="workers",
+                    help="Number of concurrent listObjects requests (10)",
+                    default=10, type="int")
+  parser.add_option("-e","--export", dest="doExport",
+                    help="Write the count history to the spreadsheet (False)",
+                    default=False, action="store_true")
   (options, args) = parser.parse_args()
   if options.loglevel < 1:
     options.loglevel = 1
@@ -327,58 +525,10 @@ if __name__ == "__main__":
     options.loglevel = 5   
   logging.basicConfig(level=10*options.loglevel)
 
-  doDetail = options.doDetail
-  config = load(file(options.config, 'r'), Loader=Loader)
-  store_file = os.path.join(os.environ['HOME'], ".dataone/plotcounts/plotcounts.xlsx")
-  try:
-    store_file = config['plotcounts']['store_file']
-  except KeyError:
-    pass
-  pickle_file = os.path.join(os.environ['HOME'], ".dataone/plotcounts/.objectcounts.pickle")
-  try:
-    pickle_file = config['plotcounts']['pickle_file']
-  except KeyError:
-    pass
-  base_url = "https://cn.dataone.org/cn"
-  try:
-    base_url = config['plotcounts']['base_url']
-  except KeyError:
-    pass
-  html_dest = os.path.join(os.environ['HOME'], ".dataone/plotcounts/objectcounts.html")
-  try:
-    html_dest = config['plotcounts']['html_dest']
-  except KeyError:
-    pass
-  html_template = os.path.join(os.environ['HOME'], ".dataone/plotcounts/objectcounts.template")
-  try:
-    html_template = config['plotcounts']['html_template']
-  except KeyError:
-    pass
-  
-
-  #Open the spreadsheet if available, otherwise create one.
-  wb = None
-  try:
-    wb = load_workbook(filename = store_file)
-  except:
-    wb = Workbook()
-
-  ctime = datetime.utcnow()
-  formats = getObjectCounts( base_url, pickle_file, options.doDownload )
-  saveObjectCounts( formats, pickle_file )
-  
-  summarysheet = None
-  try:
-    summarysheet = wb.get_sheet_by_name("Summary")
-  except:
-    summarysheet = create_sheet(0)
-    summarysheet.title = "Summary"
-  updateSummarySheet(summarysheet, ctime, formats)
-  if doDetail:
-    ws = wb.create_sheet()
-    ws.title = ctime.strftime("%Y-%m-%d")
-    label = "Sheet generated at: {0:s}".format(ctime.strftime("%Y-%m-%d %H:%M:%S.0+00:00"))
-    populateWorksheet(ws, formats, label=label)
-  wb.save( filename = store_file)
-  generateHtml(html_dest, formats, html_template)
+  config = loadConfig(options.config)
+  main(config,
+       detail=options.doDetail,
+       try_cache=options.doDownload,
+       max_workers=options.workers,
+       export=options.doExport)
   print "Done."
@@ -17,8 +17,15 @@ function main {
     generatePlot
 }
 
-# Iterate over NDAYS days and get a package count for each day
+# Build the data file for every day since 2012-06-10 from a few range faceted
+# SOLR queries, see get_state.py --history
 function buildDataFile {
+    python $(dirname $0)/src/get_state.py -l 3 --history $DFILE
+}
+
+# Iterate over NDAYS days and get a package count for each day, one request 
+# per day. Slow, kept for comparison with buildDataFile
+function buildDataFileCurl {
     echo "day | count" > $DFILE
     for (( d=0; d<=$NDAYS; d++ )); do 
         D=$(expr $NDAYS - $d)
@@ -0,0 +1,165 @@
+'''
+Offline benchmark of the state collection code against the local stand-in CN
+(d1state.standin).
+
+Each phase of EnvironmentState.populateState is timed on its own, followed by
+a complete populateState, the log history retrieval used by
+get_state.py --logsummary and the counting done by objectcounts.py. For each
+phase the wall time, number of requests served and response bytes are
+reported. Runs with the same options are repeatable, so results can be
+compared before and after a change, e.g.::
+
+  python benchmark.py -f 500 -n 40 -t 0.05
+  python benchmark.py -F 0.05 -D 2 -j > results.json
+'''
+
+import os
+import sys
+import time
+import json
+import shutil
+import logging
+import tempfile
+from optparse import OptionParser
+from d1state.system_state import EnvironmentState
+from d1state.metadata_cache import MetadataCache
+from d1state.standin import StandInServer
+from d1state import mjd
+
+
+class BenchmarkState(EnvironmentState):
+  '''EnvironmentState that skips DNS lookups, the stand-in is only reachable
+  by address.
+  '''
+
+  def getDNSInfo(self):
+    return {}
+
+
+
+def newState(server, cache_folder):
+  return BenchmarkState(server.baseurl,
+                        metadata_cache=MetadataCache(server.baseurl,
+                                                     folder=cache_folder))
+
+
+def runPhase(server, name, func):
+  '''Runs func and returns [name, seconds, requests, bytes, failures].
+  '''
+  server.resetStats()
+  t0 = time.time()
+  try:
+    func()
+  except Exception as e:
+    logging.error("Phase {0} failed: {1}".format(name, e))
+  elapsed = time.time() - t0
+  stats = server.getStats()
+  return [name, elapsed, stats['requests'], stats['bytes'], stats['failures']]
+
+
+def objectCountsPhase(server):
+  '''Returns the objectcounts.py counting function bound to the stand-in, or
+  None if objectcounts.py cannot be imported.
+  '''
+  sys.path.insert(0, os.path.dirname(os.path.dirname(
+                                     os.path.abspath(__file__))))
+  try:
+    import objectcounts
+  except ImportError as e:
+    logging.warn("Skipping objectcounts: {0}".format(e))
+    return None
+
+  def _run():
+    formats = {'formats': {}}
+    for fmt in server.data.formats:
+      formats['formats'][fmt[0]] = ["Stand-in", fmt[1], 0, 0, 0]
+    objectcounts.countObjects(server.baseurl, formats)
+  return _run
+
+
+def runBenchmark(server, days=30):
+  '''Returns the results of runPhase for each benchmarked phase.
+  '''
+  cache_folder = tempfile.mkdtemp()
+  try:
+    state = newState(server, cache_folder)
+    state.state['meta'] = {'count_meta': {0: 'ALL',
+                                          1: EnvironmentState.COUNT_PUBLIC,
+                                          2: EnvironmentState.COUNT_PUBLIC_CURRENT}}
+    #the phases of populateState, one after another in dependency order
+    results = []
+    for name, func, deps in state._statePhases():
+      results.append(runPhase(server, name, func))
+    #complete run with a cold metadata cache
+    shutil.rmtree(cache_folder)
+    full = newState(server, cache_folder)
+    results.append(runPhase(server, 'populateState', full.populateState))
+    tnow = mjd.now()
+    history = [float(d) for d in xrange(int(tnow) - days, int(tnow))]
+    results.append(runPhase(server, 'logHistory',
+                            lambda: full.getLogHistory(history)))
+    counter = objectCountsPhase(server)
+    if not counter is None:
+      results.append(runPhase(server, 'objectcounts', counter))
+    return results
+  finally:
+    shutil.rmtree(cache_folder, ignore_errors=True)
+
+
+def formatResults(results):
+  rows = ["{0:<16s} {1:>10s} {2:>10s} {3:>12s} {4:>9s}".format("phase",
+                                                              "seconds",
+                                                              "requests",
+                                                              "bytes",
+                                                              "failures")]
+  for name, elapsed, requests, nbytes, failures in results:
+    rows.append("{0:<16s} {1:>10.3f} {2:>10d} {3:>12d} {4:>9d}"\
+                .format(name, elapsed, requests, nbytes, failures))
+  return "\n".join(rows)
+
+
+#===============================================================================
+if __name__ == "__main__":
+  parser = OptionParser()
+  parser.add_option("-l","--log",dest="loglevel",
+                    help="1=DEBUG, 2=INFO, 3=WARN, 4=ERROR, 5=FATAL",
+                    default=3, type="int")
+  parser.add_option("-f","--formats", dest="nformats", default=100,
+                    type="int", help="Number of object formats (100)")
+  parser.add_option("-n","--nodes", dest="nnodes", default=20, type="int",
+                    help="Number of member nodes (20)")
+  parser.add_option("-t","--latency", dest="latency", default=0.0,
+                    type="float", help="Seconds added to each response (0)")
+  parser.add_option("-F","--failure-rate", dest="failure_rate", default=0.0,
+                    type="float", help="Fraction of CN responses that fail (0)")
+  parser.add_option("-X","--drop-rate", dest="drop_rate", default=0.0,
+                    type="float",
+                    help="Fraction of CN connections dropped (0)")
+  parser.add_option("-D","--dead-nodes", dest="dead_nodes", default=0,
+                    type="int", help="Number of unresponsive member nodes (0)")
+  parser.add_option("-d","--days", dest="days", default=30, type="int",
+                    help="Days of log history retrieved (30)")
+  parser.add_option("-s","--seed", dest="seed", default=1, type="int",
+                    help="Seed for the stand-in content and failures (1)")
+  parser.add_option("-j","--json", dest="as_json", default=False,
+                    action="store_true", help="Write results as JSON")
+  (options, args) = parser.parse_args()
+  options.loglevel = min(5, max(1, options.loglevel))
+  logging.basicConfig(level=10*options.loglevel)
+  server = StandInServer(nformats=options.nformats,
+                         nnodes=options.nnodes,
+                         latency=options.latency,
+                         failure_rate=options.failure_rate,
+                         drop_rate=options.drop_rate,
+                         dead_nodes=options.dead_nodes,
+                         seed=options.seed)
+  server.start()
+  try:
+    results = runBenchmark(server, days=options.days)
+  finally:
+    server.stop()
+  if options.as_json:
+    print json.dumps({'options': options.__dict__,
+                      'results': results}, indent=2)
+  else:
+    print formatResults(results)
@@ -0,0 +1,276 @@
+'''
+Collector daemon running the nightly collection jobs in one long running
+process instead of separate cron entries.
+
+Jobs:
+
+:state: get_state.py, a snapshot appended to the store and the web UI views
+:loghistory: get_state.py --update of the log history CSV (if configured)
+:objectcounts: objectcounts.py, with --detail on the detail_weekdays and
+               --export on the export_weekdays
+:registries: copies of the node and format registries, as done by
+             get_production_info.sh (if configured)
+
+plus any external commands listed in the configuration, e.g. getlogcounts.sh.
+
+The connection pools, metadata caches, object tally and snapshot store are
+created once and shared by all runs, so interpreter start up, imports,
+connections and parsed registries are not paid for on every run. Jobs run
+one at a time, staggered by d1state.scheduler.Scheduler, and their next and
+last run times and durations are written to the status file.
+
+Configuration is read from the collector section of ~/.dataone/cache.conf,
+next to the state and plotcounts sections used by the jobs, e.g.::
+
+  collector:
+    status: /home/vieglais/.dataone/collector.json
+    stagger: 300
+    loghistory: /home/vieglais/sync/production_history/data/production_log_history.csv
+    registries: /home/vieglais/sync/production_history/history
+    detail_weekdays: [4]
+    export_weekdays: [4]
+    jobs:
+      state: "05:07"
+      objectcounts: "05:17"
+    commands:
+      logcounts:
+        command: /home/vieglais/logcounts/getlogcounts.sh
+        every: 3600
+
+Jobs default to DEFAULT_TIME and are run in the order listed in JOBS when
+due together. A job set to null in jobs is disabled. Run with -r JOB to run
+a single job now and exit, or -s to print the status file.
+'''
+
+import os
+import sys
+import shutil
+import signal
+import logging
+import datetime
+import threading
+import subprocess
+from yaml import load, Loader
+from optparse import OptionParser
+import get_state
+from d1state.connections import ConnectionPool
+from d1state.metadata_cache import MetadataCache
+from d1state.object_tally import ObjectTally
+from d1state.scheduler import Job, Scheduler
+
+#Built in jobs, in the order they run when due at the same time
+JOBS = ['state', 'loghistory', 'objectcounts', 'registries']
+#Local time at which the built in jobs are due unless configured
+DEFAULT_TIME = "05:00"
+#objectcounts runs with --detail on these weekdays (0 = Monday)
+DETAIL_WEEKDAYS = [4]
+#and writes the count history spreadsheet (--export) on these
+EXPORT_WEEKDAYS = [4]
+
+
+def loadConfig(config_file):
+  '''Returns the collector settings from the YAML config_file, with defaults
+  for those not set.
+  '''
+  config = {}
+  try:
+    config = load(file(config_file, 'r'), Loader=Loader)
+  except:
+    logging.info("Error loading config file: {0:s}".format(config_file))
+  section = {}
+  try:
+    section = config['collector'] or {}
+  except (KeyError, TypeError):
+    pass
+  res = {}
+  res['status'] = section.get('status',
+                              os.path.join(os.environ['HOME'],
+                                           ".dataone/collector.json"))
+  res['stagger'] = section.get('stagger', Scheduler.STAGGER)
+  res['loghistory'] = section.get('loghistory', None)
+  res['registries'] = section.get('registries', None)
+  res['detail_weekdays'] = section.get('detail_weekdays', DETAIL_WEEKDAYS)
+  res['export_weekdays'] = section.get('export_weekdays', EXPORT_WEEKDAYS)
+  res['jobs'] = {}
+  for name in JOBS:
+    res['jobs'][name] = DEFAULT_TIME
+  res['jobs'].update(section.get('jobs') or {})
+  res['commands'] = section.get('commands') or {}
+  return res
+
+
+class Collector(object):
+  '''Holds the clients and caches shared by the collection jobs.
+  '''
+
+  def __init__(self, config_file):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.config = loadConfig(config_file)
+    self.state_config = get_state.loadConfig(config_file)
+    self.objectcounts_config = None
+    try:
+      sys.path.insert(0, os.path.dirname(os.path.dirname(
+                                         os.path.abspath(__file__))))
+      import objectcounts
+      self.objectcounts = objectcounts
+      self.objectcounts_config = objectcounts.loadConfig(config_file)
+    except (ImportError, IOError) as e:
+      self.log.warn("objectcounts is not available: {0}".format(e))
+    #base url: ConnectionPool or MetadataCache
+    self._pools = {}
+    self._metadata = {}
+    self.tally = None
+    if not self.state_config['tallyfolder'] is None:
+      self.tally = ObjectTally(self.state_config['tallyfolder'])
+    self._store = None
+
+
+  def pool(self, baseurl):
+    if not baseurl in self._pools:
+      self._pools[baseurl] = ConnectionPool(baseurl)
+    return self._pools[baseurl]
+
+
+  def metadata(self, baseurl):
+    if not baseurl in self._metadata:
+      self._metadata[baseurl] = MetadataCache(baseurl,
+                                              ttl=self.state_config['metadatattl'],
+                                              pool=self.pool(baseurl))
+    return self._metadata[baseurl]
+
+
+  def store(self):
+    if self._store is None:
+      get_state.mkdir_p(self.state_config['statefolder'])
+      self._store = get_state.openStore(self.state_config)
+    return self._store
+
+
+  def close(self):
+    '''Closes the kept-alive connections of the shared pools.
+    '''
+    for pool in self._pools.itervalues():
+      pool.close()
+
+
+  def newEnvironmentState(self):
+    baseurl = self.state_config['baseurl']
+    return get_state.newEnvironmentState(self.state_config,
+                                         pool=self.pool(baseurl),
+                                         metadata=self.metadata(baseurl),
+                                         tally=self.tally)
+
+
+  def runState(self):
+    get_state.main(self.state_config,
+                   envstate=self.newEnvironmentState(),
+                   store=self.store())
+
+
+  def runLogHistory(self):
+    get_state.updateLogHistory(self.state_config, self.config['loghistory'],
+                               envstate=self.newEnvironmentState())
+
+
+  def runObjectCounts(self):
+    weekday = datetime.datetime.now().weekday()
+    baseurl = self.objectcounts_config['base_url']
+    self.objectcounts.main(self.objectcounts_config,
+                           detail=weekday in self.config['detail_weekdays'],
+                           export=weekday in self.config['export_weekdays'],
+                           pool=self.pool(baseurl),
+                           metadata=self.metadata(baseurl))
+
+
+  def runRegistries(self):
+    metadata = self.metadata(self.state_config['baseurl'])
+    get_state.mkdir_p(self.config['registries'])
+    dest = os.path.join(self.config['registries'],
+                        datetime.datetime.now().strftime("%Y%m%d"))
+    for name in ['nodes', 'formats']:
+      shutil.copyfile(metadata.getPath(name),
+                      "{0}_{1}.xml".format(dest, name))
+
+
+  def commandJob(self, command):
+    def _run():
+      res = subprocess.call(command, shell=True)
+      if res != 0:
+        raise RuntimeError("{0} exited with {1}".format(command, res))
+    return _run
+
+
+  def jobs(self):
+    '''Returns the configured Jobs.
+    '''
+    funcs = {'state': self.runState,
+             'loghistory': self.runLogHistory,
+             'objectcounts': self.runObjectCounts,
+             'registries': self.runRegistries, }
+    res = []
+    for name in JOBS:
+      at = self.config['jobs'].get(name)
+      if at is None:
+        continue
+      if name == 'loghistory' and self.config['loghistory'] is None:
+        continue
+      if name == 'registries' and self.config['registries'] is None:
+        continue
+      if name == 'objectcounts' and self.objectcounts_config is None:
+        continue
+      res.append(Job(name, funcs[name], at=str(at)))
+    for name, entry in sorted(self.config['commands'].iteritems()):
+      res.append(Job(name, self.commandJob(entry['command']),
+                     at=entry.get('at'),
+                     every=entry.get('every'),
+                     weekdays=entry.get('weekdays')))
+    return res
+
+
+#===============================================================================
+if __name__ == "__main__":
+  CONFIG = os.path.join(os.environ['HOME'],".dataone/cache.conf")
+  parser = OptionParser()
+  parser.add_option("-l","--log",dest="loglevel",
+                    help="1=DEBUG, 2=INFO, 3=WARN, 4=ERROR, 5=FATAL",
+                    default=2, type="int")
+  parser.add_option("-c","--config", dest="config",
+                    help="Path to configuration file ({0:s})".format(CONFIG),
+                    default=CONFIG)
+  parser.add_option("-r","--run", dest="run_job",
+                    help="Run the named job now and exit",
+                    default=None)
+  parser.add_option("-s","--status", dest="show_status",
+                    help="Print the status file and exit",
+                    default=False, action="store_true")
+  (options, args) = parser.parse_args()
+  if options.loglevel < 1:
+    options.loglevel = 1
+  if options.loglevel > 5:
+    options.loglevel = 5
+  logging.basicConfig(level=10*options.loglevel,
+                      format="%(asctime)s %(name)s %(levelname)s %(message)s")
+  if options.show_status:
+    print file(loadConfig(options.config)['status'], "r").read()
+    sys.exit(0)
+  collector = Collector(options.config)
+  scheduler = Scheduler(status_path=collector.config['status'],
+                        stagger=collector.config['stagger'])
+  for job in collector.jobs():
+    scheduler.add(job)
+  if not options.run_job is None:
+    jobs = [job for job in scheduler.jobs if job.name == options.run_job]
+    if len(jobs) == 0:
+      parser.error("Unknown job {0}".format(options.run_job))
+    sys.exit(0 if scheduler.runJob(jobs[0], merge=True) else 1)
+  stop = threading.Event()
+
+  def _stop(signum, frame):
+    logging.info("Stopping after the current job")
+    stop.set()
+  signal.signal(signal.SIGTERM, _stop)
+  signal.signal(signal.SIGINT, _stop)
+  try:
+    scheduler.run(stop=stop)
+  finally:
+    collector.close()
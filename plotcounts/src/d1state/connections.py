@@ -0,0 +1,233 @@
+'''
+Shared, keep-alive connections to a Coordinating Node.
+
+A ConnectionPool keeps idle d1_client instances per API version. Each call
+made through the pool checks out an idle client (creating one only if none
+is free) and returns it when the call completes, or for GET when the response
+body has been read, so the pool holds as many clients as there were
+concurrent calls. A GET response that is never read to the end keeps its
+client, which is then simply dropped. Clients are not tied to the calling
+thread and keep their HTTP connections open, so requests from worker threads,
+and from later runs using the same pool (e.g. collector.py), reuse the same
+TCP / TLS sessions.
+
+Calls made through the pool are retried once on a fresh connection when the
+kept-alive socket turns out to be stale (e.g. BadStatusLine after the CN
+closed it). Other transient failures are retried with backoff by the pool's
+Resilience instance, with statistics kept per call site (the client method,
+or the REST path for GET requests such as "query/solr").
+'''
+
+import logging
+import threading
+import socket
+import errno
+import httplib
+import urlparse
+from d1_client import cnclient, cnclient_1_1
+from d1state.resilience import Resilience, ServerError, hostOf
+from d1state.instrumentation import RequestStats, CountingResponse
+
+#Errors that indicate the kept-alive connection was dropped by the server
+STALE_CONNECTION_ERRORS = (httplib.BadStatusLine,
+                           httplib.CannotSendRequest,
+                           httplib.ResponseNotReady, )
+STALE_SOCKET_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED, )
+
+
+class PooledClient(object):
+  '''Proxy for the d1_client instances of one API version that routes public
+  method calls through the owning ConnectionPool.
+  '''
+
+  def __init__(self, pool, version):
+    self._pool = pool
+    self._version = version
+
+
+  def __getattr__(self, name):
+    client = self._pool._checkout(self._version)
+    try:
+      attr = getattr(client, name)
+    finally:
+      self._pool._release(self._version, client)
+    if name.startswith('_') or not callable(attr):
+      return attr
+    def _call(*args, **kwargs):
+      return self._pool.invoke(self._version, name, *args, **kwargs)
+    return _call
+
+
+
+class ConnectionPool(object):
+  CLIENT_CLASSES = {'v1': cnclient.CoordinatingNodeClient,
+                    'v1.1': cnclient_1_1.CoordinatingNodeClient, }
+  #Breaker limits for the CN. Concurrent phases all call the CN, so a short
+  #outage fails several calls at once; a higher threshold rides that out and
+  #a short reset lets a trial call close the breaker within the same run.
+  CN_FAILURE_THRESHOLD = 10
+  CN_RESET_AFTER = 30.0
+
+  def __init__(self, baseurl, cert_path=None, resilience=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.baseurl = baseurl
+    self.cert_path = cert_path
+    self.host = hostOf(baseurl)
+    self.resilience = resilience
+    if self.resilience is None:
+      self.resilience = Resilience(instrumentation=RequestStats())
+    #per endpoint timings, None if the resilience layer was given without
+    self.instrumentation = self.resilience.instrumentation
+    self.resilience.configureHost(self.host,
+                                  ConnectionPool.CN_FAILURE_THRESHOLD,
+                                  ConnectionPool.CN_RESET_AFTER)
+    #version: [idle d1_client instances]
+    self._idle = {}
+    #version: PooledClient
+    self._proxies = {}
+    self._lock = threading.Lock()
+    self._stats = {'clients': 0,
+                   'requests': 0,
+                   'connections_created': 0,
+                   'connections_reused': 0,
+                   'reconnects': 0, }
+
+
+  def _count(self, key, n=1):
+    with self._lock:
+      self._stats[key] += n
+
+
+  def client(self, version='v1'):
+    '''Returns the client for version ("v1" or "v1.1"). It may be shared
+    between threads, each call uses a client checked out from the pool.
+    '''
+    with self._lock:
+      if not version in self._proxies:
+        self._proxies[version] = PooledClient(self, version)
+      return self._proxies[version]
+
+
+  def _checkout(self, version):
+    with self._lock:
+      idle = self._idle.setdefault(version, [])
+      if len(idle) > 0:
+        return idle.pop()
+      self._stats['clients'] += 1
+    self.log.debug("New {0} client for {1}".format(version, self.baseurl))
+    return ConnectionPool.CLIENT_CLASSES[version](self.baseurl,
+                                                  cert_path=self.cert_path)
+
+
+  def _release(self, version, client):
+    with self._lock:
+      self._idle.setdefault(version, []).append(client)
+
+
+  def close(self):
+    '''Closes the connections of the idle clients.
+    '''
+    with self._lock:
+      idle = self._idle
+      self._idle = {}
+    for clients in idle.itervalues():
+      for client in clients:
+        self._closeConnection(client)
+
+
+  def _isConnected(self, client):
+    conn = getattr(client, 'connection', None)
+    return not conn is None and not getattr(conn, 'sock', None) is None
+
+
+  def _closeConnection(self, client):
+    conn = getattr(client, 'connection', None)
+    if not conn is None:
+      conn.close()
+
+
+  def _callSite(self, client, name, args):
+    '''Returns the call site name used for retry statistics.
+    '''
+    if name in ('GET', 'POST', 'PUT', 'DELETE', 'HEAD') and len(args) > 0:
+      path = urlparse.urlparse(args[0]).path
+      base = urlparse.urlparse(self.baseurl).path.rstrip('/')
+      path = path[len(base):].strip('/')
+      #drop the API version, e.g. v1/query/solr -> query/solr
+      parts = path.split('/')
+      if len(parts) > 1 and parts[0].startswith('v'):
+        parts = parts[1:]
+      return '/'.join(parts)
+    return name
+
+
+  def invoke(self, version, name, *args, **kwargs):
+    '''Calls name(*args, **kwargs) on a client for version checked out from
+    the pool, through self.resilience, retrying transient failures with
+    backoff. A GET answered with a 5xx status raises ServerError, so it is
+    retried too. Responses to GET are wrapped so that the bytes read are
+    recorded with self.instrumentation and the client is returned to the
+    pool once the response has been read.
+    '''
+    client = self._checkout(version)
+    site = self._callSite(client, name, args)
+    try:
+      res = self.resilience.call(site, self.host, self._invokeChecked, client,
+                                 name, *args, **kwargs)
+    except Exception:
+      self._release(version, client)
+      raise
+    if name == 'GET':
+      return CountingResponse(res, self.instrumentation, site,
+                              on_done=lambda: self._release(version, client))
+    self._release(version, client)
+    return res
+
+
+  def _invokeChecked(self, client, name, *args, **kwargs):
+    res = self._invokeOnce(client, name, *args, **kwargs)
+    if name == 'GET' and res.status >= 500:
+      #read the body so the connection can be used for the retry
+      res.read()
+      raise ServerError(res.status, args[0])
+    return res
+
+
+  def _invokeOnce(self, client, name, *args, **kwargs):
+    '''Calls client.name(*args, **kwargs), retrying once on a new connection
+    if the existing one is found to be stale.
+    '''
+    method = getattr(client, name)
+    self._count('requests')
+    if self._isConnected(client):
+      self._count('connections_reused')
+    else:
+      self._count('connections_created')
+    try:
+      return method(*args, **kwargs)
+    except STALE_CONNECTION_ERRORS as e:
+      self.log.warn("Stale connection on {0}: {1}".format(name, repr(e)))
+    except socket.error as e:
+      if not getattr(e, 'errno', None) in STALE_SOCKET_ERRNOS:
+        #start the next attempt on a fresh connection
+        self._closeConnection(client)
+        raise
+      self.log.warn("Stale connection on {0}: {1}".format(name, repr(e)))
+    self._closeConnection(client)
+    self._count('reconnects')
+    self._count('connections_created')
+    try:
+      return method(*args, **kwargs)
+    except (httplib.HTTPException, socket.error):
+      self._closeConnection(client)
+      raise
+
+
+  def getStats(self):
+    '''Returns a copy of the connection counters, with the number of idle
+    clients.
+    '''
+    with self._lock:
+      res = dict(self._stats)
+      res['idle'] = sum([len(v) for v in self._idle.itervalues()])
+      return res
@@ -0,0 +1,23 @@
+'''
+Atomic replacement of the files written by the state collection, so that
+readers such as the web UI, rsync or the node_exporter textfile collector
+never see a partially written file.
+'''
+
+import os
+
+
+def writeAtomic(path, content, sync=False):
+  '''Replaces path with content by writing path.tmp and renaming it over
+  path. With sync the content is also flushed to disk before the rename.
+  '''
+  tmppath = path + ".tmp"
+  dest = file(tmppath, "wb")
+  try:
+    dest.write(content)
+    if sync:
+      dest.flush()
+      os.fsync(dest.fileno())
+  finally:
+    dest.close()
+  os.rename(tmppath, path)
@@ -0,0 +1,175 @@
+'''
+Request instrumentation for the state collector.
+
+RequestStats accumulates, per endpoint (the call site names used by
+d1state.resilience, e.g. "query/solr" or "mn.listObjects"), the number of
+requests and retries, the time spent, the response bytes read and the errors
+by exception type. EnvironmentState.populateState stores these together with
+the duration of each phase in state['meta']['timings'], which writePrometheus
+renders in the Prometheus text exposition format for the node_exporter
+textfile collector.
+'''
+
+import time
+import threading
+from d1state.fileio import writeAtomic
+
+
+class RequestStats(object):
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.reset()
+
+
+  def reset(self):
+    with self._lock:
+      self._endpoints = {}
+
+
+  def _endpoint(self, site):
+    if not site in self._endpoints:
+      self._endpoints[site] = {'requests': 0,
+                               'retries': 0,
+                               'seconds': 0.0,
+                               'bytes': 0,
+                               'errors': {}, }
+    return self._endpoints[site]
+
+
+  def request(self, site, seconds, error=None):
+    '''Records a single attempt against site that took seconds. error is the
+    exception raised, if any.
+    '''
+    with self._lock:
+      stats = self._endpoint(site)
+      stats['requests'] += 1
+      stats['seconds'] += seconds
+      if not error is None:
+        name = error.__class__.__name__
+        stats['errors'][name] = stats['errors'].get(name, 0) + 1
+
+
+  def retry(self, site):
+    with self._lock:
+      self._endpoint(site)['retries'] += 1
+
+
+  def read(self, site, nbytes, seconds):
+    '''Records nbytes of response body read from site in seconds.
+    '''
+    with self._lock:
+      stats = self._endpoint(site)
+      stats['bytes'] += nbytes
+      stats['seconds'] += seconds
+
+
+  def getStats(self):
+    '''Returns {endpoint: {'requests', 'retries', 'seconds', 'bytes',
+    'errors': {exception name: count}}}.
+    '''
+    with self._lock:
+      res = {}
+      for site, stats in self._endpoints.iteritems():
+        res[site] = dict(stats)
+        res[site]['errors'] = dict(stats['errors'])
+      return res
+
+
+
+class CountingResponse(object):
+  '''Wraps an HTTP response, recording the bytes and time spent reading its
+  body with RequestStats.read (unless stats is None). on_done, if given, is
+  called once when the body has been read to the end or the response is
+  closed.
+  '''
+
+  def __init__(self, response, stats, site, on_done=None):
+    self._response = response
+    self._stats = stats
+    self._site = site
+    self._on_done = on_done
+
+
+  def _done(self):
+    on_done = self._on_done
+    self._on_done = None
+    if not on_done is None:
+      on_done()
+
+
+  def read(self, amt=None):
+    t0 = time.time()
+    if amt is None:
+      data = self._response.read()
+    else:
+      data = self._response.read(amt)
+    if not self._stats is None:
+      self._stats.read(self._site, len(data), time.time() - t0)
+    if amt is None or len(data) == 0:
+      self._done()
+    return data
+
+
+  def close(self):
+    self._response.close()
+    self._done()
+
+
+  def __getattr__(self, name):
+    return getattr(self._response, name)
+
+
+
+def _labels(labels):
+  return ",".join(['{0}="{1}"'.format(k, str(v).replace('\\', '\\\\')
+                                              .replace('"', '\\"'))
+                   for k, v in sorted(labels.iteritems())])
+
+
+def prometheusText(meta):
+  '''Returns the timings in the meta dictionary of a snapshot as Prometheus
+  text exposition format.
+  '''
+  timings = meta.get('timings', {})
+  base = {'baseurl': meta.get('baseurl', '')}
+  lines = []
+
+  def metric(name, description, samples):
+    lines.append("# HELP {0} {1}".format(name, description))
+    lines.append("# TYPE {0} gauge".format(name))
+    for labels, value in samples:
+      all_labels = dict(base)
+      all_labels.update(labels)
+      lines.append("{0}{{{1}}} {2!r}".format(name, _labels(all_labels), value))
+
+  metric("d1state_run_seconds", "Duration of the state collection run",
+         [({}, timings.get('seconds', 0))])
+  metric("d1state_run_timestamp_seconds", "Time the collection run started",
+         [({}, timings.get('started', 0))])
+  phases = timings.get('phases', {})
+  metric("d1state_phase_seconds", "Duration of each collection phase",
+         [({'phase': k, 'status': v['status']}, v['seconds'])
+          for k, v in sorted(phases.iteritems())])
+  endpoints = sorted(timings.get('requests', {}).iteritems())
+  for key, description in [
+      ['requests', "Requests made, including retries"],
+      ['retries', "Requests retried after a transient failure"],
+      ['seconds', "Time spent in requests"],
+      ['bytes', "Response bytes read"], ]:
+    metric("d1state_endpoint_{0}".format(key), description,
+           [({'endpoint': k}, v[key]) for k, v in endpoints])
+  errors = []
+  for k, v in endpoints:
+    for error, n in sorted(v['errors'].iteritems()):
+      errors.append(({'endpoint': k, 'error': error}, n))
+  metric("d1state_endpoint_errors", "Failed requests by exception type",
+         errors)
+  return "\n".join(lines) + "\n"
+
+
+def writePrometheus(path, meta):
+  '''Writes prometheusText(meta) to path, replacing it atomically so the
+  textfile collector never reads a partial file.
+  '''
+  writeAtomic(path, prometheusText(meta))
@@ -0,0 +1,76 @@
+'''
+Writing of the JS files read by the web UI (snapshot files with env_state,
+index.js with env_state_index, history.js with count_history).
+
+Each file is a JS variable assignment followed by JSON, e.g.
+"var env_state = {...}", and the UI loads it with $.getScript. In compact
+mode the JSON is minified (no indentation or spaces after separators) and
+written with sorted keys. Formats and nodes are tables keyed by formatId and
+nodeId, so they come out in a fixed order with one entry per id, and
+successive snapshots of an unchanged environment are byte for byte identical,
+which suits rsync and HTTP caching.
+
+With precompress, .gz and (if the brotli module is installed) .br siblings
+of each file are written for servers that serve precompressed files, e.g.
+nginx gzip_static / brotli_static. The gzip header carries no name or time,
+so the siblings are also identical for identical content. Siblings are
+written before the file itself is replaced, and stale siblings are removed
+when writing without precompress, so a server never sends a compressed copy
+older than the file.
+'''
+
+import os
+import gzip
+import json
+from StringIO import StringIO
+from d1state.fileio import writeAtomic
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+#Extensions of the precompressed siblings of a JS file
+COMPRESSED_EXTENSIONS = ['.gz', '.br']
+
+
+def dumpJS(variable, obj, compact=False):
+  '''Returns the JS assigning obj (as JSON) to variable, where variable is
+  e.g. EnvironmentState.JS_VARIABLE_STATE ("var env_state = ").
+  '''
+  if compact:
+    return variable + json.dumps(obj, sort_keys=True, separators=(',', ':'))
+  return variable + json.dumps(obj, indent=2)
+
+
+def gzipBytes(content, level=9):
+  '''Returns content gzip compressed, with no file name or time in the header.
+  '''
+  fileobj = StringIO()
+  zfile = gzip.GzipFile(filename="", mode="wb", compresslevel=level,
+                        fileobj=fileobj, mtime=0)
+  zfile.write(content)
+  zfile.close()
+  return fileobj.getvalue()
+
+
+def writeJS(path, variable, obj, compact=False, precompress=False):
+  '''Writes obj to path as the JS assigning it to variable, replacing the file
+  atomically, and with precompress also path.gz and path.br. Returns the
+  number of bytes written to path.
+  '''
+  content = dumpJS(variable, obj, compact=compact)
+  if isinstance(content, unicode):
+    content = content.encode('utf-8')
+  siblings = {}
+  if precompress:
+    siblings['.gz'] = gzipBytes(content)
+    if not brotli is None:
+      siblings['.br'] = brotli.compress(content, quality=11)
+  for ext in COMPRESSED_EXTENSIONS:
+    if ext in siblings:
+      writeAtomic(path + ext, siblings[ext])
+    elif os.path.exists(path + ext):
+      os.remove(path + ext)
+  writeAtomic(path, content)
+  return len(content)
+
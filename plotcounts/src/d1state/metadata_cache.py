@@ -0,0 +1,159 @@
+'''
+On-disk cache of the CN format and node registries (listFormats, listNodes).
+
+Documents are stored per CN base URL under ~/.dataone/metadata_cache. A
+cached document younger than the TTL is used as is. An older one is
+revalidated with a conditional request (If-None-Match / If-Modified-Since)
+and downloaded again only if it has changed. If the CN cannot be reached, a
+stale copy is used. Parsed documents are kept in memory, so each registry is
+parsed at most once per refresh within a process.
+
+Requests are made with a client from a connections.ConnectionPool, so they
+share its connections, retries, circuit breaker and certificate with the
+other CN calls.
+
+Can also be run as a script to copy a cached document to a file, e.g.::
+
+  python -m d1state.metadata_cache -b https://cn.dataone.org/cn nodes nodes.xml
+'''
+
+import os
+import time
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from optparse import OptionParser
+from d1_common.types import dataoneTypes
+from d1state.connections import ConnectionPool
+from d1state.fileio import writeAtomic
+
+
+class MetadataCache(object):
+  #Seconds a cached document is used without revalidation
+  TTL = 6 * 3600
+  #document name: REST path relative to the v1 API
+  DOCUMENTS = {'formats': 'formats',
+               'nodes': 'node', }
+
+  def __init__(self, baseurl, folder=None, ttl=None, pool=None,
+               cert_path=None):
+    '''pool is the ConnectionPool used for requests to the CN, a new one for
+    baseurl and cert_path if None.
+    '''
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.baseurl = baseurl.rstrip("/")
+    self.pool = pool
+    if self.pool is None:
+      self.pool = ConnectionPool(self.baseurl, cert_path=cert_path)
+    self.ttl = ttl
+    if self.ttl is None:
+      self.ttl = MetadataCache.TTL
+    if folder is None:
+      folder = os.path.join(os.environ['HOME'], ".dataone/metadata_cache")
+    self.folder = os.path.join(folder,
+                               hashlib.sha1(self.baseurl).hexdigest()[:16])
+    if not os.path.isdir(self.folder):
+      os.makedirs(self.folder)
+    self._lock = threading.Lock()
+    #name: [mtime of cached file, parsed document]
+    self._parsed = {}
+
+
+  def _path(self, name, ext):
+    return os.path.join(self.folder, "{0}.{1}".format(name, ext))
+
+
+  def _loadMeta(self, name):
+    try:
+      return json.load(file(self._path(name, "json"), "r"))
+    except (IOError, ValueError):
+      return None
+
+
+  def _refresh(self, name, meta):
+    '''Downloads or revalidates the named document. Returns the new meta
+    information.
+    '''
+    client = self.pool.client('v1')
+    url = client._rest_url(MetadataCache.DOCUMENTS[name])
+    headers = {}
+    if not meta is None:
+      if not meta.get('etag') is None:
+        headers['If-None-Match'] = meta['etag']
+      if not meta.get('last_modified') is None:
+        headers['If-Modified-Since'] = meta['last_modified']
+    response = client.GET(url, headers=headers)
+    content = response.read()
+    if response.status == 304 and not meta is None:
+      self.log.info("{0} not modified".format(url))
+      meta['fetched'] = time.time()
+      writeAtomic(self._path(name, "json"), json.dumps(meta))
+      return meta
+    if response.status != 200:
+      raise IOError("HTTP {0} from {1}".format(response.status, url))
+    self.log.info("Downloaded {0}".format(url))
+    meta = {'url': url,
+            'fetched': time.time(),
+            'etag': response.getheader('ETag'),
+            'last_modified': response.getheader('Last-Modified'), }
+    writeAtomic(self._path(name, "xml"), content)
+    writeAtomic(self._path(name, "json"), json.dumps(meta))
+    return meta
+
+
+  def getPath(self, name):
+    '''Returns the path of the cached XML document ("formats" or "nodes"),
+    refreshing it first if it is older than the TTL.
+    '''
+    with self._lock:
+      meta = self._loadMeta(name)
+      if not os.path.exists(self._path(name, "xml")):
+        meta = None
+      if meta is None or time.time() - meta['fetched'] > self.ttl:
+        try:
+          meta = self._refresh(name, meta)
+        except Exception as e:
+          if meta is None:
+            raise
+          self.log.warn("Using stale {0}: {1}".format(name, e))
+      return self._path(name, "xml")
+
+
+  def getDocument(self, name):
+    '''Returns the parsed document, parsing it only when it has changed.
+    '''
+    path = self.getPath(name)
+    mtime = os.path.getmtime(path)
+    with self._lock:
+      if name in self._parsed and self._parsed[name][0] == mtime:
+        return self._parsed[name][1]
+      doc = dataoneTypes.CreateFromDocument(file(path, "rb").read())
+      self._parsed[name] = [mtime, doc]
+      return doc
+
+
+  def listFormats(self):
+    return self.getDocument('formats')
+
+
+  def listNodes(self):
+    return self.getDocument('nodes')
+
+
+#===============================================================================
+if __name__ == "__main__":
+  parser = OptionParser(usage="%prog [options] formats|nodes DEST")
+  parser.add_option("-b","--baseurl", dest="baseurl",
+                    help="CN base URL (https://cn.dataone.org/cn)",
+                    default="https://cn.dataone.org/cn")
+  parser.add_option("-t","--ttl", dest="ttl",
+                    help="Seconds before a cached document is revalidated",
+                    default=None, type="int")
+  (options, args) = parser.parse_args()
+  if len(args) != 2 or not args[0] in MetadataCache.DOCUMENTS:
+    parser.error("Expected formats or nodes and a destination")
+  logging.basicConfig(level=logging.WARN)
+  cache = MetadataCache(options.baseurl, ttl=options.ttl)
+  shutil.copyfile(cache.getPath(args[0]), args[1])
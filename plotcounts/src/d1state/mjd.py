@@ -5,13 +5,20 @@ Created on May 29, 2013
 
 Copied directly from:
   http://asimpleweblog.wordpress.com/2010/06/20/julian-date-calculator/
+  
+The array conversions (epoch2MJD, MJD2epoch, dateTimes2MJD, MJD2dateTimes)
+operate on whole numpy arrays using the proleptic Gregorian calendar of 
+numpy.datetime64, and agree with the scalar functions for Gregorian dates.
 '''
 
 import math
 import datetime
 import pytz
+import numpy
 
 MJD0 = 2400000.5 # 1858 November 17, 00:00:00 hours 
+MJD_UNIX_EPOCH = 40587.0 # 1970 January 1, 00:00:00 hours
+SECONDS_PER_DAY = 86400.0
 
 def base60_to_decimal(xyz,delimiter=None):
   """Decimal value from numbers in sexagesimal system. 
@@ -94,8 +101,7 @@ def julian_date(year,month,day,hour,minute,second):
 
   mjdmidnight = 365L*year - 679004L + b + int(30.6001*(month+1)) + day
 
-  fracofday = base60_to_decimal(\
-    " ".join([str(hour),str(minute),str(second)])) / 24.0 
+  fracofday = (hour + minute / 60.0 + second / 3600.0) / 24.0 
 
   return MJD0 + mjdmidnight + fracofday
 
@@ -139,7 +145,7 @@ def caldate(mjd):
 
 
 def dateTime2MJD(dt):
-  sec = dt.second + dt.microsecond / 1000.0
+  sec = dt.second + dt.microsecond / 1000000.0
   jnow = julian_date(dt.year, dt.month, dt.day, 
                      dt.hour, dt.minute, sec)
   return jnow - MJD0 
@@ -154,12 +160,41 @@ def now():
   '''Returns MJD for right now, UTC
   '''
   dnow = datetime.datetime.utcnow()
-  sec = dnow.second + dnow.microsecond / 1000.0
+  sec = dnow.second + dnow.microsecond / 1000000.0
   jnow = julian_date(dnow.year, dnow.month, dnow.day, 
                      dnow.hour, dnow.minute, sec)
   return jnow - MJD0 
 
 
+def epoch2MJD(t):
+  '''Returns MJD for seconds since 1970-01-01T00:00:00Z. t may be a scalar,
+  sequence or array.
+  '''
+  return numpy.asarray(t, dtype=numpy.float64) / SECONDS_PER_DAY + MJD_UNIX_EPOCH
+
+
+def MJD2epoch(mjd):
+  '''Returns seconds since 1970-01-01T00:00:00Z for MJD values.
+  '''
+  return (numpy.asarray(mjd, dtype=numpy.float64) - MJD_UNIX_EPOCH) * SECONDS_PER_DAY
+
+
+def dateTimes2MJD(dts):
+  '''Returns an array of MJD for an array of numpy.datetime64 values, or a 
+  sequence of naive UTC datetime.datetime values.
+  '''
+  usec = numpy.asarray(dts, dtype='datetime64[us]').astype(numpy.int64)
+  return usec / (SECONDS_PER_DAY * 1e6) + MJD_UNIX_EPOCH
+
+
+def MJD2dateTimes(mjd, unit='us'):
+  '''Returns an array of numpy.datetime64 in the specified unit (e.g. "D", 
+  "s", "us") for MJD values. Values are truncated to the unit.
+  '''
+  usec = numpy.round(MJD2epoch(mjd) * 1e6).astype(numpy.int64)
+  return usec.astype('datetime64[us]').astype('datetime64[{0}]'.format(unit))
+
+
 
 if __name__ == '__main__':
   print "Julian date for 2010/1/1 13:20:12.3456 : ",
@@ -0,0 +1,251 @@
+'''
+One pass tally of the objects listed by CN.listObjects.
+
+ObjectTally pages through listObjects once, parsing each ObjectList response
+incrementally (iterparse, clearing elements as they are read) so memory use
+is bounded by a single objectInfo rather than by a page or the whole list.
+Each identifier is recorded with its formatId and the day it was first seen
+(from dateSysMetadataModified, the only date listObjects reports) in a small
+sqlite database, from which the counts by formatId and by day are taken.
+Unlike one listObjects(count=0) call per registered format this also counts
+objects of unregistered formats.
+
+The time of each completed scan is kept as a watermark and the next update
+requests only objects with fromDate at or after it. Since fromDate matches
+system metadata modification rather than creation, modified objects are
+listed again; recording identifiers makes re-listed objects update their
+entry rather than being counted twice. Each page is committed in a single
+transaction, so an interrupted scan can simply be repeated.
+
+Deleted objects are no longer listed, so an incremental scan cannot see them.
+Two checks keep the tally from drifting: after each update the number of
+objects tallied is compared with the total listObjects currently reports, and
+if the tally holds more (objects have been removed) a full scan is made.
+Since a deletion can be hidden by objects created meanwhile, a full scan is
+also made when the last one is older than RESCAN_DAYS. A full scan records
+the identifiers it lists in the seen table and then deletes the objects that
+were not listed, so objects still present keep the day they were first seen.
+'''
+
+import os
+import logging
+import datetime
+import sqlite3
+import xml.etree.cElementTree as ElementTree
+
+LISTOBJECTS_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def _localName(tag):
+  return tag.rsplit('}', 1)[-1]
+
+
+def parseObjectList(stream):
+  '''Yields the total reported by an ObjectList document read from stream,
+  followed by [identifier, formatId, dateSysMetadataModified] for each
+  objectInfo it contains.
+  '''
+  root = None
+  entry = {}
+  for event, elem in ElementTree.iterparse(stream, events=('start', 'end')):
+    if root is None:
+      root = elem
+      yield int(root.get('total', 0))
+      continue
+    if event != 'end':
+      continue
+    name = _localName(elem.tag)
+    if name in ('identifier', 'formatId', 'dateSysMetadataModified'):
+      entry[name] = elem.text
+    elif name == 'objectInfo':
+      yield [entry.get('identifier'),
+             entry.get('formatId'),
+             entry.get('dateSysMetadataModified')]
+      entry = {}
+      root.clear()
+
+
+class ObjectTally(object):
+  #Objects requested per listObjects page
+  PAGE_SIZE = 1000
+  #Days between full rescans
+  RESCAN_DAYS = 7
+
+  def __init__(self, folder, page_size=None, rescan_days=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.folder = folder
+    self.page_size = page_size
+    if self.page_size is None:
+      self.page_size = ObjectTally.PAGE_SIZE
+    self.rescan_days = rescan_days
+    if self.rescan_days is None:
+      self.rescan_days = ObjectTally.RESCAN_DAYS
+    if not os.path.isdir(self.folder):
+      os.makedirs(self.folder)
+    self.db_path = os.path.join(self.folder, "objects.sqlite")
+    conn = self._connect()
+    conn.execute("CREATE TABLE IF NOT EXISTS objects "
+                 "(identifier TEXT PRIMARY KEY, formatId TEXT, day TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS objects_format "
+                 "ON objects (formatId)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta "
+                 "(key TEXT PRIMARY KEY, value TEXT)")
+    #identifiers listed by a full scan in progress
+    conn.execute("CREATE TABLE IF NOT EXISTS seen "
+                 "(identifier TEXT PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+
+
+  def _connect(self):
+    #connections are not shared, the tally may be used from worker threads
+    return sqlite3.connect(self.db_path)
+
+
+  def _getTime(self, key):
+    conn = self._connect()
+    row = conn.execute("SELECT value FROM meta WHERE key=?", [key])\
+              .fetchone()
+    conn.close()
+    if row is None:
+      return None
+    return datetime.datetime.strptime(row[0], LISTOBJECTS_DATE_FORMAT)
+
+
+  def getWatermark(self):
+    '''Returns the time (datetime) up to which objects have been scanned, or
+    None if no scan has completed.
+    '''
+    return self._getTime('watermark')
+
+
+  def getFullScan(self):
+    '''Returns the time (datetime) of the last completed full scan, or None.
+    '''
+    return self._getTime('full_scan')
+
+
+  def count(self):
+    '''Returns the number of objects in the tally.
+    '''
+    conn = self._connect()
+    res = conn.execute("SELECT COUNT(*) FROM objects").fetchone()[0]
+    conn.close()
+    return res
+
+
+  def _fetchPage(self, client, start, from_date, to_date, count=None):
+    if count is None:
+      count = self.page_size
+    params = {'start': start,
+              'count': count, }
+    if not to_date is None:
+      params['toDate'] = to_date.strftime(LISTOBJECTS_DATE_FORMAT)
+    if not from_date is None:
+      params['fromDate'] = from_date.strftime(LISTOBJECTS_DATE_FORMAT)
+    return client.GET(client._rest_url('object'), params)
+
+
+  def listedTotal(self, client):
+    '''Returns the number of objects listObjects currently reports.
+    '''
+    items = parseObjectList(self._fetchPage(client, 0, None, None, count=0))
+    total = items.next()
+    for item in items:
+      pass
+    return total
+
+
+  def update(self, client, to_date=None):
+    '''Scans listObjects from the watermark (or from the start if there is
+    none) up to to_date (default now) and returns the number of objects
+    listed. client is a CN client, e.g. EnvironmentState.clientv1.
+
+    A full scan is made instead if one is due, and after the scan if the
+    tally holds more objects than listObjects reports.
+    '''
+    if to_date is None:
+      to_date = datetime.datetime.utcnow()
+    full_scan = self.getFullScan()
+    if full_scan is None or \
+       to_date - full_scan >= datetime.timedelta(days=self.rescan_days):
+      self.log.info("Full rescan due, last was {0}".format(full_scan))
+      return self._scan(client, None, to_date)
+    nlisted = self._scan(client, self.getWatermark(), to_date)
+    ntally = self.count()
+    total = self.listedTotal(client)
+    if ntally > total:
+      self.log.warn("Tally has {0} objects, listObjects {1}, rescanning"\
+                    .format(ntally, total))
+      nlisted = self._scan(client, None, to_date)
+    return nlisted
+
+
+  def _scan(self, client, from_date, to_date):
+    '''Adds the objects listed between from_date and to_date and moves the
+    watermark to to_date. Returns the number listed. With from_date None all
+    objects are listed and those not listed are removed from the tally.
+    '''
+    self.log.info("Scanning listObjects from {0} to {1}".format(from_date,
+                                                                to_date))
+    full = from_date is None
+    conn = self._connect()
+    try:
+      if full:
+        conn.execute("DELETE FROM seen")
+        conn.commit()
+      start = 0
+      total = None
+      while total is None or start < total:
+        items = parseObjectList(self._fetchPage(client, start,
+                                                from_date, to_date))
+        total = items.next()
+        page = []
+        for identifier, formatId, modified in items:
+          page.append([identifier, formatId, (modified or "")[:10]])
+        if len(page) == 0:
+          break
+        conn.executemany("INSERT OR IGNORE INTO objects VALUES (?, ?, ?)",
+                         page)
+        conn.executemany("UPDATE objects SET formatId=? WHERE identifier=? "
+                         "AND formatId!=?",
+                         [[p[1], p[0], p[1]] for p in page])
+        if full:
+          conn.executemany("INSERT OR IGNORE INTO seen VALUES (?)",
+                           [[p[0]] for p in page])
+        conn.commit()
+        start += len(page)
+        self.log.debug("listObjects {0} of {1}".format(start, total))
+      conn.execute("INSERT OR REPLACE INTO meta VALUES ('watermark', ?)",
+                   [to_date.strftime(LISTOBJECTS_DATE_FORMAT)])
+      if full:
+        removed = conn.execute("DELETE FROM objects WHERE identifier NOT IN "
+                               "(SELECT identifier FROM seen)").rowcount
+        conn.execute("DELETE FROM seen")
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('full_scan', ?)",
+                     [to_date.strftime(LISTOBJECTS_DATE_FORMAT)])
+        self.log.info("Removed {0} objects no longer listed".format(removed))
+      conn.commit()
+    finally:
+      conn.close()
+    return start
+
+
+  def countByFormat(self):
+    '''Returns {formatId: number of objects}.
+    '''
+    conn = self._connect()
+    res = dict(conn.execute("SELECT formatId, COUNT(*) FROM objects "
+                            "GROUP BY formatId").fetchall())
+    conn.close()
+    return res
+
+
+  def countByDay(self):
+    '''Returns {"YYYY-MM-DD": number of objects first seen on that day}.
+    '''
+    conn = self._connect()
+    res = dict(conn.execute("SELECT day, COUNT(*) FROM objects "
+                            "GROUP BY day").fetchall())
+    conn.close()
+    return res
@@ -0,0 +1,281 @@
+'''
+Retry, backoff and circuit breaking for calls to CNs and MNs.
+
+A Resilience instance wraps calls made to remote hosts. Transient failures
+(HTTP protocol errors including 5xx responses, socket errors and
+ServiceFailure responses) are retried
+with exponential backoff and full jitter, up to max_tries attempts per call.
+All calls share a retry budget, so a run that meets many failures stops
+retrying rather than spending its time budget on them. Consecutive failures
+against a host open a circuit breaker for that host, after which calls to it
+fail immediately with CircuitOpenError until reset_after seconds have passed
+and a trial call succeeds. configureHost sets other limits for a host, e.g.
+for the CN, which all phases of a run share.
+
+Calls, retries and failures are counted per call site (a short name given by
+the caller) and reported by getStats. If an instrumentation.RequestStats is
+provided, the duration and outcome of every attempt is recorded with it too.
+'''
+
+import time
+import random
+import socket
+import httplib
+import logging
+import threading
+import urlparse
+import d1_common.types.exceptions
+
+#Exceptions considered transient and so worth retrying
+RETRYABLE_ERRORS = (httplib.HTTPException,
+                    socket.error,
+                    d1_common.types.exceptions.ServiceFailure, )
+
+
+class CircuitOpenError(Exception):
+  '''Raised instead of calling a host whose circuit breaker is open.
+  '''
+  pass
+
+
+class ServerError(httplib.HTTPException):
+  '''Raised for an HTTP 5xx response that is not otherwise an exception, so
+  that it is retried like other transient failures.
+  '''
+
+  def __init__(self, status, url):
+    httplib.HTTPException.__init__(self, "HTTP {0} from {1}".format(status,
+                                                                    url))
+    self.status = status
+
+
+def hostOf(url):
+  '''Returns the host (and port if given) of url, used to key breakers.
+  '''
+  return urlparse.urlparse(url).netloc
+
+
+class CircuitBreaker(object):
+  '''Tracks consecutive failures against a single host.
+
+  The breaker opens after failure_threshold consecutive failures. Once open,
+  calls are refused until reset_after seconds have elapsed, then a single
+  trial call is allowed (half open). Success closes the breaker, failure opens
+  it again.
+  '''
+  CLOSED = 'closed'
+  OPEN = 'open'
+  HALF_OPEN = 'half_open'
+
+  def __init__(self, host, failure_threshold, reset_after):
+    self.host = host
+    self.failure_threshold = failure_threshold
+    self.reset_after = reset_after
+    self.state = CircuitBreaker.CLOSED
+    self.failures = 0
+    self.opened = None
+    self._lock = threading.Lock()
+
+
+  def allow(self):
+    with self._lock:
+      if self.state == CircuitBreaker.CLOSED:
+        return True
+      if self.state == CircuitBreaker.OPEN and \
+         time.time() - self.opened >= self.reset_after:
+        self.state = CircuitBreaker.HALF_OPEN
+        return True
+      return False
+
+
+  def success(self):
+    with self._lock:
+      self.state = CircuitBreaker.CLOSED
+      self.failures = 0
+
+
+  def failure(self):
+    '''Records a failure. Returns True if the breaker is now open.
+    '''
+    with self._lock:
+      self.failures += 1
+      if self.state == CircuitBreaker.HALF_OPEN or \
+         self.failures >= self.failure_threshold:
+        if self.state != CircuitBreaker.OPEN:
+          logging.warn("Circuit opened for {0} after {1} failures"\
+                       .format(self.host, self.failures))
+        self.state = CircuitBreaker.OPEN
+        self.opened = time.time()
+      return self.state == CircuitBreaker.OPEN
+
+
+
+class Resilience(object):
+  #Attempts made for a single call, including the first
+  MAX_TRIES = 4
+  #Seconds; the backoff before retry n is uniform in [0, BASE_DELAY * 2**n]
+  BASE_DELAY = 0.5
+  MAX_DELAY = 30.0
+  #Total number of retries allowed between calls to reset()
+  RETRY_BUDGET = 100
+  #Consecutive failures before a host's breaker opens, at most max_tries so
+  #that a single call to a dead host opens it
+  FAILURE_THRESHOLD = 3
+  #Seconds an open breaker refuses calls before allowing a trial call
+  RESET_AFTER = 300.0
+
+  def __init__(self, max_tries=None, base_delay=None, max_delay=None,
+               retry_budget=None, failure_threshold=None, reset_after=None,
+               instrumentation=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.instrumentation = instrumentation
+    self.max_tries = max_tries
+    if self.max_tries is None:
+      self.max_tries = Resilience.MAX_TRIES
+    self.base_delay = base_delay
+    if self.base_delay is None:
+      self.base_delay = Resilience.BASE_DELAY
+    self.max_delay = max_delay
+    if self.max_delay is None:
+      self.max_delay = Resilience.MAX_DELAY
+    self.retry_budget = retry_budget
+    if self.retry_budget is None:
+      self.retry_budget = Resilience.RETRY_BUDGET
+    self.failure_threshold = failure_threshold
+    if self.failure_threshold is None:
+      self.failure_threshold = Resilience.FAILURE_THRESHOLD
+    self.failure_threshold = min(self.failure_threshold, self.max_tries)
+    self.reset_after = reset_after
+    if self.reset_after is None:
+      self.reset_after = Resilience.RESET_AFTER
+    self._lock = threading.Lock()
+    self._breakers = {}
+    self.reset()
+
+
+  def reset(self):
+    '''Clears the per call site counters and refills the retry budget.
+    Breaker state is kept, so a host found dead stays skipped across runs.
+    '''
+    with self._lock:
+      self._budget = self.retry_budget
+      self._sites = {}
+
+
+  def _site(self, site):
+    if not site in self._sites:
+      self._sites[site] = {'calls': 0,
+                           'retries': 0,
+                           'failures': 0,
+                           'rejected': 0, }
+    return self._sites[site]
+
+
+  def _count(self, site, key):
+    with self._lock:
+      self._site(site)[key] += 1
+
+
+  def _takeRetry(self, site):
+    '''Consumes one retry from the budget. Returns False if it is spent.
+    '''
+    with self._lock:
+      if self._budget <= 0:
+        return False
+      self._budget -= 1
+      self._site(site)['retries'] += 1
+      return True
+
+
+  def breaker(self, host):
+    with self._lock:
+      if not host in self._breakers:
+        self._breakers[host] = CircuitBreaker(host,
+                                              self.failure_threshold,
+                                              self.reset_after)
+      return self._breakers[host]
+
+
+  def configureHost(self, host, failure_threshold=None, reset_after=None):
+    '''Sets the consecutive failures before the breaker for host opens and
+    the seconds it then stays open, where given. Unlike the defaults the
+    threshold may exceed max_tries.
+    '''
+    breaker = self.breaker(host)
+    with breaker._lock:
+      if not failure_threshold is None:
+        breaker.failure_threshold = failure_threshold
+      if not reset_after is None:
+        breaker.reset_after = reset_after
+    return breaker
+
+
+  def backoff(self, attempt):
+    '''Returns the seconds to wait before retry number attempt (from 1).
+    '''
+    return random.uniform(0, min(self.max_delay,
+                                 self.base_delay * 2 ** attempt))
+
+
+  def _instrument(self, site, t0, error=None):
+    if not self.instrumentation is None:
+      self.instrumentation.request(site, time.time() - t0, error=error)
+
+
+  def call(self, site, host, func, *args, **kwargs):
+    '''Returns func(*args, **kwargs), retrying transient failures.
+
+    site names the calling code for the statistics, host is the remote host
+    for the circuit breaker. Raises CircuitOpenError without calling func if
+    the breaker for host is open, otherwise the last error once attempts or
+    the retry budget are exhausted. Errors that are not transient (e.g.
+    NotAuthorized) are raised immediately and count as a success for the
+    breaker, since the host responded.
+    '''
+    breaker = self.breaker(host)
+    self._count(site, 'calls')
+    attempt = 0
+    while True:
+      if not breaker.allow():
+        self._count(site, 'rejected')
+        raise CircuitOpenError("Circuit open for {0}".format(host))
+      attempt += 1
+      t0 = time.time()
+      try:
+        res = func(*args, **kwargs)
+        self._instrument(site, t0)
+        breaker.success()
+        return res
+      except RETRYABLE_ERRORS as e:
+        self._instrument(site, t0, e)
+        is_open = breaker.failure()
+        if is_open or attempt >= self.max_tries or not self._takeRetry(site):
+          self._count(site, 'failures')
+          raise
+        if not self.instrumentation is None:
+          self.instrumentation.retry(site)
+        delay = self.backoff(attempt)
+        self.log.warn("{0} on {1} failed ({2}), retry {3} in {4:.2f}s"\
+                      .format(site, host, repr(e), attempt, delay))
+        time.sleep(delay)
+      except Exception as e:
+        #the host answered, e.g. with NotFound or NotAuthorized, so it is up
+        #and a half open breaker is closed rather than left holding the trial
+        self._instrument(site, t0, e)
+        breaker.success()
+        raise
+
+
+  def getStats(self):
+    '''Returns {'budget_remaining', 'sites': {site: counters},
+    'open_circuits': [hosts]}.
+    '''
+    with self._lock:
+      sites = dict((k, dict(v)) for k, v in self._sites.iteritems())
+      budget = self._budget
+      breakers = self._breakers.values()
+    return {'budget_remaining': budget,
+            'sites': sites,
+            'open_circuits': sorted([b.host for b in breakers
+                                     if b.state != CircuitBreaker.CLOSED]),
+            }
@@ -0,0 +1,183 @@
+'''
+Daily, weekly and monthly rollups of the snapshot history for charting.
+
+StateRollups reads each snapshot of a snapshot_store.SnapshotStore once and
+extracts a flat set of numeric series from it (extractSeries): the summary
+counts, the objectcount of each node, the log event totals for each period
+and the size histogram bins. For each interval a series holds one value per
+period, the value in the latest snapshot of that period, since all of these
+are levels rather than increments. Series missing from a period are null.
+
+Progress is kept in rollups.json in the rollup folder with the timestamp of
+the last snapshot read, so each update reads only the snapshots appended
+since (sequentially, which the store serves from its delta cache). Delete the
+file to rebuild the rollups from the start of the store.
+
+write() produces one small JS file per interval (rollup_day.js etc.) with
+"var state_rollup = " and
+
+  {"interval": "week",
+   "periods": ["2026-10-12", ...],      #first day of each period
+   "tstamps": [snapshot tstamp, ...],   #snapshot giving the values
+   "series": {"summary.counts.all.total": [n, ...], ...}}
+
+The daily file is limited to the most recent MAX_PERIODS['day'] days.
+'''
+
+import os
+import json
+import logging
+import datetime
+from d1state.system_state import EnvironmentState
+from d1state import js_output
+from d1state.fileio import writeAtomic
+
+#name: function returning the first day of the period containing a date
+INTERVALS = {'day': lambda d: d,
+             'week': lambda d: d - datetime.timedelta(days=d.weekday()),
+             'month': lambda d: d.replace(day=1), }
+#Periods written to the JS file for each interval, 0 for all
+MAX_PERIODS = {'day': 400, 'week': 0, 'month': 0}
+
+
+def _isNumber(v):
+  return isinstance(v, (int, long, float)) and not isinstance(v, bool)
+
+
+def _flatten(prefix, value, res):
+  if _isNumber(value):
+    res[prefix] = value
+  elif isinstance(value, dict):
+    for k, v in value.iteritems():
+      if k == 'histogram':
+        #rows of [size_low, size_high, count]
+        for i, row in enumerate(v):
+          res["{0}.bin{1}".format(prefix, i)] = row[2]
+      else:
+        _flatten(prefix + "." + k, v, res)
+
+
+def extractSeries(state):
+  '''Returns {series name: value} for the values of an EnvironmentState
+  snapshot that are rolled up, e.g. "summary.counts.all.total",
+  "summary.sizes.data.bin3", "nodes.urn:node:KNB.objectcount" and
+  "logs.read.Day". Nodes with an error code instead of an objectcount are
+  omitted.
+  '''
+  res = {}
+  if not state.get('summary') is None:
+    _flatten("summary", state['summary'], res)
+  for nodeId, node in (state.get('nodes') or {}).iteritems():
+    n = node.get('objectcount', -1)
+    if _isNumber(n) and n >= 0:
+      res["nodes.{0}.objectcount".format(nodeId)] = n
+  logs = state.get('logs') or {}
+  for event, periods in (logs.get('data') or {}).iteritems():
+    _flatten("logs." + event, periods, res)
+  return res
+
+
+class StateRollups(object):
+
+  def __init__(self, folder, intervals=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.folder = folder
+    self.intervals = intervals
+    if self.intervals is None:
+      self.intervals = sorted(INTERVALS.keys())
+    if not os.path.isdir(self.folder):
+      os.makedirs(self.folder)
+    self.path = os.path.join(self.folder, "rollups.json")
+    self.rollups = self._load()
+
+
+  def _load(self):
+    try:
+      rollups = json.load(file(self.path, "r"))
+    except (IOError, ValueError):
+      rollups = {'last': None, 'intervals': {}}
+    for name in self.intervals:
+      rollups['intervals'].setdefault(name, {'periods': [],
+                                             'tstamps': [],
+                                             'series': {}})
+    return rollups
+
+
+  def _save(self):
+    writeAtomic(self.path, json.dumps(self.rollups, separators=(',', ':')))
+
+
+  def add(self, state):
+    '''Adds the series of a snapshot state. Snapshots must be added in
+    timestamp order.
+    '''
+    tstamp = state['meta']['tstamp']
+    day = datetime.datetime.strptime(tstamp,
+                                     EnvironmentState.TIMESTAMP_FORMAT).date()
+    values = extractSeries(state)
+    for name in self.intervals:
+      rollup = self.rollups['intervals'][name]
+      period = INTERVALS[name](day).isoformat()
+      series = rollup['series']
+      if len(rollup['periods']) == 0 or rollup['periods'][-1] != period:
+        rollup['periods'].append(period)
+        rollup['tstamps'].append(None)
+        for v in series.itervalues():
+          v.append(None)
+      n = len(rollup['periods'])
+      rollup['tstamps'][-1] = tstamp
+      for key, value in values.iteritems():
+        if not key in series:
+          series[key] = [None] * n
+        series[key][-1] = value
+    self.rollups['last'] = tstamp
+
+
+  def update(self, store):
+    '''Adds the snapshots appended to store since the previous update and
+    saves the progress. Returns the number of snapshots added.
+    '''
+    start = 0
+    if not self.rollups['last'] is None:
+      start = store.find(self.rollups['last']) + 1
+    n = len(store)
+    for i in xrange(start, n):
+      self.add(store.load(i))
+    if n > start:
+      self._save()
+    self.log.info("Added {0} snapshots to the rollups".format(n - start))
+    return n - start
+
+
+  def series(self, name, max_periods=None):
+    '''Returns the rollup for interval name, limited to the latest
+    max_periods periods (default MAX_PERIODS[name], 0 for all).
+    '''
+    if max_periods is None:
+      max_periods = MAX_PERIODS.get(name, 0)
+    rollup = self.rollups['intervals'][name]
+    first = 0
+    if max_periods > 0:
+      first = max(0, len(rollup['periods']) - max_periods)
+    res = {'interval': name,
+           'periods': rollup['periods'][first:],
+           'tstamps': rollup['tstamps'][first:],
+           'series': {}}
+    for key, values in rollup['series'].iteritems():
+      values = values[first:]
+      #series with no values in the retained periods are dropped
+      if values.count(None) < len(values):
+        res['series'][key] = values
+    return res
+
+
+  def write(self, folder, compact=False, precompress=False):
+    '''Writes rollup_<interval>.js for each interval to folder. compact and
+    precompress are as for js_output.writeJS.
+    '''
+    for name in self.intervals:
+      js_output.writeJS(os.path.join(folder, "rollup_{0}.js".format(name)),
+                        EnvironmentState.JS_VARIABLE_ROLLUP,
+                        self.series(name),
+                        compact=compact,
+                        precompress=precompress)
@@ -0,0 +1,220 @@
+'''
+Scheduling of the collection jobs run by collector.py in a single process.
+
+A Job runs daily at a local time ("HH:MM", optionally on some weekdays only)
+like a crontab entry, or every given number of seconds. The Scheduler runs
+due jobs one at a time in the calling thread, and starts a job no sooner
+than stagger seconds after the previous one finished, so jobs scheduled for
+the same time run one after another rather than all hitting the CN at once.
+A failed job is logged and scheduled again as usual.
+
+After each job, and when started, the scheduler writes a JSON status file
+giving for each job the next and last run times, the duration and outcome of
+the last run and the number of runs and failures. A job run on its own (with
+collector.py -r) only updates its own entry, so the status written by a
+running collector is kept.
+'''
+
+import json
+import time
+import logging
+import datetime
+import threading
+from d1state.fileio import writeAtomic
+
+#Format of the times in the status file
+STATUS_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _formatTime(t):
+  if t is None:
+    return None
+  return t.strftime(STATUS_TIME_FORMAT)
+
+
+class Job(object):
+
+  def __init__(self, name, func, at=None, every=None, weekdays=None):
+    '''func is called without arguments. Exactly one of at ("HH:MM", local
+    time) and every (seconds) must be given. weekdays optionally limits a
+    daily job to those days, 0 = Monday.
+    '''
+    if (at is None) == (every is None):
+      raise ValueError("Job {0}: one of at or every is required".format(name))
+    self.name = name
+    self.func = func
+    self.at = None
+    if not at is None:
+      hour, minute = at.split(":")
+      self.at = [int(hour), int(minute)]
+    self.every = every
+    self.weekdays = weekdays
+    self.next_run = None
+
+
+  def nextRun(self, after):
+    '''Returns the first scheduled time (datetime) later than after.
+    '''
+    if not self.every is None:
+      return after + datetime.timedelta(seconds=self.every)
+    res = after.replace(hour=self.at[0], minute=self.at[1],
+                        second=0, microsecond=0)
+    if res <= after:
+      res += datetime.timedelta(days=1)
+    while not self.weekdays is None and not res.weekday() in self.weekdays:
+      res += datetime.timedelta(days=1)
+    return res
+
+
+  def __str__(self):
+    if not self.every is None:
+      return "{0} every {1}s".format(self.name, self.every)
+    return "{0} at {1:02d}:{2:02d}".format(self.name, self.at[0], self.at[1])
+
+
+
+class Scheduler(object):
+  #Minimum seconds between the end of a job and the start of the next
+  STAGGER = 300
+  #Longest sleep, so changes to the clock are noticed
+  MAX_SLEEP = 60
+
+  def __init__(self, status_path=None, stagger=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.status_path = status_path
+    self.stagger = stagger
+    if self.stagger is None:
+      self.stagger = Scheduler.STAGGER
+    self.jobs = []
+    #name: status entry, see getStatus
+    self.status = {}
+    self.last_end = None
+    self.started = datetime.datetime.now()
+
+
+  def add(self, job):
+    job.next_run = job.nextRun(datetime.datetime.now())
+    self.jobs.append(job)
+    self.status[job.name] = {'schedule': str(job),
+                             'last_run': None,
+                             'last_seconds': None,
+                             'last_status': None,
+                             'last_error': None,
+                             'runs': 0,
+                             'failures': 0, }
+    self.log.info("Scheduled {0}, next run {1}".format(job, job.next_run))
+
+
+  def nextJob(self):
+    '''Returns [job, start] for the job to run next and when it may start.
+    '''
+    job = min(self.jobs, key=lambda j: j.next_run)
+    start = job.next_run
+    if not self.last_end is None:
+      start = max(start,
+                  self.last_end + datetime.timedelta(seconds=self.stagger))
+    return [job, start]
+
+
+  def runJob(self, job, merge=False):
+    '''Runs job now and schedules its next run. Returns True if it succeeded.
+    With merge only the entry of job is updated in the status file (see
+    mergeStatus), otherwise the status file is replaced.
+    '''
+    status = self.status[job.name]
+    status['last_run'] = datetime.datetime.now()
+    self.log.info("Running {0}".format(job.name))
+    t0 = time.time()
+    ok = True
+    try:
+      job.func()
+      status['last_status'] = 'ok'
+      status['last_error'] = None
+    except Exception as e:
+      self.log.exception("Job {0} failed".format(job.name))
+      ok = False
+      status['last_status'] = 'failed'
+      status['last_error'] = repr(e)
+      status['failures'] += 1
+    status['last_seconds'] = time.time() - t0
+    status['runs'] += 1
+    self.last_end = datetime.datetime.now()
+    job.next_run = job.nextRun(self.last_end)
+    self.log.info("{0} {1} in {2:.1f}s, next run {3}".format(job.name,
+                                                           status['last_status'],
+                                                           status['last_seconds'],
+                                                           job.next_run))
+    if merge:
+      self.mergeStatus(job)
+    else:
+      self.writeStatus()
+    return ok
+
+
+  def run(self, stop=None):
+    '''Runs jobs as they become due until the threading.Event stop is set.
+    '''
+    if stop is None:
+      stop = threading.Event()
+    self.writeStatus()
+    while not stop.is_set() and len(self.jobs) > 0:
+      job, start = self.nextJob()
+      wait = (start - datetime.datetime.now()).total_seconds()
+      if wait > 0:
+        stop.wait(min(wait, Scheduler.MAX_SLEEP))
+        continue
+      self.runJob(job)
+
+
+  def getStatus(self):
+    '''Returns {'started', 'updated', 'jobs': {name: {'schedule', 'next_run',
+    'last_run', 'last_seconds', 'last_status', 'last_error', 'runs',
+    'failures'}}} with times as STATUS_TIME_FORMAT local times.
+    '''
+    jobs = {}
+    for job in self.jobs:
+      entry = dict(self.status[job.name])
+      entry['last_run'] = _formatTime(entry['last_run'])
+      entry['next_run'] = _formatTime(job.next_run)
+      jobs[job.name] = entry
+    return {'started': _formatTime(self.started),
+            'updated': _formatTime(datetime.datetime.now()),
+            'jobs': jobs}
+
+
+  def writeStatus(self):
+    '''Replaces the status file, if any, with getStatus().
+    '''
+    if self.status_path is None:
+      return
+    writeAtomic(self.status_path,
+                json.dumps(self.getStatus(), indent=2, sort_keys=True))
+
+
+  def mergeStatus(self, job):
+    '''Adds the last run of job to the status file, e.g. one written by a
+    running collector, leaving the other jobs, the next run times and the
+    start time as they are. Replaces the status file if it can not be read.
+    '''
+    if self.status_path is None:
+      return
+    try:
+      current = json.load(file(self.status_path, "r"))
+      jobs = current['jobs']
+    except (IOError, ValueError, KeyError, TypeError):
+      self.writeStatus()
+      return
+    status = self.status[job.name]
+    entry = jobs.setdefault(job.name, {'schedule': str(job),
+                                       'next_run': None,
+                                       'runs': 0,
+                                       'failures': 0, })
+    entry['last_run'] = _formatTime(status['last_run'])
+    for key in ['last_seconds', 'last_status', 'last_error']:
+      entry[key] = status[key]
+    entry['runs'] = entry.get('runs', 0) + 1
+    if status['last_status'] != 'ok':
+      entry['failures'] = entry.get('failures', 0) + 1
+    current['updated'] = _formatTime(datetime.datetime.now())
+    writeAtomic(self.status_path,
+                json.dumps(current, indent=2, sort_keys=True))
@@ -0,0 +1,319 @@
+'''
+Append-only storage for EnvironmentState snapshots.
+
+Snapshots are appended as single lines of JSON to monthly segment files
+(segments/YYYY-MM.jsonl). Each append also adds a fixed width record to
+index.dat giving the snapshot timestamp, its name (the file name used by the
+web UI), segment, byte offset and length. Appends are O(1) and, since the
+index records are fixed width and in time order, a snapshot is located by
+binary search over the index file in O(log n) without reading it all.
+
+Consecutive snapshots differ little, so most are stored as a delta against
+the previous snapshot (a line of {"_delta": changes}), with a full keyframe
+written every keyframe_interval snapshots. Loading a snapshot replays the
+deltas since the preceding keyframe.
+
+The JS views used by the web UI (index.js with env_state_index and one file
+per snapshot with env_state) are generated on demand by exportViews.
+'''
+
+import os
+import copy
+import json
+import logging
+from d1state.system_state import EnvironmentState
+from d1state import js_output
+
+#tstamp, name, segment, offset, length
+RECORD_FORMAT = "{0:<27s} {1:<40s} {2:<16s} {3:>14d} {4:>10d}\n"
+RECORD_SIZE = len(RECORD_FORMAT.format("", "", "", 0, 0))
+#Key identifying a delta record in a segment
+DELTA_KEY = "_delta"
+
+
+def diffState(old, new):
+  '''Returns the changes needed to turn dictionary old into new as a dictionary
+  with (when non-empty) "set": {key: new value}, "nested": {key: changes of a
+  dictionary value} and "remove": [keys]. Returns an empty dictionary if old 
+  and new are equal.
+  '''
+  res = {}
+  setv = {}
+  nested = {}
+  for k, v in new.iteritems():
+    if not k in old:
+      setv[k] = v
+    elif isinstance(v, dict) and isinstance(old[k], dict):
+      changes = diffState(old[k], v)
+      if len(changes) > 0:
+        nested[k] = changes
+    elif old[k] != v:
+      setv[k] = v
+  removed = [k for k in old.iterkeys() if not k in new]
+  if len(setv) > 0:
+    res['set'] = setv
+  if len(nested) > 0:
+    res['nested'] = nested
+  if len(removed) > 0:
+    res['remove'] = removed
+  return res
+
+
+def applyDiff(state, changes):
+  '''Applies changes from diffState to the dictionary state in place and 
+  returns it.
+  '''
+  for k in changes.get('remove', []):
+    del state[k]
+  for k, v in changes.get('set', {}).iteritems():
+    state[k] = copy.deepcopy(v)
+  for k, v in changes.get('nested', {}).iteritems():
+    applyDiff(state[k], v)
+  return state
+
+
+class SnapshotStore(object):
+  #Number of snapshots between full keyframes
+  KEYFRAME_INTERVAL = 30
+
+  def __init__(self, folder, keyframe_interval=None):
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.folder = folder
+    self.keyframe_interval = keyframe_interval
+    if self.keyframe_interval is None:
+      self.keyframe_interval = SnapshotStore.KEYFRAME_INTERVAL
+    #[index, state, snapshots since keyframe] of the last snapshot loaded
+    self._cache = None
+    self.segment_folder = os.path.join(self.folder, "segments")
+    self.index_path = os.path.join(self.folder, "index.dat")
+    if not os.path.isdir(self.segment_folder):
+      os.makedirs(self.segment_folder)
+    self._checkIndex()
+
+
+  def _checkIndex(self):
+    '''Drops a partially written trailing index record, e.g. from an
+    interrupted append.
+    '''
+    if not os.path.exists(self.index_path):
+      return
+    size = os.path.getsize(self.index_path)
+    if size % RECORD_SIZE != 0:
+      self.log.warn("Truncating partial record in {0}".format(self.index_path))
+      findex = file(self.index_path, "r+b")
+      findex.truncate(size - size % RECORD_SIZE)
+      findex.close()
+
+
+  def __len__(self):
+    if not os.path.exists(self.index_path):
+      return 0
+    return os.path.getsize(self.index_path) / RECORD_SIZE
+
+
+  def _segmentPath(self, segment):
+    return os.path.join(self.segment_folder, segment + ".jsonl")
+
+
+  def append(self, state, name):
+    '''Appends the state dictionary of an EnvironmentState, stored under name.
+    Snapshots must be appended in timestamp order. The snapshot is stored as
+    a delta against the previous one unless a keyframe is due.
+    '''
+    tstamp = state['meta']['tstamp']
+    if len(name) > 40:
+      raise ValueError("Snapshot name too long: {0}".format(name))
+    #normalize to the form the state takes when loaded back, e.g. string keys
+    state = json.loads(json.dumps(state))
+    n = len(self)
+    since_keyframe = 0
+    if n > 0:
+      if self.entry(n-1)[0] > tstamp:
+        raise ValueError("Snapshot {0} is older than the latest".format(tstamp))
+      previous = self.load(n-1)
+      since_keyframe = self._cache[2] + 1
+    if n == 0 or since_keyframe >= self.keyframe_interval:
+      content = state
+      since_keyframe = 0
+    else:
+      content = {DELTA_KEY: diffState(previous, state)}
+    segment = tstamp[:7]
+    record = json.dumps(content, separators=(',', ':')) + "\n"
+    fseg = file(self._segmentPath(segment), "ab")
+    fseg.seek(0, os.SEEK_END)
+    offset = fseg.tell()
+    fseg.write(record)
+    fseg.close()
+    findex = file(self.index_path, "ab")
+    findex.write(RECORD_FORMAT.format(tstamp, name, segment, offset,
+                                      len(record)))
+    findex.close()
+    self._cache = [n, state, since_keyframe]
+
+
+  def entry(self, i):
+    '''Returns [tstamp, name, segment, offset, length] of the i-th snapshot.
+    '''
+    if i < 0:
+      i += len(self)
+    findex = file(self.index_path, "rb")
+    findex.seek(i * RECORD_SIZE)
+    record = findex.read(RECORD_SIZE)
+    findex.close()
+    if len(record) != RECORD_SIZE:
+      raise IndexError("No snapshot at {0}".format(i))
+    return [record[0:27].strip(),
+            record[28:68].strip(),
+            record[69:85].strip(),
+            int(record[86:100]),
+            int(record[101:111])]
+
+
+  def entries(self, start=0):
+    '''Iterates over index entries from start.
+    '''
+    if len(self) == 0:
+      return
+    findex = file(self.index_path, "rb")
+    findex.seek(start * RECORD_SIZE)
+    while True:
+      record = findex.read(RECORD_SIZE)
+      if len(record) != RECORD_SIZE:
+        break
+      yield [record[0:27].strip(),
+             record[28:68].strip(),
+             record[69:85].strip(),
+             int(record[86:100]),
+             int(record[101:111])]
+    findex.close()
+
+
+  def find(self, tstamp):
+    '''Returns the index of the latest snapshot taken at or before tstamp
+    (a string in EnvironmentState.TIMESTAMP_FORMAT), or -1 if there is none.
+    '''
+    lo = 0
+    hi = len(self)
+    while lo < hi:
+      mid = (lo + hi) / 2
+      if self.entry(mid)[0] <= tstamp:
+        lo = mid + 1
+      else:
+        hi = mid
+    return lo - 1
+
+
+  def _readRecord(self, i):
+    tstamp, name, segment, offset, length = self.entry(i)
+    fseg = file(self._segmentPath(segment), "rb")
+    fseg.seek(offset)
+    record = fseg.read(length)
+    fseg.close()
+    return json.loads(record)
+
+
+  def load(self, i):
+    '''Returns the state dictionary of the i-th snapshot, reconstructed from 
+    the preceding keyframe and deltas.
+    '''
+    if i < 0:
+      i += len(self)
+    if not self._cache is None and self._cache[0] == i:
+      return copy.deepcopy(self._cache[1])
+    deltas = []
+    j = i
+    while True:
+      if not self._cache is None and self._cache[0] == j:
+        state = copy.deepcopy(self._cache[1])
+        since_keyframe = self._cache[2]
+        break
+      record = self._readRecord(j)
+      if not DELTA_KEY in record:
+        state = record
+        since_keyframe = 0
+        break
+      deltas.append(record[DELTA_KEY])
+      j -= 1
+    for changes in reversed(deltas):
+      applyDiff(state, changes)
+    self._cache = [i, state, since_keyframe + len(deltas)]
+    return copy.deepcopy(state)
+
+
+  def asJSON(self, i, outStream, compact=False):
+    '''Writes the i-th snapshot in the form written by EnvironmentState.asJSON
+    and read by EnvironmentState.fromJSON.
+    '''
+    outStream.write(js_output.dumpJS(EnvironmentState.JS_VARIABLE_STATE,
+                                     self.load(i),
+                                     compact=compact))
+
+
+  def get(self, tstamp):
+    '''Returns the state of the latest snapshot taken at or before tstamp, or
+    None.
+    '''
+    i = self.find(tstamp)
+    if i < 0:
+      return None
+    return self.load(i)
+
+
+  def exportViews(self, folder, last=0, overwrite=False, compact=False,
+                  precompress=False):
+    '''Writes index.js and the per-snapshot JS files expected by the web UI to
+    folder. If last is greater than zero only the most recent last snapshots
+    are exported and listed in the index, and the files of older snapshots 
+    are removed from folder, so its size stays bounded. Existing snapshot
+    files are kept unless overwrite is True. compact and precompress are as
+    for js_output.writeJS.
+    '''
+    n = len(self)
+    start = 0
+    if last > 0:
+      start = max(0, n - last)
+    for i, entry in enumerate(self.entries()):
+      if i >= start:
+        break
+      for ext in [""] + js_output.COMPRESSED_EXTENSIONS:
+        dest = os.path.join(folder, entry[1] + ext)
+        if os.path.exists(dest):
+          os.remove(dest)
+    index = []
+    for i, entry in enumerate(self.entries(start=start)):
+      index.append([entry[0], entry[1]])
+      dest = os.path.join(folder, entry[1])
+      if overwrite or not os.path.exists(dest):
+        js_output.writeJS(dest, EnvironmentState.JS_VARIABLE_STATE,
+                          self.load(start + i),
+                          compact=compact,
+                          precompress=precompress)
+    js_output.writeJS(os.path.join(folder, "index.js"),
+                      EnvironmentState.JS_VARIABLE_INDEX, index,
+                      compact=compact,
+                      precompress=precompress)
+    return index
+
+
+  def importViews(self, folder):
+    '''Appends the snapshots listed in folder/index.js that are newer than the
+    latest stored snapshot. Used to migrate an existing state folder.
+    '''
+    jstr = file(os.path.join(folder, "index.js"), "r").read()
+    index = json.loads(jstr[len(EnvironmentState.JS_VARIABLE_INDEX):])
+    latest = ""
+    if len(self) > 0:
+      latest = self.entry(-1)[0]
+    nimported = 0
+    for tstamp, name in sorted(index):
+      if tstamp <= latest:
+        continue
+      try:
+        jbuffer = file(os.path.join(folder, name), "r").read()
+        state = json.loads(jbuffer[len(EnvironmentState.JS_VARIABLE_STATE):])
+      except Exception as e:
+        self.log.error("Unable to import {0}: {1}".format(name, e))
+        continue
+      self.append(state, name)
+      nimported += 1
+    return nimported
@@ -0,0 +1,263 @@
+'''
+Helpers for issuing SOLR queries through the CN query endpoints and pulling
+counts out of the responses.
+
+Responses are requested as JSON (wt=json). When the ijson package is 
+available responses are decoded incrementally and only the requested parts
+of the response are built; otherwise the standard json module is used.
+
+Transient failures, including 5xx responses, are retried by the
+ConnectionPool the client is obtained from (see d1state.resilience). A
+response that is still not successful raises an error rather than being
+decoded.
+'''
+
+import json
+from d1state.resilience import ServerError
+try:
+  import ijson
+  from ijson.common import ObjectBuilder
+except ImportError:
+  ijson = None
+
+
+def _setPath(doc, path, value):
+  keys = path.split('.')
+  for k in keys[:-1]:
+    doc = doc.setdefault(k, {})
+  doc[keys[-1]] = value
+
+
+def _selectFields(doc, fields):
+  '''Returns a copy of doc holding only the dotted paths listed in fields.
+  '''
+  res = {}
+  for path in fields:
+    value = doc
+    try:
+      for k in path.split('.'):
+        value = value[k]
+    except (KeyError, TypeError):
+      continue
+    _setPath(res, path, value)
+  return res
+
+
+def _streamFields(stream, fields):
+  '''Incrementally parses the JSON document in stream, building only the
+  values found at the dotted paths listed in fields.
+  '''
+  res = {}
+  builder = None
+  depth = 0
+  current = None
+  for prefix, event, value in ijson.parse(stream):
+    if builder is None:
+      if not prefix in fields:
+        continue
+      if event in ('start_map', 'start_array'):
+        builder = ObjectBuilder()
+        builder.event(event, value)
+        depth = 1
+        current = prefix
+      elif not event in ('end_map', 'end_array', 'map_key'):
+        _setPath(res, prefix, value)
+      continue
+    builder.event(event, value)
+    if event in ('start_map', 'start_array'):
+      depth += 1
+    elif event in ('end_map', 'end_array'):
+      depth -= 1
+      if depth == 0:
+        _setPath(res, current, builder.value)
+        builder = None
+  return res
+
+
+def decodeResponse(stream, fields=None):
+  '''Decodes a SOLR JSON response read from stream. If fields, a list of 
+  dotted paths such as "response.numFound" or "facet_counts.facet_fields", 
+  is provided then only those parts of the response are returned.
+  '''
+  if fields is None:
+    return json.load(stream)
+  if ijson is None:
+    return _selectFields(json.load(stream), fields)
+  return _streamFields(stream, fields)
+
+
+def query(client, params, engine='solr', fields=None):
+  '''Returns the decoded response of a query against the CN query engine
+  (solr or logsolr). params is a dictionary of SOLR request parameters;
+  entries with a value of None are dropped and list values are sent as
+  repeated parameters. fields limits the decoded content, see 
+  decodeResponse.
+  '''
+  params = dict((k, v) for k, v in params.iteritems() if not v is None)
+  params['wt'] = 'json'
+  params['omitHeader'] = 'true'
+  url = client._rest_url('query/{0}/'.format(engine))
+  response = client.GET(url, params)
+  status = getattr(response, 'status', 200)
+  if status != 200:
+    response.read()
+    if status >= 500:
+      raise ServerError(status, url)
+    raise IOError("HTTP {0} from {1}".format(status, url))
+  return decodeResponse(response, fields=fields)
+
+
+def numFound(client, q='*:*', fq=None, engine='solr'):
+  '''Returns the number of records matching q and fq.
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'fl': 'id',
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['response.numFound'])
+  return results['response']['numFound']
+
+
+def firstDoc(client, q='*:*', fq=None, fl=None, sort=None, engine='solr'):
+  '''Returns the first document matching q and fq in sort order, or None if
+  there are no matches.
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 1,
+            'fl': fl,
+            'sort': sort,
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['response.docs'])
+  docs = results.get('response', {}).get('docs', [])
+  if len(docs) == 0:
+    return None
+  return docs[0]
+
+
+def facetCounts(results, field):
+  '''Returns a dictionary of {value: count} for the facet on field in a
+  decoded SOLR response.
+  '''
+  flat = results['facet_counts']['facet_fields'][field]
+  return dict(zip(flat[0::2], flat[1::2]))
+
+
+def countByFacet(client, field, q='*:*', fq=None, engine='solr'):
+  '''Returns {value: count} for every value of field among the records
+  matching q and fq, using a single faceted request. Values with no matching
+  records are not included.
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'facet': 'true',
+            'facet.field': field,
+            'facet.limit': -1,
+            'facet.mincount': 1,
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['facet_counts.facet_fields'])
+  return facetCounts(results, field)
+
+
+def countByQueries(client, queries, q='*:*', fq=None, engine='solr'):
+  '''Returns {query: count} for each entry of queries, evaluated as 
+  facet.query against the records matching q and fq in a single request.
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'facet': 'true',
+            'facet.query': list(queries),
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['facet_counts.facet_queries'])
+  return results['facet_counts']['facet_queries']
+
+
+def _pivotTree(entries):
+  res = {}
+  for entry in entries:
+    res[entry['value']] = [entry['count'], _pivotTree(entry.get('pivot', []))]
+  return res
+
+
+def countByPivot(client, fields, q='*:*', fq=None, engine='solr'):
+  '''Returns the counts for the records matching q and fq pivoted on the list
+  of fields (e.g. ['formatType', 'formatId']), using a single request. The 
+  result is nested as {value: [count, {value of next field: [count, ...]}]},
+  with an empty dictionary below the last field.
+  '''
+  pivot = ",".join(fields)
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'facet': 'true',
+            'facet.pivot': pivot,
+            'facet.limit': -1,
+            'facet.pivot.mincount': 1,
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['facet_counts.facet_pivot'])
+  return _pivotTree(results['facet_counts']['facet_pivot'].get(pivot, []))
+
+
+def checkPivot(tree):
+  '''Returns [value, count, sum of the counts below it] for each entry of a
+  countByPivot result whose count differs from the sum of its children. An
+  empty list means the pivot is consistent.
+  '''
+  res = []
+  for value, (count, children) in tree.iteritems():
+    if len(children) == 0:
+      continue
+    nsum = sum([child[0] for child in children.itervalues()])
+    if nsum != count:
+      res.append([value, count, nsum])
+    res += checkPivot(children)
+  return res
+
+
+def countByRange(client, field, start, end, gap, q='*:*', fq=None, 
+                 include=None, engine='solr'):
+  '''Returns {bucket_start: count} for the range facet of field from start to
+  end in steps of gap (SOLR date math, e.g. "+1DAY"), using a single request.
+  include is passed through as facet.range.include. Bucket keys are the start
+  values as reported by SOLR.
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'facet': 'true',
+            'facet.range': field,
+            'facet.range.start': start,
+            'facet.range.end': end,
+            'facet.range.gap': gap,
+            'facet.range.include': include,
+            'facet.mincount': 0,
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['facet_counts.facet_ranges'])
+  flat = results['facet_counts']['facet_ranges'][field]['counts']
+  return dict(zip(flat[0::2], flat[1::2]))
+
+
+def fieldStats(client, field, q='*:*', fq=None, facet=None, engine='solr'):
+  '''Returns the stats component summary (min, max, count, ...) of a numeric
+  field for the records matching q and fq. If facet is provided, the summary 
+  also contains per value statistics under ['facets'][facet].
+  '''
+  params = {'q': q,
+            'fq': fq,
+            'rows': 0,
+            'stats': 'true',
+            'stats.field': field,
+            'stats.facet': facet,
+            }
+  results = query(client, params, engine=engine, 
+                  fields=['stats.stats_fields'])
+  return results['stats']['stats_fields'][field]
@@ -0,0 +1,550 @@
+'''
+A local stand-in for a DataONE Coordinating Node and its Member Nodes, used to
+measure the state collection code without touching a production environment.
+
+The server answers the requests made by EnvironmentState and objectcounts.py:
+
+  /cn/v1/formats           listFormats
+  /cn/v1/node              listNodes
+  /cn/v1/object            listObjects (paged, or count=0 totals by format)
+  /cn/v1/log               getLogRecords (totals)
+  /cn/v1/query/solr/       SOLR queries, JSON responses
+  /cn/v1/query/logsolr/    log SOLR queries, JSON responses
+  /mn/<n>/v1/object        Member Node listObjects
+
+Any API version (v1, v1.1, v2) is accepted in the path. Content is synthetic
+but deterministic for a given seed: nformats object formats, nnodes member
+nodes, and counts derived from the query terms. A fixed latency can be added
+to every response, a fraction of responses can fail with a ServiceFailure or
+a dropped connection, and the first dead_nodes member nodes drop every
+request.
+
+Requests and response bytes are counted per endpoint, see getStats. Typical
+use::
+
+  server = StandInServer(nformats=200, nnodes=40, latency=0.05)
+  server.start()
+  state = EnvironmentState(server.baseurl)
+  ...
+  server.stop()
+'''
+
+import time
+import re
+import json
+import math
+import bisect
+import zlib
+import random
+import logging
+import datetime
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+from xml.sax.saxutils import escape
+
+TYPES_NS = "http://ns.dataone.org/service/types/v1"
+FORMAT_TYPES = ['DATA', 'METADATA', 'RESOURCE']
+LOG_EVENTS = ['create', 'read', 'update', 'delete', 'replicate',
+              'synchronization_failed', 'replication_failed']
+SOLR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+XML_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.000+00:00"
+LISTOBJECTS_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+#Seconds between the modification times of consecutive stand-in objects
+OBJECT_SPACING = 60
+
+
+def _termFraction(term):
+  '''Returns a deterministic fraction in [0.5, 1.0) for a query term, used to
+  scale counts for restricted queries.
+  '''
+  if term is None or term == '*:*':
+    return 1.0
+  return 0.5 + (zlib.crc32(term) & 0xff) / 512.0
+
+
+def _parseSOLRDate(value):
+  return datetime.datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+class StandInData(object):
+  '''The synthetic content served by the stand-in.
+  '''
+
+  def __init__(self, nformats=100, nnodes=20, seed=1):
+    rnd = random.Random(seed)
+    #[formatId, formatType, number of objects, mean size]
+    self.formats = []
+    for i in xrange(0, nformats):
+      self.formats.append(["format/{0:04d}".format(i),
+                           FORMAT_TYPES[i % len(FORMAT_TYPES)],
+                           int(rnd.paretovariate(1.2) * 100),
+                           rnd.randint(1000, 10000000)])
+    #[nodeId, number of objects]
+    self.nodes = []
+    for i in xrange(0, nnodes):
+      self.nodes.append(["urn:node:STANDIN{0:03d}".format(i),
+                         rnd.randint(0, 500000)])
+    self.events = dict((e, rnd.randint(10, 100000)) for e in LOG_EVENTS)
+    #objects are listed in formats order, one modified every OBJECT_SPACING
+    #seconds up to when the content was created
+    self.created = datetime.datetime.utcnow()
+    self._format_ends = []
+    n = 0
+    for fmt in self.formats:
+      n += fmt[2]
+      self._format_ends.append(n)
+
+
+  def objectAt(self, i):
+    '''Returns [identifier, formatId, dateSysMetadataModified] of the i-th
+    object in listObjects order.
+    '''
+    fmt = self.formats[bisect.bisect_right(self._format_ends, i)]
+    modified = self.created - datetime.timedelta(
+                 seconds=(self.total() - i) * OBJECT_SPACING)
+    return ["standin.{0:08d}".format(i), fmt[0], modified]
+
+
+  def objectRange(self, from_date=None, to_date=None):
+    '''Returns the [first, last + 1] indexes of the objects modified between
+    from_date and to_date (datetimes or None).
+    '''
+    n = self.total()
+    lo = 0
+    hi = n
+    if not from_date is None:
+      seconds = (self.created - from_date).total_seconds()
+      lo = max(0, n - int(math.floor(seconds / OBJECT_SPACING)))
+    if not to_date is None:
+      seconds = (self.created - to_date).total_seconds()
+      hi = min(n, n - int(math.ceil(seconds / OBJECT_SPACING)) + 1)
+    return [lo, max(lo, hi)]
+
+
+  def total(self):
+    return sum([f[2] for f in self.formats])
+
+
+  def fraction(self, params):
+    f = 1.0
+    for term in params.get('q', []) + params.get('fq', []):
+      f *= _termFraction(term)
+    return f
+
+
+  def formatCounts(self, params):
+    f = self.fraction(params)
+    return [[fmt[0], int(fmt[2] * f)] for fmt in self.formats]
+
+
+  def facetField(self, field, params):
+    if field == 'formatId':
+      return self.formatCounts(params)
+    if field == 'formatType':
+      res = dict((t, 0) for t in FORMAT_TYPES)
+      for fmt, n in zip(self.formats, self.formatCounts(params)):
+        res[fmt[1]] += n[1]
+      return sorted(res.items())
+    if field == 'event':
+      f = self.fraction(params)
+      return [[e, int(n * f)] for e, n in sorted(self.events.iteritems())]
+    return []
+
+
+  def fieldStats(self, field, params):
+    f = self.fraction(params)
+    count = int(self.total() * f)
+    sizes = [fmt[3] for fmt in self.formats]
+    res = {'min': min(sizes) / 10,
+           'max': max(sizes) * 10,
+           'count': count,
+           'missing': 0,
+           'sum': sum([fmt[2] * fmt[3] for fmt in self.formats]) * f,
+           }
+    res['mean'] = res['sum'] / max(1, count)
+    return res
+
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self, address=('127.0.0.1', 0), nformats=100, nnodes=20,
+               latency=0.0, failure_rate=0.0, drop_rate=0.0, dead_nodes=0,
+               seed=1):
+    BaseHTTPServer.HTTPServer.__init__(self, address, StandInHandler)
+    self.log = logging.getLogger(str(self.__class__.__name__))
+    self.data = StandInData(nformats=nformats, nnodes=nnodes, seed=seed)
+    self.latency = latency
+    self.failure_rate = failure_rate
+    self.drop_rate = drop_rate
+    self.dead_nodes = dead_nodes
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+    self._thread = None
+    self.resetStats()
+
+
+  @property
+  def rooturl(self):
+    return "http://{0}:{1}".format(self.server_address[0],
+                                   self.server_address[1])
+
+
+  @property
+  def baseurl(self):
+    '''Base URL of the stand-in CN.
+    '''
+    return self.rooturl + "/cn"
+
+
+  def nodeURL(self, i):
+    return "{0}/mn/{1}".format(self.rooturl, i)
+
+
+  def start(self):
+    '''Serves requests in a background thread.
+    '''
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.daemon = True
+    self._thread.start()
+    self.log.info("Stand-in CN at {0}".format(self.baseurl))
+
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+
+  def resetStats(self):
+    with self._lock:
+      self._stats = {'requests': 0,
+                     'bytes': 0,
+                     'failures': 0,
+                     'endpoints': {}, }
+
+
+  def count(self, endpoint, nbytes, failed=False):
+    with self._lock:
+      self._stats['requests'] += 1
+      self._stats['bytes'] += nbytes
+      if failed:
+        self._stats['failures'] += 1
+      counts = self._stats['endpoints'].setdefault(endpoint, [0, 0])
+      counts[0] += 1
+      counts[1] += nbytes
+
+
+  def getStats(self):
+    '''Returns {'requests', 'bytes', 'failures', 'endpoints': {endpoint:
+    [requests, bytes]}} since the last resetStats.
+    '''
+    with self._lock:
+      res = dict(self._stats)
+      res['endpoints'] = dict((k, list(v)) for k, v
+                              in self._stats['endpoints'].iteritems())
+      return res
+
+
+  def injectFailure(self):
+    '''Returns None, "drop" or "fail" for the next response.
+    '''
+    with self._lock:
+      r = self._random.random()
+    if r < self.drop_rate:
+      return "drop"
+    if r < self.drop_rate + self.failure_rate:
+      return "fail"
+    return None
+
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, format, *args):
+    logging.debug(format % args)
+
+
+  def _send(self, endpoint, status, content_type, body, failed=False):
+    self.send_response(status)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+    self.server.count(endpoint, len(body), failed=failed)
+
+
+  def _sendError(self, endpoint, status, name, description, failed=False):
+    body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<error name="{0}" errorCode="{1}" detailCode="0">'
+            '<description>{2}</description></error>')\
+           .format(name, status, escape(description))
+    self._send(endpoint, status, "text/xml", body, failed=failed)
+
+
+  def _drop(self, endpoint):
+    self.server.count(endpoint, 0, failed=True)
+    self.close_connection = 1
+
+
+  def do_GET(self):
+    url = urlparse.urlparse(self.path)
+    params = urlparse.parse_qs(url.query)
+    parts = [p for p in url.path.split('/') if p != '']
+    if self.server.latency > 0:
+      time.sleep(self.server.latency)
+    #/mn/<n>/<version>/<resource>
+    if len(parts) >= 4 and parts[0] == 'mn':
+      self.doMN(int(parts[1]), '/'.join(parts[3:]), params)
+      return
+    #/cn/<version>/<resource>
+    if len(parts) >= 3 and parts[0] == 'cn':
+      self.doCN('/'.join(parts[2:]), params)
+      return
+    self._sendError('unknown', 404, 'NotFound', self.path)
+
+
+  def doMN(self, i, resource, params):
+    endpoint = 'mn/' + resource
+    if i < self.server.dead_nodes:
+      self._drop(endpoint)
+      return
+    if resource != 'object' or i >= len(self.server.data.nodes):
+      self._sendError(endpoint, 404, 'NotFound', self.path)
+      return
+    self._sendObjectList(endpoint, self.server.data.nodes[i][1])
+
+
+  def doCN(self, resource, params):
+    endpoint = resource.rstrip('/')
+    failure = self.server.injectFailure()
+    if failure == "drop":
+      self._drop(endpoint)
+      return
+    if failure == "fail":
+      self._sendError(endpoint, 500, 'ServiceFailure', 'Injected failure',
+                      failed=True)
+      return
+    if endpoint == 'formats':
+      self._sendFormats(endpoint)
+    elif endpoint == 'node':
+      self._sendNodes(endpoint)
+    elif endpoint == 'object':
+      fmt = params.get('formatId', params.get('objectFormat', [None]))[0]
+      if not fmt is None:
+        total = 0
+        for f in self.server.data.formats:
+          if f[0] == fmt:
+            total = f[2]
+        self._sendObjectList(endpoint, total)
+      else:
+        self._sendObjects(endpoint, params)
+    elif endpoint == 'log':
+      total = int(sum(self.server.data.events.values()) *
+                  self.server.data.fraction(params))
+      self._sendList(endpoint, 'log', total)
+    elif endpoint in ('query/solr', 'query/logsolr'):
+      self._sendSOLR(endpoint, params)
+    else:
+      self._sendError(endpoint, 404, 'NotFound', self.path)
+
+
+  def _sendList(self, endpoint, element, total):
+    body = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<ns1:{0} xmlns:ns1="{1}" count="0" start="0" total="{2}"/>')\
+           .format(element, TYPES_NS, total)
+    self._send(endpoint, 200, "text/xml", body)
+
+
+  def _sendObjectList(self, endpoint, total):
+    self._sendList(endpoint, 'objectList', total)
+
+
+  def _sendObjects(self, endpoint, params):
+    '''ListObjects over all formats, honouring start, count, fromDate and
+    toDate.
+    '''
+    data = self.server.data
+    dates = []
+    for key in ['fromDate', 'toDate']:
+      value = params.get(key, [None])[0]
+      if not value is None:
+        value = datetime.datetime.strptime(value[:19], LISTOBJECTS_DATE_FORMAT)
+      dates.append(value)
+    lo, hi = data.objectRange(dates[0], dates[1])
+    start = lo + int(params.get('start', ['0'])[0])
+    end = min(hi, start + int(params.get('count', ['1000'])[0]))
+    body = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<ns1:objectList xmlns:ns1="{0}" count="{1}" start="{2}" '
+            'total="{3}">'.format(TYPES_NS, max(0, end - start), start - lo,
+                                  hi - lo)]
+    for i in xrange(start, end):
+      identifier, formatId, modified = data.objectAt(i)
+      body.append('<objectInfo><identifier>{0}</identifier>'
+                  '<formatId>{1}</formatId>'
+                  '<checksum algorithm="MD5">{2:032x}</checksum>'
+                  '<dateSysMetadataModified>{3}</dateSysMetadataModified>'
+                  '<size>{4}</size></objectInfo>'\
+                  .format(identifier, escape(formatId), i,
+                          modified.strftime(XML_DATE_FORMAT), i % 100000))
+    body.append('</ns1:objectList>')
+    self._send(endpoint, 200, "text/xml", "".join(body))
+
+
+  def _sendFormats(self, endpoint):
+    formats = self.server.data.formats
+    body = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<ns1:objectFormatList xmlns:ns1="{0}" count="{1}" start="0" '
+            'total="{1}">'.format(TYPES_NS, len(formats))]
+    for fmt in formats:
+      body.append('<objectFormat><formatId>{0}</formatId>'
+                  '<formatName>Stand-in {0}</formatName>'
+                  '<formatType>{1}</formatType></objectFormat>'\
+                  .format(escape(fmt[0]), fmt[1]))
+    body.append('</ns1:objectFormatList>')
+    self._send(endpoint, 200, "text/xml", "".join(body))
+
+
+  def _sendNodes(self, endpoint):
+    harvested = datetime.datetime.utcnow().strftime(XML_DATE_FORMAT)
+    body = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+            '<ns1:nodeList xmlns:ns1="{0}">'.format(TYPES_NS),
+            '<node replicate="false" synchronize="false" type="cn" '
+            'state="up"><identifier>urn:node:CNSTANDIN</identifier>'
+            '<name>Stand-in CN</name><description>Stand-in CN</description>'
+            '<baseURL>{0}</baseURL>'
+            '<subject>CN=urn:node:CNSTANDIN</subject>'
+            '<contactSubject>CN=standin</contactSubject></node>'\
+            .format(self.server.baseurl)]
+    for i, node in enumerate(self.server.data.nodes):
+      body.append('<node replicate="false" synchronize="true" type="mn" '
+                  'state="up"><identifier>{0}</identifier>'
+                  '<name>Stand-in MN {1}</name>'
+                  '<description>Stand-in MN {1}</description>'
+                  '<baseURL>{2}</baseURL>'
+                  '<synchronization>'
+                  '<schedule hour="*" mday="*" min="0" mon="*" sec="0" '
+                  'wday="?" year="*"/>'
+                  '<lastHarvested>{3}</lastHarvested>'
+                  '<lastCompleteHarvest>{3}</lastCompleteHarvest>'
+                  '</synchronization>'
+                  '<subject>CN={0}</subject>'
+                  '<contactSubject>CN=standin</contactSubject></node>'\
+                  .format(node[0], i, self.server.nodeURL(i), harvested))
+    body.append('</ns1:nodeList>')
+    self._send(endpoint, 200, "text/xml", "".join(body))
+
+
+  def _sendSOLR(self, endpoint, params):
+    data = self.server.data
+    numFound = int(data.total() * data.fraction(params))
+    res = {'response': {'numFound': numFound, 'start': 0, 'docs': []}}
+    rows = int(params.get('rows', ['10'])[0])
+    for i in xrange(0, min(rows, numFound, 100)):
+      res['response']['docs'].append({'id': "standin.{0}".format(i)})
+    if params.get('facet', ['false'])[0] == 'true':
+      facets = {'facet_queries': {},
+                'facet_fields': {},
+                'facet_ranges': {},
+                'facet_pivot': {}, }
+      for field in params.get('facet.field', []):
+        flat = []
+        for value, n in data.facetField(field, params):
+          flat += [value, n]
+        facets['facet_fields'][field] = flat
+      for q in params.get('facet.query', []):
+        facets['facet_queries'][q] = int(numFound * _termFraction(q))
+      for field in params.get('facet.range', []):
+        facets['facet_ranges'][field] = self._facetRange(field, params)
+      for pivot in params.get('facet.pivot', []):
+        facets['facet_pivot'][pivot] = self._facetPivot(pivot, params)
+      res['facet_counts'] = facets
+    if params.get('stats', ['false'])[0] == 'true':
+      stats = {}
+      for field in params.get('stats.field', []):
+        stats[field] = data.fieldStats(field, params)
+        for facet in params.get('stats.facet', []):
+          values = {}
+          for value, n in data.facetField(facet, params):
+            values[value] = data.fieldStats(field, {'q': [value]})
+          stats[field].setdefault('facets', {})[facet] = values
+      res['stats'] = {'stats_fields': stats}
+    self._send(endpoint, 200, "application/json", json.dumps(res))
+
+
+  def _facetPivot(self, pivot, params):
+    '''Returns the pivot for formatType,formatId; other pivots are empty.
+    '''
+    if pivot != 'formatType,formatId':
+      return []
+    res = []
+    counts = self.server.data.formatCounts(params)
+    for ftype in FORMAT_TYPES:
+      children = [{'field': 'formatId', 'value': fmt[0], 'count': n[1]}
+                  for fmt, n in zip(self.server.data.formats, counts)
+                  if fmt[1] == ftype and n[1] > 0]
+      total = sum([c['count'] for c in children])
+      if total > 0:
+        res.append({'field': 'formatType', 'value': ftype, 'count': total,
+                    'pivot': children})
+    return res
+
+
+  def _facetRange(self, field, params):
+    '''Returns buckets between facet.range.start and facet.range.end. Only
+    gaps of whole days (+1DAY, +7DAYS) are supported.
+    '''
+    t = _parseSOLRDate(params['facet.range.start'][0])
+    tend = _parseSOLRDate(params['facet.range.end'][0])
+    gap = params.get('facet.range.gap', ['+1DAY'])[0]
+    step = datetime.timedelta(days=int(re.match(r"\+(\d+)DAY", gap).group(1)))
+    base = int(self.server.data.total() * self.server.data.fraction(params))
+    counts = []
+    while t < tend:
+      key = t.strftime("%Y-%m-%dT%H:%M:%SZ")
+      counts += [key, int(base * _termFraction(key) / 50)]
+      t += step
+    return {'counts': counts,
+            'gap': gap,
+            'start': params['facet.range.start'][0],
+            'end': params['facet.range.end'][0], }
+
+
+
+#===============================================================================
+if __name__ == "__main__":
+  from optparse import OptionParser
+  parser = OptionParser(usage="%prog [options]")
+  parser.add_option("-p","--port", dest="port", default=8080, type="int",
+                    help="Port to listen on (8080)")
+  parser.add_option("-f","--formats", dest="nformats", default=100,
+                    type="int", help="Number of object formats (100)")
+  parser.add_option("-n","--nodes", dest="nnodes", default=20, type="int",
+                    help="Number of member nodes (20)")
+  parser.add_option("-t","--latency", dest="latency", default=0.0,
+                    type="float", help="Seconds added to each response (0)")
+  parser.add_option("-F","--failure-rate", dest="failure_rate", default=0.0,
+                    type="float", help="Fraction of CN responses that fail (0)")
+  parser.add_option("-X","--drop-rate", dest="drop_rate", default=0.0,
+                    type="float",
+                    help="Fraction of CN connections dropped (0)")
+  parser.add_option("-D","--dead-nodes", dest="dead_nodes", default=0,
+                    type="int", help="Number of unresponsive member nodes (0)")
+  (options, args) = parser.parse_args()
+  logging.basicConfig(level=logging.INFO)
+  server = StandInServer(address=('127.0.0.1', options.port),
+                         nformats=options.nformats,
+                         nnodes=options.nnodes,
+                         latency=options.latency,
+                         failure_rate=options.failure_rate,
+                         drop_rate=options.drop_rate,
+                         dead_nodes=options.dead_nodes)
+  logging.info("Stand-in CN at {0}".format(server.baseurl))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    server.server_close()
@@ -11,6 +11,7 @@ state view, or can be loaded back into the Python structure for additional
 processing.
 '''
 
+import time
 import logging
 import pprint
 import datetime
@@ -18,10 +19,20 @@ import json
 import socket
 import httplib
 import math
+import errno
+import urlparse
+import threading
+import numpy
 import dns.resolver
 import d1_common.types.exceptions
-from d1_client import cnclient, cnclient_1_1
 from d1_client import mnclient
+from d1state import connections
+from d1state.metadata_cache import MetadataCache
+from d1state import mjd
+from d1state import solr
+from d1state import workers
+from d1state import js_output
+from d1state.resilience import Resilience, CircuitOpenError, hostOf
 
 
 def getNow(asDate=False):
@@ -51,22 +62,39 @@ def dateTimeToSOLRTime(dt):
   return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
   
 
-def escapeQueryTerm(term):
+def historyDays(start, end, ndays):
+  '''Returns the label ("YYYY-MM-DD") of each bucket of ndays days from start
+  (midnight) up to end, the last day covered by the bucket. A final partial
+  bucket is labelled with the day of end, or the day before if end is
+  midnight.
   '''
-  + - && || ! ( ) { } [ ] ^ " ~ * ? : \
-  '''
-  reserved = ['+','-','&','|','!','(',')','{','}','[',']','^','"','~','*','?',':',]
-  term = term.replace(u'\\',u'\\\\')
-  for c in reserved:
-    term = term.replace(c,u"\%s" % c)
-  return term
+  last = (end - datetime.timedelta(microseconds=1)).date()
+  step = datetime.timedelta(days=ndays)
+  res = []
+  t = start
+  while t < end:
+    day = min((t + step - datetime.timedelta(days=1)).date(), last)
+    res.append(day.strftime("%Y-%m-%d"))
+    t += step
+  return res
+
 
 class NodeState(object):
+  #objectcount reported when a probe does not complete within its deadline
+  DEADLINE_EXCEEDED = -1000 - errno.ETIMEDOUT
   
-  def __init__(self, baseURL):
+  def __init__(self, baseURL, timeout=None, resilience=None):
     self.log = logging.getLogger(str(self.__class__.__name__))
     self.baseurl = baseURL
-    self.clientv1 = mnclient.MemberNodeClient( self.baseurl )
+    #Retries and the per host circuit breaker, usually shared by all nodes
+    self.resilience = resilience
+    if self.resilience is None:
+      self.resilience = Resilience()
+    if timeout is None:
+      self.clientv1 = mnclient.MemberNodeClient( self.baseurl )
+    else:
+      self.clientv1 = mnclient.MemberNodeClient( self.baseurl, 
+                                                 timeout=timeout )
 
   
   def count(self):
@@ -93,10 +121,18 @@ exception httplib.CannotSendRequest -17
 exception httplib.CannotSendHeader -18
 exception httplib.ResponseNotReady -19
 exception httplib.BadStatusLine -20
+exception resilience.CircuitOpenError -22
+
+    Transient failures are retried with backoff by self.resilience before
+    an error code is returned.
     '''
     try:
-      res = self.clientv1.listObjects(start=0, count=0)
+      res = self.resilience.call('mn.listObjects', hostOf(self.baseurl),
+                                 self.clientv1.listObjects, start=0, count=0)
       return res.total
+    except CircuitOpenError as e:
+      self.log.error(e)
+      return -22
     except d1_common.types.exceptions.NotAuthorized as e:
       self.log.error(e)
       return -401
@@ -164,13 +200,25 @@ exception httplib.BadStatusLine -20
 
 class EnvironmentState(object):
   #increment the version flag if there's a change to the generated data structure  
-  VERSION = "18"
+  VERSION = "19"
+  #Number of member nodes probed concurrently by getNodes
+  NODE_WORKERS = 10
+  #Seconds allowed for a single member node count before it is abandoned
+  NODE_TIMEOUT = 120
+  #Seconds allowed for resolving a host name in getDNSInfo
+  DNS_TIMEOUT = 5.0
+  #Number of days covered by each range faceted request in getLogHistory
+  LOG_HISTORY_CHUNK_DAYS = 366
   COUNT_PUBLIC = None
   COUNT_PUBLIC_CURRENT = "-obsoletedBy:[* TO *]"
   TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.0+00:00"
   JS_VARIABLE_STATE = "var env_state = "
   JS_VARIABLE_INDEX = "var env_state_index = "
   JS_VARIABLE_NODES = "var node_state_index = "
+  JS_VARIABLE_HISTORY = "var count_history = "
+  JS_VARIABLE_ROLLUP = "var state_rollup = "
+  #Days per bucket for the intervals supported by getCountHistory
+  HISTORY_INTERVALS = {'day': 1, 'week': 7}
   #TODO: These IP addresses are specific to the production environment and 
   #include changes to UCSB and ORC
   CN_IP_ADDRESSES = ['160.36.134.71',
@@ -194,10 +242,18 @@ class EnvironmentState(object):
                ]
 
   
-  def __init__(self, baseurl, cert_path=None):
+  def __init__(self, baseurl, cert_path=None, 
+               node_workers=None, node_timeout=None, pool=None,
+               metadata_cache=None, object_tally=None):
     self.log = logging.getLogger(str(self.__class__.__name__))
     self.log.debug("Initializing...")
     self.baseurl = baseurl
+    self.node_workers = node_workers
+    if self.node_workers is None:
+      self.node_workers = EnvironmentState.NODE_WORKERS
+    self.node_timeout = node_timeout
+    if self.node_timeout is None:
+      self.node_timeout = EnvironmentState.NODE_TIMEOUT
     self.state = {'meta':None,
                   'formats':None,
                   'nodes':None,
@@ -206,18 +262,71 @@ class EnvironmentState(object):
                   'dns': None,
                   'logs': None,
                   }
-    self.clientv1 = cnclient.CoordinatingNodeClient( self.baseurl, 
-                                                     cert_path=cert_path )
-    self.clientv11 = cnclient_1_1.CoordinatingNodeClient( self.baseurl,
-                                                          cert_path=cert_path )
+    #CN clients are shared through a connection pool, which may be provided
+    #to reuse connections across several EnvironmentState instances
+    self.pool = pool
+    if self.pool is None:
+      self.pool = connections.ConnectionPool( self.baseurl, 
+                                              cert_path=cert_path )
+    #Retry statistics and circuit breakers for both CN and MN calls
+    self.resilience = self.pool.resilience
+    #Per endpoint request timings, may be None
+    self.instrumentation = self.resilience.instrumentation
+    #Format and node registries are read through an on-disk cache
+    self.metadata = metadata_cache
+    if self.metadata is None:
+      self.metadata = MetadataCache( self.baseurl, pool=self.pool )
+    #{count column: {formatType: count}} reported by SOLR in getCounts
+    self.type_totals = {}
+    #Optional ObjectTally used for the listObjects counts
+    self.object_tally = object_tally
+    #{host: resolveHost result}, cleared at the start of each populateState
+    self._dns_cache = {}
+    self._dns_lock = threading.Lock()
+
+
+  @property
+  def clientv1(self):
+    return self.pool.client('v1')
+
+
+  @property
+  def clientv11(self):
+    return self.pool.client('v1.1')
 
 
   def __str__(self):
     return pprint.pformat( self.state )
 
 
+  def _statePhases(self):
+    '''Returns the phases of populateState as [name, func, dependencies] for
+    workers.runPhases. Phases store their result in self.state as they 
+    complete so that dependent phases can use it.
+    '''
+    def setState(key, func):
+      def _phase():
+        self.state[key] = func()
+        return self.state[key]
+      return _phase
+
+    return [['formats', setState('formats', self.getFormats), []],
+            ['nodes', setState('nodes', self.getNodes), []],
+            ['dns', setState('dns', self.getDNSInfo), ['nodes']],
+            ['logs', setState('logs', self.getLogSummary), []],
+            ['counts', setState('counts', self.getCounts), ['formats']],
+            ['summary', self.summarizeCounts, ['counts']],
+            ['sizes', self.getObjectTypeSizeHistogram, []],
+           ]
+
+
   def populateState(self):
     '''Populates self.state with current environment status
+    
+    Independent phases (see _statePhases) are retrieved concurrently, so the
+    elapsed time is about that of the longest chain of dependent phases.
+    The duration of each phase and the requests made by endpoint are 
+    recorded in state['meta']['timings'].
     '''
     self.tstamp = getNow()
     meta = {'tstamp': getNowString(self.tstamp),
@@ -228,28 +337,45 @@ class EnvironmentState(object):
                            2:EnvironmentState.COUNT_PUBLIC_CURRENT}
             }
     self.state['meta'] = meta
-    self.state['formats'] = self.getFormats()
-    self.state['nodes'] = self.getNodes()
-    self.state['dns'] = self.getDNSInfo()
-    self.state['logs'] = self.getLogSummary()
-    self.state['counts'] = self.getCounts()
-    self.state['summary'] = self.summarizeCounts()
-    self.state['summary']['sizes'] = self.getObjectTypeSizeHistogram()
-    
-    
-  def retrieveLogResponse(self, q, fq=None):
-    self.clientv1.connection.close()
-    url = self.clientv1._rest_url('log')
-    query = {'q': q}
-    if not fq is None:
-      query['fq'] = fq
-    #logging.info("URL = %s" % url)
-    response = self.clientv1.GET(url, query)
-    logrecs = self.clientv1._read_dataone_type_response(response)
-    return logrecs.total
+    self.resilience.reset()
+    self.clearDNSCache()
+    if not self.instrumentation is None:
+      self.instrumentation.reset()
+    phase_timings = {}
+    t0 = time.time()
+    try:
+      results = workers.runPhases(self._statePhases(), timings=phase_timings)
+    finally:
+      meta['retries'] = self.resilience.getStats()
+      meta['timings'] = {'started': t0,
+                         'seconds': time.time() - t0,
+                         'phases': phase_timings,
+                         'requests': {}, }
+      if not self.instrumentation is None:
+        meta['timings']['requests'] = self.instrumentation.getStats()
+    self.state['summary'] = results['summary']
+    self.state['summary']['sizes'] = results['sizes']
+    self.log.info("Connections: {0}".format(self.pool.getStats()))
     
     
+  @staticmethod
+  def logEventQuery(event):
+    '''Returns the logsolr q for an entry of LOG_EVENTS. Events with a .ext
+    suffix exclude accesses originating from the CNs.
+    '''
+    if event.endswith('.ext'):
+      exclude_cns = "-ipAddress:({0})"\
+                      .format( " OR ".join(EnvironmentState.CN_IP_ADDRESSES))
+      return "event:{0} AND {1}".format(event.split(".")[0], exclude_cns)
+    return "event:{0}".format(event)
+
+
   def getLogSummary(self):
+    '''Returns counts of log events over each reporting period. 
+    
+    One logsolr request faceted on event is made per period, and one request
+    with a facet.query per period for each .ext event.
+    '''
     periods = [['Day', 'dateLogged:[NOW-1DAY TO NOW]', 'Past day'],
                ['Week', 'dateLogged:[NOW-7DAY TO NOW]', 'Past week'],
                ['Month', 'dateLogged:[NOW-1MONTH TO NOW]', 'Past month'],
@@ -259,36 +385,143 @@ class EnvironmentState(object):
     res = {'events': EnvironmentState.LOG_EVENTS,
            'periods': map(lambda p: [p[0], p[2]], periods),
            'data': {}}
-    exclude_cns = "-ipAddress:({0})"\
-                    .format( " OR ".join(EnvironmentState.CN_IP_ADDRESSES))
     for event in EnvironmentState.LOG_EVENTS:
       res['data'][event[0]] = {}
-      for period in periods:
-        self.log.info('Log for {0} over {1}'.format(event[0], period[0]))
-        if event[0].endswith('.ext'):
-          ev = event[0].split(".")[0]
-          q = "event:{0} AND {1}".format(ev, exclude_cns)
-        else:
-          q = "event:{0}".format(event[0])
-        fq = period[1]
-        nrecords = self.retrieveLogResponse(q, fq=fq)
-        res['data'][event[0]][period[0]] = nrecords
+    for period in periods:
+      self.log.info('Log events over {0}'.format(period[0]))
+      hits = solr.countByFacet(self.clientv1, 'event', 
+                               fq=period[1], 
+                               engine='logsolr')
+      for event in EnvironmentState.LOG_EVENTS:
+        if not event[0].endswith('.ext'):
+          res['data'][event[0]][period[0]] = hits.get(event[0], 0)
+    for event in EnvironmentState.LOG_EVENTS:
+      if event[0].endswith('.ext'):
+        self.log.info('Log for {0} over all periods'.format(event[0]))
+        hits = solr.countByQueries(self.clientv1, 
+                                   [period[1] for period in periods],
+                                   q=EnvironmentState.logEventQuery(event[0]),
+                                   engine='logsolr')
+        for period in periods:
+          res['data'][event[0]][period[0]] = hits.get(period[1], 0)
     return res
 
     
-  def getDNSInfo(self):
-    #TODO: Make this responsive to the CNode specified in the constructor
-    res = {'cn-ucsb-1.dataone.org':{},
-           'cn-unm-1.dataone.org':{},
-           'cn-orc-1.dataone.org':{},
-           'cn.dataone.org':{}
-           }
-    for k in res.keys():
-      info = dns.resolver.query(k)
-      res[k]['address'] = []
-      for ip in info:
-        res[k]['address'].append(ip.to_text())
-    return res;
+  def getLogHistory(self, days, chunk_days=None):
+    '''Returns {day: [count for each entry of LOG_EVENTS]} for each MJD in 
+    days.
+    
+    The count for a day is the number of events logged in 
+    dateLogged:[D-2DAY TO D-1DAY] where D is midnight UTC at the start of the 
+    day, as reported by get_state.py --logsummary. Counts are retrieved with a
+    facet.range over dateLogged with a gap of one day, making one request per
+    event for every chunk_days days spanned.
+    '''
+    if chunk_days is None:
+      chunk_days = EnvironmentState.LOG_HISTORY_CHUNK_DAYS
+    oneday = datetime.timedelta(days=1)
+    res = {}
+    for day in days:
+      res[day] = [0] * len(EnvironmentState.LOG_EVENTS)
+    if len(days) == 0:
+      return res
+    #start of the window for each day, D-2DAY
+    starts = mjd.MJD2dateTimes(days, unit='D') - numpy.timedelta64(2, 'D')
+    keys = numpy.datetime_as_string(starts.astype('datetime64[s]'))
+    counts = [{} for event in EnvironmentState.LOG_EVENTS]
+    t0 = starts.min().astype(datetime.datetime)
+    t0 = datetime.datetime(t0.year, t0.month, t0.day)
+    tend = starts.max().astype(datetime.datetime)
+    tend = datetime.datetime(tend.year, tend.month, tend.day) + oneday
+    while t0 < tend:
+      t1 = min(t0 + chunk_days*oneday, tend)
+      for i, event in enumerate(EnvironmentState.LOG_EVENTS):
+        self.log.info('Log history for {0} from {1} to {2}'.format(event[0], 
+                                                                   t0, t1))
+        #include both ends of each bucket to match [D-2DAY TO D-1DAY]
+        hits = solr.countByRange(self.clientv1, 'dateLogged',
+                                 dateTimeToSOLRTime(t0),
+                                 dateTimeToSOLRTime(t1),
+                                 '+1DAY',
+                                 q=EnvironmentState.logEventQuery(event[0]),
+                                 include=['lower', 'upper'],
+                                 engine='logsolr')
+        for k in hits.keys():
+          counts[i][k[:19]] = hits[k]
+      t0 = t1
+    for day, key in zip(days, keys):
+      for i in xrange(0, len(EnvironmentState.LOG_EVENTS)):
+        res[day][i] = counts[i].get(key, 0)
+    return res
+
+    
+  def resolveHost(self, host, timeout=None):
+    '''Returns {'address': [IP addresses], 'ttl': seconds, 'latency': seconds}
+    for host, with 'error' instead of 'ttl' if resolution failed. Results are
+    cached until clearDNSCache is called, so each host is resolved once per
+    run.
+    '''
+    if timeout is None:
+      timeout = EnvironmentState.DNS_TIMEOUT
+    with self._dns_lock:
+      if host in self._dns_cache:
+        return self._dns_cache[host]
+    entry = {'address': [],
+             'latency': None, }
+    resolver = dns.resolver.Resolver()
+    resolver.timeout = timeout
+    resolver.lifetime = timeout
+    t0 = time.time()
+    try:
+      answer = resolver.query(host)
+      entry['ttl'] = answer.rrset.ttl
+      for ip in answer:
+        entry['address'].append(ip.to_text())
+    except Exception as e:
+      self.log.error("DNS lookup of {0} failed: {1}".format(host, repr(e)))
+      entry['error'] = e.__class__.__name__
+    entry['latency'] = time.time() - t0
+    with self._dns_lock:
+      self._dns_cache[host] = entry
+    return entry
+
+
+  def clearDNSCache(self):
+    with self._dns_lock:
+      self._dns_cache = {}
+
+
+  def getDNSInfo(self, max_workers=None, timeout=None):
+    '''Returns {host: entry from resolveHost} for the host of the base URL and
+    of each node in self.state['nodes'], resolved concurrently.
+
+    Entries also give the 'type' of the host ("cn" for the base URL and
+    coordinating nodes, otherwise "mn") and the 'nodes' served from it.
+    '''
+    if max_workers is None:
+      max_workers = self.node_workers
+    hosts = {}
+    baseurl_host = urlparse.urlparse(self.baseurl).hostname
+    hosts[baseurl_host] = {'type': 'cn', 'nodes': []}
+    for nodeId, node in (self.state['nodes'] or {}).iteritems():
+      host = urlparse.urlparse(node['baseurl']).hostname
+      if host is None:
+        continue
+      info = hosts.setdefault(host, {'type': 'mn', 'nodes': []})
+      if node['type'] == 'cn':
+        info['type'] = 'cn'
+      info['nodes'].append(nodeId)
+    names = sorted(hosts.keys())
+    entries = workers.mapConcurrent(lambda h: self.resolveHost(h, timeout),
+                                    names,
+                                    max_workers=max_workers)
+    res = {}
+    for host, entry in zip(names, entries):
+      if entry is None:
+        entry = {'address': [], 'latency': None, 'error': 'Failed'}
+      res[host] = dict(entry)
+      res[host].update(hosts[host])
+    return res
 
 
   def getCountsToDate(self, to_date, exclude_listObjects=False):
@@ -307,8 +540,73 @@ class EnvironmentState(object):
     self.state['summary'] = self.summarizeCounts()
 
 
-  def getNodes(self):
+  def getCountHistory(self, start, end=None, interval='day', 
+                      field='dateUploaded', q='*:*', fq=None, by_type=False):
+    '''Returns the cumulative number of objects for every day or week 
+    (interval) from start up to end (datetimes, end defaults to now).
+
+    Each series is retrieved with a single facet.range request on field, plus
+    one request for the number of objects before start. With by_type a series
+    is also retrieved for each formatType, except for types excluded by fq
+    (e.g. "-formatType:RESOURCE"), which would always be zero. Returns::
+
+      {'field': field, 'fq': fq, 'interval': interval,
+       'days': ["YYYY-MM-DD", ...],
+       'counts': {'all': [...], 'DATA': [...], ...}}
+
+    where days are the last day covered by each bucket.
+    '''
+    if end is None:
+      end = getNow()
+    ndays = EnvironmentState.HISTORY_INTERVALS[interval]
+    start = datetime.datetime(start.year, start.month, start.day)
+    fqs = []
+    if not fq is None:
+      fqs.append(fq)
+    #exclusive upper bound, objects added before start
+    before = fqs + ["{0}:[* TO {1}}}".format(field, dateTimeToSOLRTime(start))]
+    series = [['all', fqs], ]
+    baseline = {'all': solr.numFound(self.clientv1, q=q, fq=before)}
+    if by_type:
+      for ftype, n in solr.countByFacet(self.clientv1, 'formatType',
+                                        q=q, fq=before).iteritems():
+        baseline[ftype] = n
+      for ftype in ['DATA', 'METADATA', 'RESOURCE']:
+        if "-formatType:{0}".format(ftype) in fqs:
+          continue
+        baseline.setdefault(ftype, 0)
+        series.append([ftype, fqs + ["formatType:{0}".format(ftype)]])
+    days = historyDays(start, end, ndays)
+    res = {'field': field,
+           'fq': fq,
+           'interval': interval,
+           'days': days,
+           'counts': {}, }
+    for name, series_fq in series:
+      self.log.info("Count history for {0}".format(name))
+      if len(series_fq) == 0:
+        series_fq = None
+      hits = solr.countByRange(self.clientv1, field,
+                               dateTimeToSOLRTime(start),
+                               dateTimeToSOLRTime(end),
+                               "+{0}DAYS".format(ndays),
+                               q=q, fq=series_fq)
+      total = baseline[name]
+      counts = []
+      for key in sorted(hits.keys()):
+        total += hits[key]
+        counts.append(total)
+      res['counts'][name] = counts[:len(days)]
+    return res
+
+
+  def getNodes(self, max_workers=None, node_timeout=None):
     '''Returns a dictionary of node information, keyed by nodeId
+    
+    Synchronized member nodes are counted concurrently by up to max_workers 
+    threads. A node whose count has not completed within node_timeout seconds
+    is given an objectcount of NodeState.DEADLINE_EXCEEDED. Defaults are 
+    self.node_workers and self.node_timeout.
     '''
     
     def syncschedule_array(s):
@@ -317,9 +615,20 @@ class EnvironmentState(object):
       # hour mday min mon sec wday year
       # year, mon, mday, wday, hour, min, sec
       return [s.year, s.mon, s.mday, s.wday, s.hour, s.min, s.sec]
+
+    def nodecount(baseurl):
+      self.log.info("Attempting node count on {0}".format(baseurl))
+      ns = NodeState(baseurl, timeout=node_timeout, 
+                     resilience=self.resilience)
+      return ns.count()
     
+    if max_workers is None:
+      max_workers = self.node_workers
+    if node_timeout is None:
+      node_timeout = self.node_timeout
     res = {}
-    nodes = self.clientv1.listNodes()
+    to_count = []
+    nodes = self.metadata.listNodes()
     for node in nodes.node:
       entry = {'name' : node.name,
                'description' : node.description,
@@ -333,18 +642,24 @@ class EnvironmentState(object):
         entry['sync.schedule'] = syncschedule_array(sync.schedule)
         entry['sync.lastHarvested'] = sync.lastHarvested.strftime("%Y-%m-%d %H:%M:%S.0%z")
         entry['sync.lastCompleteHarvest'] = sync.lastCompleteHarvest.strftime("%Y-%m-%d %H:%M:%S.0%z")
-        #Call list objects to get a count
-        self.log.info("Attempting node count on {0}".format(node.baseURL))
-        ns = NodeState(node.baseURL)
-        entry['objectcount'] = ns.count()
-        
+        to_count.append(node.identifier.value())
       res[node.identifier.value()] = entry
+    #Call list objects on each synchronized node to get a count
+    counts = workers.mapConcurrent(nodecount,
+                                   [res[k]['baseurl'] for k in to_count],
+                                   max_workers=max_workers,
+                                   timeout=node_timeout,
+                                   on_timeout=lambda u: NodeState.DEADLINE_EXCEEDED)
+    for nodeId, n in zip(to_count, counts):
+      if n is None:
+        n = -1
+      res[nodeId]['objectcount'] = n
     return res
 
 
   def getFormats(self):
     res = {}
-    formats = self.clientv1.listFormats()
+    formats = self.metadata.listFormats()
     for format in formats.objectFormat:
       res[format.formatId] = {'name' : format.formatName,
                               'type' : format.formatType}
@@ -354,7 +669,23 @@ class EnvironmentState(object):
   def _countAll(self, counts, as_of_date=None):
     '''Returns object counts by formatId using listObjects
     Requires that self.state['formats'] has been populated
+
+    If self.object_tally is set, it is brought up to date with a single scan
+    of the objects listed since its previous update and the counts are taken
+    from it. Otherwise, and for counts as of a date, listObjects is called
+    once per format.
     '''
+    if not self.object_tally is None and as_of_date is None:
+      nlisted = self.object_tally.update(self.clientv1)
+      self.log.info("{0:d} objects listed since the previous scan".format(nlisted))
+      totals = self.object_tally.countByFormat()
+      for formatId in self.state['formats'].keys():
+        self.state['counts'][formatId][0] = totals.get(formatId, 0)
+      for formatId in totals.keys():
+        if not formatId in self.state['formats']:
+          self.log.warn("Unregistered formatId {0:s} : {1:d}".format(formatId,
+                                                                     totals[formatId]))
+      return
     to_date = None
     if not as_of_date is None:
       to_date = dateTimeToListObjectsTime(as_of_date)
@@ -368,35 +699,32 @@ class EnvironmentState(object):
 
 
   def _countSOLR(self, counts, col=1, fq=None, as_of_date=None):
-    '''Populates counts 
+    '''Populates counts[formatId][col] with the number of SOLR hits for each
+    formatId and self.type_totals[col] with the number for each formatType,
+    using a single request pivoted on formatType,formatId.
     '''
-    queryEngine = "solr"
-    query='/'
-    maxrecords = 0
-    fields = 'id'    
-    date_restriction = ''
+    q = '*:*'
     if not as_of_date is None:
-      date_restriction = " AND dateUploaded:[* TO {0:s}]".format(dateTimeToSOLRTime(as_of_date))
+      q = "dateUploaded:[* TO {0:s}]".format(dateTimeToSOLRTime(as_of_date))
+    tree = solr.countByPivot(self.clientv1, ['formatType', 'formatId'],
+                             q=q, fq=fq)
+    for ftype, nhits, nsum in solr.checkPivot(tree):
+      self.log.warn("Column {0} {1} total {2:d} != sum of formats {3:d}"\
+                    .format(col, ftype, nhits, nsum))
+    hits = {}
+    self.type_totals[col] = {}
+    for ftype, (ntype, formats) in tree.iteritems():
+      self.type_totals[col][ftype] = ntype
+      for formatId, (nhits, children) in formats.iteritems():
+        hits[formatId] = hits.get(formatId, 0) + nhits
     for formatId in self.state['formats'].keys():
-      q = "formatId:\"{0:s}\"".format(escapeQueryTerm(formatId))
-      q = q + date_restriction
-      ntries = 0
-      while ntries < 4:
-        try:
-          ntries += 1
-          results = eval(self.clientv1.query(queryEngine, query=query, 
-                                  q=q,
-                                  fq=fq,
-                                  wt='python', 
-                                  fl=fields, 
-                                  rows=maxrecords).read())
-          break
-        except httplib.BadStatusLine as e:
-          self.log.warn(e)
-          
-      nHits = results['response']['numFound']
+      nHits = hits.get(formatId, 0)
       self.state['counts'][formatId][col] = nHits
       self.log.info("{0:s} : {1:d}".format(formatId, nHits))
+    for formatId in hits.keys():
+      if not formatId in self.state['formats']:
+        self.log.warn("Unregistered formatId {0:s} : {1:d}".format(formatId,
+                                                                   hits[formatId]))
 
 
   def getCounts(self, as_of_date=None, exclude_listObjects=False):
@@ -407,6 +735,7 @@ class EnvironmentState(object):
     for formatId in self.state['formats'].keys():
       counts[formatId] = [0, 0, 0]
     self.state['counts'] = counts
+    self.type_totals = {}
     #populate the number of all objects
     for k in self.state['meta']['count_meta'].keys():
       if k == 0:
@@ -420,108 +749,151 @@ class EnvironmentState(object):
     return counts
 
 
-  def getObjectSizeHistogram(self, q="*:*", nbins=10):
-    '''Returns a list of [size_low, size_high, count] for objects that match
-    the specified query.
-    To find minimum value: 
-      https://cn.dataone.org/cn/v1/query/solr/?fl=size&sort=size%20asc&q=*:*&rows=1
-    to find maximum value:
-      https://cn.dataone.org/cn/v1/query/solr/?fl=size&sort=size%20desc&q=*:*&rows=1
+  def _sizeHistogramBins(self, minval, maxval, nbins):
+    '''Returns ([size_low, size_high, 0], fq) for each of nbins log spaced 
+    bins between minval and maxval, where fq selects the objects in the bin.
     '''
-
-    def getSOLRResponse(q, maxrecords, fields, rsort, fq=None):
-      ntries = 0
-      while ntries < 4:
-        try:
-          ntries += 1
-          results = eval(self.clientv1.query("solr", query="/", 
-                                  q=q,
-                                  fq=fq,
-                                  wt='python', 
-                                  fl=fields, 
-                                  sort=rsort,
-                                  rows=maxrecords).read())
-          return results
-        except httplib.BadStatusLine as e:
-          self.log.warn(e)
-      return None
-      
-    minval = getSOLRResponse(q, 1, 'size', "size asc")['response']['docs'][0]['size']
-    maxval = getSOLRResponse(q, 1, 'size', "size desc")['response']['docs'][0]['size']
-    if minval <1:
-      minval = 1
     lminval = math.log10(minval)
     lmaxval = math.log10(maxval)
     binsize = (lmaxval - lminval) / (nbins*1.0)
     res = []
+    fqs = []
     for i in xrange(0, nbins):
       row = [math.pow(10, lminval + i*binsize), 
              math.pow(10, lminval + (i+1)*binsize), 
              0]
-      res.append(row)
-    for i in xrange(0, nbins):
-      row = res[i]
       if i == 0:
         fq = "size:[{0:d} TO {1:d}]".format(math.trunc(row[0]), math.trunc(row[1]))
       elif i == nbins-1:
         fq = "size:[{0:d} TO {1:d}]".format(math.trunc(row[0]), math.trunc(row[1])+1)
       else:
         fq = "size:[{0:d} TO {1:d}]".format(math.trunc(row[0])+1, math.trunc(row[1]))
-      n = getSOLRResponse(q, 0, 'size', 'size asc', fq=fq)['response']['numFound']
-      res[i][2] = n
+      res.append(row)
+      fqs.append(fq)
+    return res, fqs
+
+
+  def getObjectSizeHistogram(self, q="*:*", nbins=10):
+    '''Returns a list of [size_low, size_high, count] for objects that match
+    the specified query.
+    
+    The size range comes from the stats component and all bins are counted
+    with facet queries, so two requests are made regardless of nbins.
+    '''
+    sizes = solr.fieldStats(self.clientv1, 'size', q=q)
+    minval = long(sizes['min'])
+    maxval = long(sizes['max'])
+    if minval <1:
+      minval = 1
+    res, fqs = self._sizeHistogramBins(minval, maxval, nbins)
+    hits = solr.countByQueries(self.clientv1, fqs, q=q)
+    for i in xrange(0, nbins):
+      res[i][2] = hits.get(fqs[i], 0)
     return {"minimum": minval,
             "maximum": maxval,
             "histogram": res}
 
 
-  def getObjectTypeSizeHistogram(self):
-    res = {'data':[],
-           'metadata':[],
-           'resource':[]}
-    res['data'] = self.getObjectSizeHistogram(q="formatType:DATA")
-    res['metadata'] = self.getObjectSizeHistogram(q="formatType:METADATA")
-    res['resource'] = self.getObjectSizeHistogram(q="formatType:RESOURCE")
+  def getObjectTypeSizeHistogram(self, nbins=10):
+    '''Returns size histograms for DATA, METADATA and RESOURCE objects.
+    
+    The size range for each type is retrieved by a single stats request 
+    faceted on formatType, and every bin of every type is counted by a single
+    request of facet queries.
+    '''
+    types = [['data', 'DATA'],
+             ['metadata', 'METADATA'],
+             ['resource', 'RESOURCE']]
+    sizes = solr.fieldStats(self.clientv1, 'size', facet='formatType')
+    res = {}
+    queries = []
+    for key, ftype in types:
+      tsizes = sizes['facets']['formatType'][ftype]
+      minval = long(tsizes['min'])
+      maxval = long(tsizes['max'])
+      if minval <1:
+        minval = 1
+      bins, fqs = self._sizeHistogramBins(minval, maxval, nbins)
+      res[key] = {"minimum": minval,
+                  "maximum": maxval,
+                  "histogram": bins}
+      for fq in fqs:
+        queries.append("formatType:{0} AND {1}".format(ftype, fq))
+    hits = solr.countByQueries(self.clientv1, queries)
+    i = 0
+    for key, ftype in types:
+      for row in res[key]['histogram']:
+        row[2] = hits.get(queries[i], 0)
+        i += 1
     return res
 
 
   def summarizeCounts(self):
     '''Computes summary totals for DATA, METADATA, and RESOURCE objects
+
+    Totals of the SOLR count columns are taken from the formatType pivot
+    retrieved with the per format counts (self.type_totals) and checked
+    against the per format counts summed by registered type. Differences,
+    e.g. from objects with unregistered formats, are logged and listed in
+    state['meta']['count_checks']. The listObjects column is summed.
     '''
-    totalcols = ['data', 'meta', 'resource']
-    summary = {'all': {'data':0, 'meta': 0, 'resource': 0, 'total': 0},
-               'public': {'data':0, 'meta': 0, 'resource': 0, 'total': 0},
-               'public_notobsolete': {'data':0, 'meta': 0, 'resource': 0, 'total': 0}
-               }
-    for fmt in self.state['formats'].keys():
-      if self.state['formats'][fmt]['type'] == 'DATA':
-        summary['all']['data'] = summary['all']['data'] + self.state['counts'][fmt][0]
-        summary['public']['data'] = summary['public']['data'] + self.state['counts'][fmt][1]
-        summary['public_notobsolete']['data'] = summary['public_notobsolete']['data'] + self.state['counts'][fmt][2]
-      elif self.state['formats'][fmt]['type'] == 'METADATA':
-        summary['all']['meta'] = summary['all']['meta'] + self.state['counts'][fmt][0]
-        summary['public']['meta'] = summary['public']['meta'] + self.state['counts'][fmt][1]
-        summary['public_notobsolete']['meta'] = summary['public_notobsolete']['meta'] + self.state['counts'][fmt][2]
-      elif self.state['formats'][fmt]['type'] == 'RESOURCE':
-        summary['all']['resource'] = summary['all']['resource'] + self.state['counts'][fmt][0]
-        summary['public']['resource'] = summary['public']['resource'] + self.state['counts'][fmt][1]
-        summary['public_notobsolete']['resource'] = summary['public_notobsolete']['resource'] + self.state['counts'][fmt][2]
+    columns = ['all', 'public', 'public_notobsolete']
+    type_keys = {'DATA': 'data', 'METADATA': 'meta', 'RESOURCE': 'resource'}
+    summary = {}
+    checks = []
+    for col, name in enumerate(columns):
+      summed = {'data':0, 'meta': 0, 'resource': 0}
+      for fmt in self.state['formats'].keys():
+        key = type_keys.get(self.state['formats'][fmt]['type'])
+        if not key is None:
+          summed[key] = summed[key] + self.state['counts'][fmt][col]
+      summary[name] = summed
+      if col in self.type_totals:
+        pivot = {'data':0, 'meta': 0, 'resource': 0}
+        for ftype, n in self.type_totals[col].iteritems():
+          if ftype in type_keys:
+            pivot[type_keys[ftype]] = n
+        for key in sorted(pivot.keys()):
+          if pivot[key] != summed[key]:
+            self.log.warn("{0} {1}: formatType total {2:d}, formats sum {3:d}"\
+                          .format(name, key, pivot[key], summed[key]))
+            checks.append([name, key, pivot[key], summed[key]])
+        summary[name] = pivot
     for ctype in summary.keys():
       summary[ctype]['total'] = summary[ctype]['data']
       summary[ctype]['total'] = summary[ctype]['total'] + summary[ctype]['meta']
       summary[ctype]['total'] = summary[ctype]['total'] + summary[ctype]['resource']
+    if not self.state['meta'] is None:
+      self.state['meta']['count_checks'] = checks
     self.state['summary'] = {'counts' : summary}
     return summary
-    
 
-  def asJSON(self, outStream):
-    outStream.write(EnvironmentState.JS_VARIABLE_STATE)
-    json.dump(self.state, outStream, indent=2)
+
+  def asJSON(self, outStream, compact=False):
+    '''Writes the state as "var env_state = " and JSON, minified with sorted
+    keys if compact (see d1state.js_output).
+    '''
+    outStream.write(js_output.dumpJS(EnvironmentState.JS_VARIABLE_STATE,
+                                     self.state,
+                                     compact=compact))
   
   
   def fromJSON(self, inStream):
     jbuffer = inStream.read()
     self.state = json.loads(jbuffer[len(EnvironmentState.JS_VARIABLE_STATE):])
-    self.tstamp = datetime.datetime().strptime(self.state['meta']['tstamp'],"%Y-%m-%d %H:%M:%S.0+00:00")
+    self.tstamp = datetime.datetime.strptime(self.state['meta']['tstamp'],"%Y-%m-%d %H:%M:%S.0+00:00")
+
+
+  def fromStore(self, store, tstamp):
+    '''Loads the latest snapshot taken at or before tstamp from a 
+    snapshot_store.SnapshotStore. Returns False if there is no such snapshot.
+    '''
+    i = store.find(tstamp)
+    if i < 0:
+      return False
+    self.state = store.load(i)
+    self.tstamp = datetime.datetime.strptime(self.state['meta']['tstamp'],"%Y-%m-%d %H:%M:%S.0+00:00")
+    return True
     
   
   def getTStamp(self):
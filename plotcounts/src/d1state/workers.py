@@ -0,0 +1,168 @@
+'''
+Minimal bounded worker pool used to run independent network probes
+concurrently, and a scheduler for running dependent phases of work. Python 2
+has no concurrent.futures in the standard library, so these are built 
+directly on threading and Queue.
+'''
+
+import sys
+import time
+import logging
+import threading
+import Queue
+
+
+def callWithDeadline(func, item, timeout=None, on_timeout=None):
+  '''Call func(item) and return the result.
+
+  If timeout (seconds) is not None and func has not returned by then, the
+  call is abandoned (left running in a daemon thread) and on_timeout(item) is
+  returned instead, or None if on_timeout is None. An exception raised by 
+  func within the deadline is raised again with its original traceback.
+  '''
+  if timeout is None:
+    return func(item)
+  res = {}
+
+  def _run():
+    try:
+      res['value'] = func(item)
+    except Exception:
+      res['error'] = sys.exc_info()
+
+  t = threading.Thread(target=_run)
+  t.daemon = True
+  t.start()
+  t.join(timeout)
+  if 'error' in res:
+    raise res['error'][0], res['error'][1], res['error'][2]
+  if t.is_alive():
+    logging.warn("Deadline of {0}s exceeded for {1}".format(timeout, item))
+    if on_timeout is None:
+      return None
+    return on_timeout(item)
+  return res['value']
+
+
+def mapConcurrent(func, items, max_workers=10, timeout=None, on_timeout=None):
+  '''Returns [func(item) for item in items], evaluated by at most max_workers
+  threads. Results are in the same order as items.
+
+  timeout is a per item deadline in seconds, measured from when a worker
+  picks up the item. Items exceeding the deadline get on_timeout(item) as
+  their result. func is expected to trap its own exceptions; an exception
+  escaping func is logged and recorded as None.
+  '''
+  items = list(items)
+  results = [None] * len(items)
+  if len(items) == 0:
+    return results
+  tasks = Queue.Queue()
+  for i, item in enumerate(items):
+    tasks.put((i, item))
+
+  def _worker():
+    while True:
+      try:
+        i, item = tasks.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        results[i] = callWithDeadline(func, item,
+                                      timeout=timeout,
+                                      on_timeout=on_timeout)
+      except Exception as e:
+        logging.exception("Worker failed on {0}: {1}".format(item, e))
+
+  nworkers = max(1, min(max_workers, len(items)))
+  threads = []
+  for i in xrange(0, nworkers):
+    t = threading.Thread(target=_worker)
+    t.daemon = True
+    t.start()
+    threads.append(t)
+  for t in threads:
+    t.join()
+  return results
+
+
+def runPhases(phases, timings=None):
+  '''Runs a set of dependent phases, each in its own thread, and returns 
+  {name: result}.
+
+  phases is a list of [name, func, [names of phases it depends on]]. func is
+  called without arguments as soon as all of its dependencies have completed,
+  so independent phases run at the same time. If a phase raises, phases 
+  depending on it are skipped and the first exception is re-raised once the
+  running phases have finished.
+
+  If timings is a dictionary, it is populated with {name: {'start': seconds
+  since the epoch, 'seconds': duration, 'status': "ok", "failed" or 
+  "skipped"}} for each phase.
+  '''
+  if timings is None:
+    timings = {}
+  names = set([phase[0] for phase in phases])
+  for name, func, deps in phases:
+    for dep in deps:
+      if not dep in names:
+        raise ValueError("Phase {0} depends on unknown phase {1}".format(name,
+                                                                         dep))
+  results = {}
+  errors = []
+  started = set()
+  done = set()
+  failed = set()
+  cond = threading.Condition()
+
+  def _run(name, func):
+    t0 = time.time()
+    value = None
+    error = None
+    try:
+      value = func()
+    except Exception:
+      error = sys.exc_info()
+      logging.exception("Phase {0} failed".format(name))
+    elapsed = time.time() - t0
+    logging.info("Phase {0} finished in {1:.3f}s".format(name, elapsed))
+    with cond:
+      timings[name] = {'start': t0,
+                       'seconds': elapsed,
+                       'status': "ok" if error is None else "failed", }
+      if error is None:
+        results[name] = value
+        done.add(name)
+      else:
+        errors.append(error)
+        failed.add(name)
+      cond.notify_all()
+
+  with cond:
+    while True:
+      skipped = True
+      while skipped:
+        skipped = False
+        for name, func, deps in phases:
+          if not name in started and len(failed.intersection(deps)) > 0:
+            logging.error("Skipping phase {0}, a dependency failed".format(name))
+            started.add(name)
+            failed.add(name)
+            timings[name] = {'start': time.time(),
+                             'seconds': 0.0,
+                             'status': "skipped", }
+            skipped = True
+      for name, func, deps in phases:
+        if name in started:
+          continue
+        if done.issuperset(deps):
+          started.add(name)
+          t = threading.Thread(target=_run, args=(name, func))
+          t.daemon = True
+          t.start()
+      if len(done) + len(failed) == len(phases):
+        break
+      cond.wait()
+  if len(errors) > 0:
+    raise errors[0][0], errors[0][1], errors[0][2]
+  return results
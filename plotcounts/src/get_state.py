@@ -6,14 +6,32 @@ Created on Mar 2, 2014
 
 import os
 import errno
+import json
 import logging
+import datetime
 from yaml import load, Loader
 from optparse import OptionParser
-import json
 import pprint
 from d1state.system_state import EnvironmentState
+from d1state.snapshot_store import SnapshotStore
+from d1state.rollups import StateRollups
+from d1state.metadata_cache import MetadataCache
+from d1state.connections import ConnectionPool
+from d1state.object_tally import ObjectTally
+from d1state.instrumentation import writePrometheus
+from d1state.js_output import writeJS
+from d1state.fileio import writeAtomic
 from d1state import mjd
 
+#MJD of 2012-07-01, the first day of the log history
+MJD_D1_START = 56109.0
+#First day of the count history plotted by plotcounts.R
+COUNT_HISTORY_START = datetime.datetime(2012, 6, 10)
+#plotcounts.csv counts data sets, i.e. objects other than resource maps
+PLOTCOUNTS_FQ = "-formatType:RESOURCE"
+#Default number of recent snapshots kept as JS views in the state folder
+EXPORT_LAST = 30
+
 
 def mkdir_p(path):
   try:
@@ -63,48 +81,283 @@ def loadConfig(config_file):
   res['stateformat'] = getConfigValue(config, 
                                      ['destformat', 'state'], 
                                      default="%Y%m%dT%H%M%S.js")
+  res['nodeworkers'] = getConfigValue(config, 
+                                     ['nodeworkers', 'state'], 
+                                     default=EnvironmentState.NODE_WORKERS)
+  res['nodetimeout'] = getConfigValue(config, 
+                                     ['nodetimeout', 'state'], 
+                                     default=EnvironmentState.NODE_TIMEOUT)
+  res['storefolder'] = getConfigValue(config, 
+                                     ['store', 'state'], 
+                                     default=os.path.join(res['statefolder'], "store"))
+  res['metadatattl'] = getConfigValue(config, 
+                                     ['metadatattl', 'state'], 
+                                     default=MetadataCache.TTL)
+  #number of recent snapshots written as JS views, 0 for all
+  res['exportlast'] = getConfigValue(config, 
+                                     ['exportlast', 'state'], 
+                                     default=EXPORT_LAST)
+  #write the JS views minified with sorted keys
+  res['compact'] = getConfigValue(config, 
+                                     ['compact', 'state'], 
+                                     default=False)
+  #also write .gz (and .br if brotli is installed) copies of the JS views
+  res['precompress'] = getConfigValue(config, 
+                                     ['precompress', 'state'], 
+                                     default=False)
+  #optional folder of the listObjects tally, see d1state.object_tally
+  res['tallyfolder'] = getConfigValue(config,
+                                     ['tally', 'state'],
+                                     default=None)
+  #optional Prometheus textfile collector file for the run timings
+  res['prometheus'] = getConfigValue(config, 
+                                     ['prometheus', 'state'], 
+                                     default=None)
   return res
 
 
-def main(config):
+def openStore(config):
+  '''Returns the SnapshotStore for the configuration. A new store is seeded 
+  with any snapshots already listed in the state folder index.js.
+  '''
+  store = SnapshotStore(config['storefolder'])
+  if len(store) == 0 and \
+     os.path.exists(os.path.join(config['statefolder'], "index.js")):
+    n = store.importViews(config['statefolder'])
+    logging.info("Imported {0} snapshots into {1}".format(n, 
+                                                        config['storefolder']))
+  return store
+
+
+def updateRollups(config, store):
+  '''Adds new snapshots to the daily, weekly and monthly rollups kept with
+  the store and writes the rollup JS files to the state folder.
+  '''
+  rollups = StateRollups(config['storefolder'])
+  rollups.update(store)
+  rollups.write(config['statefolder'],
+                compact=config['compact'],
+                precompress=config['precompress'])
+
+
+def newEnvironmentState(config, pool=None, metadata=None, tally=None):
+  '''Returns an EnvironmentState for the configuration. The connection pool,
+  metadata cache and object tally are created unless provided, e.g. to be
+  shared between runs by collector.py.
+  '''
+  if pool is None:
+    pool = ConnectionPool(config['baseurl'])
+  if metadata is None:
+    metadata = MetadataCache(config['baseurl'], ttl=config['metadatattl'],
+                             pool=pool)
+  if tally is None and not config['tallyfolder'] is None:
+    tally = ObjectTally(config['tallyfolder'])
+  return EnvironmentState(config['baseurl'],
+                          node_workers=config['nodeworkers'],
+                          node_timeout=config['nodetimeout'],
+                          pool=pool,
+                          metadata_cache=metadata,
+                          object_tally=tally)
+
+
+def main(config, envstate=None, store=None):
   mkdir_p(config['statefolder'])
-  #load index JSON
-  state_index_src = os.path.join(config['statefolder'], "index.js")
-  logging.debug("INDEX = " + state_index_src)
-  state_index = []
+  if store is None:
+    store = openStore(config)
+  #capture state
+  if envstate is None:
+    envstate = newEnvironmentState(config)
   try:
-    jstr = file(state_index_src, "r").read()
-    state_index = json.loads(jstr[len(EnvironmentState.JS_VARIABLE_INDEX):])
-  except:
-    logging.info("No index file available. Creating at {0:s}".format(state_index_src))
+    envstate.populateState()
+  finally:
+    #timings are written for failed runs too
+    if not config['prometheus'] is None:
+      writePrometheus(config['prometheus'], envstate.state['meta'])
+  logging.info(pprint.pformat(envstate.state['meta']['timings']['phases']))
+  #append to the store
+  name = envstate.tstamp.strftime(config['stateformat'])
+  logging.debug(pprint.pformat([envstate.getTStamp(), name]))
+  store.append(envstate.state, name)
+  #Write out index.js and the new state JS file for the web UI
+  store.exportViews(config['statefolder'], 
+                    last=config['exportlast'],
+                    compact=config['compact'],
+                    precompress=config['precompress'])
+  updateRollups(config, store)
+
+
+def mainExport(config):
+  '''Regenerates the web UI JS views in the state folder from the store.
+  '''
+  mkdir_p(config['statefolder'])
+  store = openStore(config)
+  index = store.exportViews(config['statefolder'], 
+                            last=config['exportlast'],
+                            overwrite=True,
+                            compact=config['compact'],
+                            precompress=config['precompress'])
+  updateRollups(config, store)
+  logging.info("Exported {0} snapshots to {1}".format(len(index), 
+                                                      config['statefolder']))
+
+
+
+def logHistoryHeader():
+  row = ['"MJD"']
+  for event in EnvironmentState.LOG_EVENTS:
+    row.append('"' + event[0] + '"')
+  return ",".join(row)
+
+
+def logHistoryRow(day, counts):
+  row = ["{0:.5f}".format(day)]
+  for nrecords in counts:
+    row.append(str(nrecords))
+  return ",".join(row)
+
+
+def loadLogHistory(fname):
+  '''Returns ({int(MJD): row}, clean) for the complete rows of a log history
+  CSV. Rows with missing or non-numeric columns, or not ended by a newline,
+  are dropped so the day is fetched again. clean is True if the file can be
+  appended to, i.e. it starts with the header, every row is complete and the
+  days are in increasing order.
+  '''
+  res = {}
+  if not os.path.exists(fname):
+    return res, True
+  clean = True
+  last = None
+  ncols = len(EnvironmentState.LOG_EVENTS) + 1
+  for nline, raw in enumerate(file(fname, "r")):
+    line = raw.strip()
+    if line.startswith('"'):
+      clean = clean and nline == 0
+      continue
+    clean = clean and nline > 0
+    if line == "":
+      continue
+    row = line.split(",")
+    try:
+      if not raw.endswith("\n"):
+        raise ValueError("No end of line")
+      day = float(row[0])
+      if len(row) != ncols:
+        raise ValueError("Expected {0} columns".format(ncols))
+      for v in row[1:]:
+        int(v)
+    except ValueError as e:
+      logging.warn("Incomplete log history row '{0}': {1}".format(line, e))
+      clean = False
+      continue
+    clean = clean and (last is None or int(day) > last)
+    last = int(day)
+    res[int(day)] = line
+  return res, clean
+
+
+def writeLogHistory(fname, rows):
+  '''Atomically replaces fname with the header and rows, sorted by day.
+  '''
+  lines = [logHistoryHeader()]
+  for day in sorted(rows.keys()):
+    lines.append(rows[day])
+  writeAtomic(fname, "\n".join(lines) + "\n", sync=True)
+
+
+def appendLogHistory(fname, lines):
+  '''Appends lines to fname, writing the header first if fname is new, and
+  syncs the file to disk.
+  '''
+  exists = os.path.exists(fname)
+  dest = file(fname, "a")
+  if not exists:
+    dest.write(logHistoryHeader() + "\n")
+  for line in lines:
+    dest.write(line + "\n")
+  dest.flush()
+  os.fsync(dest.fileno())
+  dest.close()
+
+
+def updateLogHistory(config, fname, chunk_days=None, envstate=None):
+  '''Brings the log history CSV fname up to date. 
   
-  #capture state
-  envstate = EnvironmentState(config['baseurl'])
-  envstate.populateState()
-  #append index entry
-  row = [envstate.getTStamp(), envstate.tstamp.strftime(config['stateformat'])]
-  logging.debug(pprint.pformat(row))
-  state_index.append(row)
-  #Write out the state JSON file
-  statedest = file(os.path.join(config['statefolder'],row[1]), "w")
-  envstate.asJSON(statedest)
-  statedest.close()
-  #update the index JSON file
-  jbuffer = file(state_index_src, "w")
-  jbuffer.write(EnvironmentState.JS_VARIABLE_INDEX)
-  json.dump(state_index, jbuffer, indent=2)
-  jbuffer.close()
+  Days between the first day in the file (or MJD_D1_START for a new file)
+  and today that are missing or incomplete are retrieved in chunks of
+  chunk_days days. Each chunk after the last day in the file is appended, so
+  an update costs the same however long the history is. The file is only
+  rewritten for chunks that fill earlier gaps, or to repair a file that
+  cannot be appended to. Either way each chunk is on disk before the next
+  is retrieved, so an interrupted update resumes from the last completed
+  chunk when run again.
+  '''
+  if chunk_days is None:
+    chunk_days = EnvironmentState.LOG_HISTORY_CHUNK_DAYS
+  rows, clean = loadLogHistory(fname)
+  last = None
+  if len(rows) > 0:
+    last = max(rows.keys())
+  mjdnow = mjd.now()
+  first = int(MJD_D1_START)
+  if len(rows) > 0:
+    first = min(rows.keys())
+  missing = []
+  for t in xrange(first, int(mjdnow)):
+    if not t in rows:
+      missing.append(t*1.0)
+  if not int(mjdnow) in rows:
+    missing.append(mjdnow)
+  logging.info("{0} days missing from {1}".format(len(missing), fname))
+  if envstate is None:
+    envstate = EnvironmentState(config['baseurl'])
+  for i in xrange(0, len(missing), chunk_days):
+    days = missing[i:i+chunk_days]
+    history = envstate.getLogHistory(days)
+    for day in days:
+      rows[int(day)] = logHistoryRow(day, history[day])
+    if clean and (last is None or int(days[0]) > last):
+      appendLogHistory(fname, [rows[int(day)] for day in days])
+    else:
+      writeLogHistory(fname, rows)
+      clean = True
+    if last is None or int(days[-1]) > last:
+      last = int(days[-1])
+    logging.info("Log history updated to MJD {0:.5f}".format(days[-1]))
+  logging.info('Done.')
 
 
+def mainCountHistory(config, fname, interval='day'):
+  '''Writes the cumulative count of data sets for every day (or week) since
+  COUNT_HISTORY_START to fname in the "day | count" format of plotcounts.csv,
+  and the history by formatType to history.js in the state folder.
+  '''
+  envstate = EnvironmentState(config['baseurl'])
+  history = envstate.getCountHistory(COUNT_HISTORY_START, 
+                                     interval=interval,
+                                     fq=PLOTCOUNTS_FQ,
+                                     by_type=True)
+  envstate.state['history'] = history
+  lines = ["day | count"]
+  for day, n in zip(history['days'], history['counts']['all']):
+    lines.append("{0} | {1}".format(day, n))
+  writeAtomic(fname, "\n".join(lines) + "\n")
+  mkdir_p(config['statefolder'])
+  writeJS(os.path.join(config['statefolder'], "history.js"),
+          EnvironmentState.JS_VARIABLE_HISTORY, history,
+          compact=config['compact'],
+          precompress=config['precompress'])
+  logging.info("Wrote {0} days of count history".format(len(history['days'])))
+
 
 def mainLogSummary(config, dtstring):
   '''
   SOLR date format: 2013-07-17T00:00:00Z
   
-  NOTE: this method was written in a rush to get some reporting information.
-  It needs to be refactored to tidy things up a bit.
+  Counts for all the days requested are retrieved by 
+  EnvironmentState.getLogHistory using range facets, so a complete history 
+  (-D ALL) needs only a few requests per event.
   '''
-  MJD_D1_START = 56109.0
   envstate = EnvironmentState(config['baseurl'])
   dates = []
   mjdstart = None
@@ -123,31 +376,15 @@ def mainLogSummary(config, dtstring):
       dates.append(t*1.0)
     dates.append(mjdnow)
     #print out the header
-    row = ['"MJD"']
-    for event in EnvironmentState.LOG_EVENTS:
-      row.append('"' + event[0] + '"')
-    print(",".join(row))
+    print(logHistoryHeader())
   if dtstring is None:
     dates = [mjd.now(), ]
-  exclude_cns = "-ipAddress:({0})"\
-                  .format( " OR ".join(EnvironmentState.CN_IP_ADDRESSES))
   logging.debug("DATES = %s" % str(dates))
+  history = envstate.getLogHistory(dates)
   for day in dates:
-    dtstring = mjd.MJD2dateTime(day).strftime("%Y-%m-%dT00:00:00Z")
-    fq = "dateLogged:[{0}-2DAY TO {0}-1DAY]".format(dtstring)
-    row = ["{0:.5f}".format(day)]
-    for event in EnvironmentState.LOG_EVENTS:
-      if event[0].endswith('.ext'):
-        ev = event[0].split(".")[0]
-        q = "event:{0} AND {1}".format(ev, exclude_cns)
-      else:
-        q = "event:{0}".format(event[0])
-      logging.debug("Q  = %s" % q)
-      logging.debug("FQ = %s" % fq)
-      nrecords = envstate.retrieveLogResponse(q, fq=fq)
-      row.append(str(nrecords))
-    print ",".join(row)
-    logging.info(",".join(row))
+    row = logHistoryRow(day, history[day])
+    print row
+    logging.info(row)
   logging.info('Done.')
   
 
@@ -172,6 +409,18 @@ if __name__ == "__main__":
   parser.add_option("-D","--date", dest="log_summary_date",
                     help="Date or MJD for which to retrieve log stats",
                     default=None)
+  parser.add_option("-u","--update", dest="log_history",
+                    help="Add missing days to the specified log history CSV",
+                    default=None)
+  parser.add_option("-H","--history", dest="count_history",
+                    help="Write the daily count history to the specified plotcounts.csv",
+                    default=None)
+  parser.add_option("-i","--interval", dest="interval",
+                    help="Interval of the count history, day or week (day)",
+                    default="day", choices=["day", "week"])
+  parser.add_option("-E","--export", dest="do_export",
+                    help="Regenerate the web UI JS files from the snapshot store",
+                    default=False, action="store_true")
   (options, args) = parser.parse_args()
   if options.loglevel < 1:
     options.loglevel = 1
@@ -180,7 +429,14 @@ if __name__ == "__main__":
   logging.basicConfig(level=10*options.loglevel)
   config = loadConfig(options.config)
   logging.debug(pprint.pformat(config))
-  if options.do_log_summary:
+  if options.do_export:
+    mainExport(config)
+  elif not options.count_history is None:
+    mainCountHistory(config, options.count_history, 
+                     interval=options.interval)
+  elif not options.log_history is None:
+    updateLogHistory(config, options.log_history)
+  elif options.do_log_summary:
     mainLogSummary(config, options.log_summary_date)
   else:
     main(config)
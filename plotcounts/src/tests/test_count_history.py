@@ -0,0 +1,80 @@
+'''
+Tests for EnvironmentState.getCountHistory and its bucket labels.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import datetime
+import unittest
+from d1state import solr
+from d1state.system_state import EnvironmentState, historyDays
+
+
+class TestHistoryDays(unittest.TestCase):
+
+  def test_endAtMidnight(self):
+    days = historyDays(datetime.datetime(2026, 10, 15),
+                       datetime.datetime(2026, 10, 18), 1)
+    self.assertEqual(days, ['2026-10-15', '2026-10-16', '2026-10-17'])
+
+
+  def test_endNotAtMidnight(self):
+    days = historyDays(datetime.datetime(2026, 10, 15),
+                       datetime.datetime(2026, 10, 18, 10), 1)
+    self.assertEqual(days, ['2026-10-15', '2026-10-16', '2026-10-17',
+                            '2026-10-18'])
+
+
+  def test_partialWeek(self):
+    days = historyDays(datetime.datetime(2026, 10, 1),
+                       datetime.datetime(2026, 10, 18, 10), 7)
+    self.assertEqual(days, ['2026-10-07', '2026-10-14', '2026-10-18'])
+    self.assertEqual(len(set(days)), len(days))
+
+
+if __name__ == "__main__":
+  unittest.main()
+
+
+class TestCountHistory(unittest.TestCase):
+
+  def setUp(self):
+    self.stubbed = [solr.numFound, solr.countByFacet, solr.countByRange]
+    self.ranges = []
+
+    def countByRange(client, field, start, end, gap, q='*:*', fq=None,
+                     include=None, engine='solr'):
+      self.ranges.append(fq)
+      return {'2026-10-15T00:00:00Z': 1, '2026-10-16T00:00:00Z': 2}
+    solr.numFound = lambda client, q='*:*', fq=None, engine='solr': 10
+    solr.countByFacet = lambda client, field, q='*:*', fq=None, \
+                               engine='solr': {'DATA': 6, 'METADATA': 4}
+    solr.countByRange = countByRange
+    #the metadata cache is not used, so none is created
+    self.env = EnvironmentState("https://cn.example.org/cn",
+                                metadata_cache=False)
+
+
+  def tearDown(self):
+    solr.numFound, solr.countByFacet, solr.countByRange = self.stubbed
+
+
+  def test_excludedTypeIsNotRequested(self):
+    res = self.env.getCountHistory(datetime.datetime(2026, 10, 15),
+                                   datetime.datetime(2026, 10, 17),
+                                   fq="-formatType:RESOURCE", by_type=True)
+    self.assertEqual(sorted(res['counts'].keys()), ['DATA', 'METADATA', 'all'])
+    self.assertEqual(res['counts']['all'], [11, 13])
+    self.assertEqual(res['counts']['DATA'], [7, 9])
+    self.assertEqual(len(self.ranges), 3)
+    for fq in self.ranges:
+      self.assertFalse("formatType:RESOURCE" in fq, fq)
+
+
+  def test_allTypesWithoutFilter(self):
+    res = self.env.getCountHistory(datetime.datetime(2026, 10, 15),
+                                   datetime.datetime(2026, 10, 17),
+                                   by_type=True)
+    self.assertEqual(sorted(res['counts'].keys()),
+                     ['DATA', 'METADATA', 'RESOURCE', 'all'])
+    self.assertEqual(res['counts']['RESOURCE'], [1, 3])
@@ -0,0 +1,182 @@
+'''
+Tests for the log history backfill: EnvironmentState.getLogHistory mapping
+range facet buckets to days, and get_state.updateLogHistory appending to or
+rewriting the CSV.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+import get_state
+from d1state import mjd
+from d1state import solr
+from d1state.system_state import EnvironmentState
+
+NEVENTS = len(EnvironmentState.LOG_EVENTS)
+#2026-10-10
+MJD_DAY = 61323.0
+
+
+class FakeRanges(object):
+  '''Stands for solr.countByRange, answering with a count for every day
+  bucket from start to end derived from the event and the day.
+  '''
+
+  def __init__(self):
+    self.requests = []
+
+
+  def __call__(self, client, field, start, end, gap, q='*:*', fq=None,
+               include=None, engine='solr'):
+    self.requests.append([start, end, q])
+    event = [q == EnvironmentState.logEventQuery(e[0])
+             for e in EnvironmentState.LOG_EVENTS].index(True)
+    res = {}
+    t = mjd.dateTimes2MJD([start[:19]])[0]
+    tend = mjd.dateTimes2MJD([end[:19]])[0]
+    while t < tend:
+      day = str(mjd.MJD2dateTimes([t], unit='D')[0])
+      res[day + "T00:00:00Z"] = 100 * event + int(t) % 100
+      t += 1
+    return res
+
+
+class TestGetLogHistory(unittest.TestCase):
+
+  def setUp(self):
+    self.countByRange = solr.countByRange
+    self.ranges = FakeRanges()
+    solr.countByRange = self.ranges
+    #the metadata cache is not used, so none is created
+    self.env = EnvironmentState("https://cn.example.org/cn",
+                                metadata_cache=False)
+
+
+  def tearDown(self):
+    solr.countByRange = self.countByRange
+
+
+  def test_bucketsMapToDays(self):
+    days = [MJD_DAY + i for i in xrange(7)] + [MJD_DAY + 7.25]
+    res = self.env.getLogHistory(days, chunk_days=3)
+    self.assertEqual(sorted(res.keys()), days)
+    for day in days:
+      #the count for D is taken from the bucket starting at D-2DAY
+      bucket = int(day) - 2
+      self.assertEqual(res[day], [100 * i + bucket % 100
+                                  for i in xrange(NEVENTS)], day)
+
+
+  def test_requestsPerChunk(self):
+    days = [MJD_DAY + i for i in xrange(7)]
+    self.env.getLogHistory(days, chunk_days=3)
+    #buckets from 2026-10-08 to 2026-10-14, in chunks of 3, 3 and 1 days
+    spans = sorted(set([(r[0], r[1]) for r in self.ranges.requests]))
+    self.assertEqual(spans, [("2026-10-08T00:00:00.000Z",
+                              "2026-10-11T00:00:00.000Z"),
+                             ("2026-10-11T00:00:00.000Z",
+                              "2026-10-14T00:00:00.000Z"),
+                             ("2026-10-14T00:00:00.000Z",
+                              "2026-10-15T00:00:00.000Z")])
+    self.assertEqual(len(self.ranges.requests), 3 * NEVENTS)
+
+
+
+class FakeEnvironment(object):
+  '''Stands for EnvironmentState in updateLogHistory.
+  '''
+
+  def __init__(self):
+    self.requested = []
+
+
+  def getLogHistory(self, days):
+    self.requested.append(list(days))
+    return dict((day, [int(day) % 10] * NEVENTS) for day in days)
+
+
+class TestUpdateLogHistory(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.fname = os.path.join(self.folder, "production_log_history.csv")
+    self.writeLogHistory = get_state.writeLogHistory
+    self.rewrites = []
+
+    def _write(fname, rows):
+      self.rewrites.append(len(rows))
+      self.writeLogHistory(fname, rows)
+    get_state.writeLogHistory = _write
+    self.today = int(mjd.now())
+
+
+  def tearDown(self):
+    get_state.writeLogHistory = self.writeLogHistory
+    shutil.rmtree(self.folder)
+
+
+  def writeRows(self, days):
+    lines = [get_state.logHistoryHeader()]
+    for day in days:
+      lines.append(get_state.logHistoryRow(day, [int(day) % 10] * NEVENTS))
+    dest = file(self.fname, "w")
+    dest.write("\n".join(lines) + "\n")
+    dest.close()
+
+
+  def update(self):
+    env = FakeEnvironment()
+    get_state.updateLogHistory({}, self.fname, chunk_days=3, envstate=env)
+    return env.requested
+
+
+  def assertComplete(self):
+    rows, clean = get_state.loadLogHistory(self.fname)
+    self.assertTrue(clean)
+    self.assertEqual(sorted(rows.keys()), range(self.today - 20,
+                                                self.today + 1))
+
+
+  def test_appendsWithoutRewriting(self):
+    self.writeRows([float(d) for d in xrange(self.today - 20,
+                                             self.today - 4)])
+    before = file(self.fname, "r").read()
+    requested = self.update()
+    self.assertEqual([len(days) for days in requested], [3, 2])
+    self.assertEqual(self.rewrites, [])
+    self.assertTrue(file(self.fname, "r").read().startswith(before))
+    self.assertComplete()
+
+
+  def test_fillsGapsThenAppends(self):
+    days = [float(d) for d in xrange(self.today - 20, self.today - 1)
+            if not d in (self.today - 15, self.today - 14)]
+    self.writeRows(days)
+    requested = self.update()
+    self.assertEqual([[int(d) for d in r] for r in requested],
+                     [[self.today - 15, self.today - 14, self.today - 1],
+                      [self.today]])
+    #the chunk filling the gap is written in place, the last is appended
+    self.assertEqual(self.rewrites, [20])
+    self.assertComplete()
+
+
+  def test_repairsTornRow(self):
+    self.writeRows([float(d) for d in xrange(self.today - 20, self.today)])
+    content = file(self.fname, "r").read()
+    #an append interrupted part way through the last row
+    file(self.fname, "w").write(content[:-3])
+    requested = self.update()
+    self.assertEqual([[int(d) for d in r] for r in requested],
+                     [[self.today - 1, self.today]])
+    self.assertEqual(self.rewrites, [21])
+    self.assertComplete()
+    self.assertEqual(self.update(), [])
+    self.assertEqual(self.rewrites, [21])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+'''
+Tests for the array conversions of d1state.mjd.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import datetime
+import unittest
+import numpy
+from d1state import mjd
+
+#Scalar MJD goes through the Julian date, so is only good to about 1e-9 days
+SCALAR_TOLERANCE = 1e-9
+
+
+def sampleDateTimes():
+  return [datetime.datetime(1970, 1, 1),
+          datetime.datetime(2012, 7, 1, 0, 0, 0, 1),
+          datetime.datetime(2016, 2, 29, 23, 59, 59, 999999),
+          datetime.datetime(2026, 10, 18, 13, 20, 12, 345678)]
+
+
+class TestMJD(unittest.TestCase):
+
+  def test_arrayAgreesWithScalar(self):
+    dts = sampleDateTimes()
+    res = mjd.dateTimes2MJD(dts)
+    self.assertEqual(res.shape, (len(dts), ))
+    for dt, value in zip(dts, res):
+      self.assertAlmostEqual(value, mjd.dateTime2MJD(dt),
+                             delta=SCALAR_TOLERANCE)
+
+
+  def test_microseconds(self):
+    dt = datetime.datetime(2026, 10, 18, 13, 20, 12)
+    half = dt + datetime.timedelta(microseconds=500000)
+    #half a second in days, well above the scalar tolerance
+    delta = 0.5 / mjd.SECONDS_PER_DAY
+    self.assertAlmostEqual(mjd.dateTime2MJD(half) - mjd.dateTime2MJD(dt),
+                           delta, delta=SCALAR_TOLERANCE)
+    arr = mjd.dateTimes2MJD([dt, half])
+    self.assertAlmostEqual(arr[1] - arr[0], delta, delta=1e-11)
+
+
+  def test_now(self):
+    before = mjd.dateTimes2MJD([datetime.datetime.utcnow()])[0]
+    value = mjd.now()
+    after = mjd.dateTimes2MJD([datetime.datetime.utcnow()])[0]
+    self.assertTrue(before - SCALAR_TOLERANCE <= value, (before, value))
+    self.assertTrue(value <= after + SCALAR_TOLERANCE, (value, after))
+
+
+  def test_epoch(self):
+    self.assertEqual(mjd.epoch2MJD(0), mjd.MJD_UNIX_EPOCH)
+    t = numpy.array([0.0, 1341100800.0, 1792329612.345678])
+    res = mjd.epoch2MJD(t)
+    self.assertEqual(res[1], 56109.0)
+    self.assertTrue(numpy.allclose(mjd.MJD2epoch(res), t, rtol=0,
+                                   atol=1e-6))
+    self.assertAlmostEqual(float(mjd.epoch2MJD(86400.5)),
+                           mjd.MJD_UNIX_EPOCH + 1 + 0.5 / 86400, places=12)
+
+
+  def test_roundTrip(self):
+    dts = numpy.array(sampleDateTimes(), dtype='datetime64[us]')
+    back = mjd.MJD2dateTimes(mjd.dateTimes2MJD(dts))
+    self.assertEqual(back.dtype, numpy.dtype('datetime64[us]'))
+    self.assertTrue((back == dts).all(), (back, dts))
+    days = mjd.MJD2dateTimes(mjd.dateTimes2MJD(dts), unit='D')
+    self.assertEqual([str(d) for d in days],
+                     ['1970-01-01', '2012-07-01', '2016-02-29', '2026-10-18'])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,111 @@
+'''
+Tests for d1state.object_tally reconciliation with listObjects.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import shutil
+import datetime
+import tempfile
+import unittest
+from StringIO import StringIO
+from d1state import object_tally
+
+DATE_FORMAT = object_tally.LISTOBJECTS_DATE_FORMAT
+
+
+class FakeClient(object):
+  '''Serves listObjects from a dict of identifier: [formatId, modified].
+  '''
+
+  def __init__(self):
+    self.objects = {}
+
+
+  def _rest_url(self, path):
+    return path
+
+
+  def GET(self, url, params):
+    listed = []
+    for identifier in sorted(self.objects.keys()):
+      formatId, modified = self.objects[identifier]
+      stamp = modified.strftime(DATE_FORMAT)
+      if 'fromDate' in params and stamp < params['fromDate']:
+        continue
+      if 'toDate' in params and stamp >= params['toDate']:
+        continue
+      listed.append([identifier, formatId, stamp])
+    page = listed[params['start']:params['start'] + params['count']]
+    xml = ['<ObjectList total="{0}">'.format(len(listed))]
+    for identifier, formatId, stamp in page:
+      xml.append("<objectInfo><identifier>{0}</identifier>"
+                 "<formatId>{1}</formatId>"
+                 "<dateSysMetadataModified>{2}</dateSysMetadataModified>"
+                 "</objectInfo>".format(identifier, formatId, stamp))
+    xml.append('</ObjectList>')
+    return StringIO("".join(xml))
+
+
+class TestObjectTally(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.client = FakeClient()
+    self.day = datetime.datetime(2026, 10, 1)
+    for i in xrange(5):
+      self.client.objects["id{0}".format(i)] = ["eml", self.day]
+
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+
+  def test_deletedObjectsAreRemoved(self):
+    tally = object_tally.ObjectTally(self.folder, page_size=2)
+    tally.update(self.client, to_date=self.day + datetime.timedelta(days=1))
+    self.assertEqual(5, tally.count())
+    del self.client.objects["id0"]
+    del self.client.objects["id1"]
+    tally.update(self.client, to_date=self.day + datetime.timedelta(days=2))
+    self.assertEqual(3, tally.count())
+
+
+  def test_periodicFullRescan(self):
+    tally = object_tally.ObjectTally(self.folder, page_size=2)
+    first = self.day + datetime.timedelta(days=1)
+    self.client.objects["id0"][0] = "pdf"
+    tally.update(self.client, to_date=first)
+    #A deletion hidden by an object added after the scan window is only
+    #found by the rescan
+    del self.client.objects["id0"]
+    later = self.day + datetime.timedelta(days=2)
+    self.client.objects["id9"] = ["eml", later + datetime.timedelta(hours=1)]
+    tally.update(self.client, to_date=later)
+    self.assertEqual({"eml": 4, "pdf": 1}, tally.countByFormat())
+    self.assertEqual(first, tally.getFullScan())
+    rescan = first + datetime.timedelta(days=tally.rescan_days)
+    tally.update(self.client, to_date=rescan)
+    self.assertEqual({"eml": 5}, tally.countByFormat())
+    self.assertEqual(rescan, tally.getFullScan())
+
+
+  def test_rescanKeepsFirstSeenDay(self):
+    tally = object_tally.ObjectTally(self.folder, page_size=2)
+    first = self.day + datetime.timedelta(days=1)
+    tally.update(self.client, to_date=first)
+    #system metadata of id0 modified later, and id1 deleted
+    later = self.day + datetime.timedelta(days=3)
+    self.client.objects["id0"][1] = later
+    del self.client.objects["id1"]
+    #the deletion is found by a full scan
+    tally.update(self.client, to_date=later + datetime.timedelta(hours=1))
+    self.assertEqual({"2026-10-01": 4}, tally.countByDay())
+    rescan = tally.getFullScan() + datetime.timedelta(days=tally.rescan_days)
+    tally.update(self.client, to_date=rescan)
+    self.assertEqual(rescan, tally.getFullScan())
+    self.assertEqual({"2026-10-01": 4}, tally.countByDay())
+
+
+if __name__ == "__main__":
+  unittest.main()
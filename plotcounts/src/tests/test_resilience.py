@@ -0,0 +1,83 @@
+'''
+Tests for d1state.resilience circuit breaking.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import socket
+import unittest
+from d1state import resilience
+
+
+class NotFound(Exception):
+  '''Stands for a non-retryable DataONE error such as NotFound.
+  '''
+  pass
+
+
+def _raise(error):
+  raise error
+
+
+class TestResilience(unittest.TestCase):
+
+  def newResilience(self, **kwargs):
+    return resilience.Resilience(base_delay=0, max_delay=0, **kwargs)
+
+
+  def test_deadHostOpensInOneCall(self):
+    r = self.newResilience()
+    self.assertTrue(r.failure_threshold <= r.max_tries)
+    calls = []
+
+    def dead():
+      calls.append(1)
+      raise socket.error("refused")
+    self.assertRaises(socket.error, r.call, 'test', 'h', dead)
+    self.assertEqual(len(calls), r.failure_threshold)
+    self.assertRaises(resilience.CircuitOpenError, r.call, 'test', 'h', dead)
+    self.assertEqual(len(calls), r.failure_threshold)
+
+
+  def test_halfOpenThenNonRetryableError(self):
+    r = self.newResilience(failure_threshold=1, reset_after=0)
+    self.assertRaises(socket.error, r.call, 'test', 'h',
+                      _raise, socket.error("refused"))
+    breaker = r.breaker('h')
+    self.assertEqual(breaker.state, resilience.CircuitBreaker.OPEN)
+    #reset_after has elapsed, the trial call gets a non-retryable answer
+    self.assertRaises(NotFound, r.call, 'test', 'h', _raise, NotFound())
+    self.assertEqual(breaker.state, resilience.CircuitBreaker.CLOSED)
+    self.assertEqual(r.call('test', 'h', lambda: 42), 42)
+
+
+  def test_serverErrorIsRetried(self):
+    r = self.newResilience()
+    calls = []
+
+    def flaky():
+      calls.append(1)
+      if len(calls) < 3:
+        raise resilience.ServerError(503, "http://h/cn/v1/query/solr/")
+      return 42
+    self.assertEqual(r.call('test', 'h', flaky), 42)
+    self.assertEqual(len(calls), 3)
+
+
+  def test_configureHostOutlastsConcurrentFailures(self):
+    r = self.newResilience(max_tries=1)
+    r.configureHost('cn', failure_threshold=10, reset_after=0)
+    #several phases failing at once during a short outage
+    for i in xrange(5):
+      self.assertRaises(socket.error, r.call, 'test', 'cn',
+                        _raise, socket.error("reset"))
+    self.assertEqual(r.breaker('cn').state, resilience.CircuitBreaker.CLOSED)
+    self.assertEqual(r.call('test', 'cn', lambda: 42), 42)
+    #other hosts keep the default threshold
+    self.assertRaises(socket.error, r.call, 'test', 'mn',
+                      _raise, socket.error("reset"))
+    self.assertEqual(r.breaker('mn').state, resilience.CircuitBreaker.OPEN)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,81 @@
+'''
+Tests for the rollup series read by the web UI.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import os
+import re
+import unittest
+from StringIO import StringIO
+from d1state.system_state import EnvironmentState
+from d1state.rollups import extractSeries
+
+SYSTEMSTATE_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "..", "www", "lib", "systemstate.js")
+
+
+def newEnvironmentState():
+  #the metadata cache is not used, so none is created
+  return EnvironmentState("https://cn.example.org/cn", metadata_cache=False)
+
+
+def snapshotJSON():
+  '''Returns the asJSON output of a snapshot with counts, sizes, nodes and
+  logs in the form populateState leaves them.
+  '''
+  env = newEnvironmentState()
+  env.state['meta'] = {'tstamp': "2026-10-18 00:00:00.0+00:00"}
+  env.state['formats'] = {'eml://ecoinformatics.org/eml-2.1.1':
+                              {'type': 'METADATA'},
+                          'text/csv': {'type': 'DATA'},
+                          'http://www.openarchives.org/ore/terms':
+                              {'type': 'RESOURCE'}}
+  env.state['counts'] = {'eml://ecoinformatics.org/eml-2.1.1': [10, 8, 6],
+                         'text/csv': [20, 15, 12],
+                         'http://www.openarchives.org/ore/terms': [5, 4, 3]}
+  env.summarizeCounts()
+  bins, fqs = env._sizeHistogramBins(1, 100000, 4)
+  env.state['summary']['sizes'] = {'data': {'minimum': 1,
+                                            'maximum': 100000,
+                                            'histogram': bins}}
+  env.state['nodes'] = {'urn:node:KNB': {'objectcount': 7},
+                        'urn:node:DOWN': {'objectcount': -1110}}
+  env.state['logs'] = {'data': {'read': {'Day': 3, 'All': 30}}}
+  out = StringIO()
+  env.asJSON(out, compact=True)
+  return out.getvalue()
+
+
+class TestRollupSeries(unittest.TestCase):
+
+  def setUp(self):
+    env = newEnvironmentState()
+    env.fromJSON(StringIO(snapshotJSON()))
+    self.series = extractSeries(env.state)
+
+
+  def test_seriesNames(self):
+    self.assertEqual(self.series['summary.counts.all.total'], 35)
+    self.assertEqual(self.series['summary.counts.public.total'], 27)
+    self.assertEqual(self.series['summary.counts.public_notobsolete.total'],
+                     21)
+    self.assertEqual(self.series['summary.counts.all.data'], 20)
+    self.assertTrue('summary.sizes.data.bin3' in self.series)
+    self.assertEqual(self.series['nodes.urn:node:KNB.objectcount'], 7)
+    self.assertFalse('nodes.urn:node:DOWN.objectcount' in self.series)
+    self.assertEqual(self.series['logs.read.Day'], 3)
+
+
+  def test_pageSeriesAreExtracted(self):
+    js = file(SYSTEMSTATE_JS, "r").read()
+    body = js[js.index("function renderRollups()"):]
+    body = body[:body.index("\n}\n")]
+    names = re.findall(r'\[ "([^"]+)",', body)
+    self.assertEqual(len(names), 3)
+    for name in names:
+      self.assertTrue(name in self.series, name)
+
+
+if __name__ == "__main__":
+  unittest.main()
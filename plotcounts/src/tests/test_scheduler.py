@@ -0,0 +1,68 @@
+'''
+Tests for the status file of d1state.scheduler.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from d1state.scheduler import Job, Scheduler
+
+
+def _ok():
+  pass
+
+
+def _fail():
+  raise IOError("CN unavailable")
+
+
+def newScheduler(path):
+  scheduler = Scheduler(status_path=path, stagger=0)
+  scheduler.add(Job("state", _ok, at="01:00"))
+  scheduler.add(Job("objectcounts", _fail, at="02:00"))
+  return scheduler
+
+
+class TestSchedulerStatus(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.path = os.path.join(self.folder, "collector.json")
+
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+
+  def test_runJobKeepsDaemonStatus(self):
+    daemon = newScheduler(self.path)
+    for i in xrange(3):
+      daemon.runJob(daemon.jobs[0])
+    before = json.load(file(self.path, "r"))
+    single = newScheduler(self.path)
+    self.assertFalse(single.runJob(single.jobs[1], merge=True))
+    after = json.load(file(self.path, "r"))
+    self.assertEqual(after['started'], before['started'])
+    self.assertEqual(after['jobs']['state'], before['jobs']['state'])
+    self.assertEqual(after['jobs']['state']['runs'], 3)
+    entry = after['jobs']['objectcounts']
+    self.assertEqual(entry['next_run'],
+                     before['jobs']['objectcounts']['next_run'])
+    self.assertEqual([entry['runs'], entry['failures']], [1, 1])
+    self.assertEqual(entry['last_status'], 'failed')
+
+
+  def test_runJobWithoutStatusFile(self):
+    single = newScheduler(self.path)
+    self.assertTrue(single.runJob(single.jobs[0], merge=True))
+    status = json.load(file(self.path, "r"))
+    self.assertEqual(status['jobs']['state']['runs'], 1)
+    self.assertEqual(status['jobs']['objectcounts']['runs'], 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,97 @@
+'''
+Tests for the keyframe and delta encoding of d1state.snapshot_store.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import copy
+import shutil
+import tempfile
+import unittest
+from d1state.snapshot_store import SnapshotStore, DELTA_KEY
+
+
+def snapshots():
+  '''Returns [tstamp, name, state] for a run of snapshots that add, change
+  and remove top level and nested keys.
+  '''
+  state = {'meta': {'tstamp': '', 'timings': {'nodes': 1.5}},
+           'counts': {'all': {'total': 100, 'eml': 40}},
+           'nodes': {'urn:node:A': {'state': 'up', 'objectcount': 10}},
+           'dns': 'ok'}
+  res = []
+  for i in xrange(8):
+    state = copy.deepcopy(state)
+    tstamp = "2026-10-{0:02d} 00:00:00.0+00:00".format(i + 1)
+    state['meta']['tstamp'] = tstamp
+    state['counts']['all']['total'] = 100 + i
+    if i == 2:
+      #removed key
+      del state['dns']
+    if i == 4:
+      #changed nested value
+      state['nodes']['urn:node:A']['state'] = 'down'
+      state['nodes']['urn:node:B'] = {'state': 'up', 'objectcount': 5}
+    if i == 5:
+      del state['nodes']['urn:node:A']['objectcount']
+    res.append([tstamp, "state_{0}.js".format(i), state])
+  return res
+
+
+class TestSnapshotStore(unittest.TestCase):
+
+  def setUp(self):
+    self.folder = tempfile.mkdtemp()
+    self.snapshots = snapshots()
+    store = SnapshotStore(self.folder, keyframe_interval=3)
+    for tstamp, name, state in self.snapshots:
+      store.append(state, name)
+
+
+  def tearDown(self):
+    shutil.rmtree(self.folder)
+
+
+  def test_keyframesAndDeltas(self):
+    store = SnapshotStore(self.folder, keyframe_interval=3)
+    kinds = [DELTA_KEY in store._readRecord(i) for i in xrange(len(store))]
+    self.assertEqual(kinds, [False, True, True, False, True, True, False,
+                             True])
+
+
+  def test_getReturnsAppended(self):
+    for tstamp, name, state in self.snapshots:
+      #a new store for each, so nothing is served from the cache
+      store = SnapshotStore(self.folder, keyframe_interval=3)
+      self.assertEqual(store.get(tstamp), state)
+
+
+  def test_findAndLoadInAnyOrder(self):
+    store = SnapshotStore(self.folder, keyframe_interval=3)
+    for i in [7, 2, 5, 0, 6, 4, 1, 3]:
+      tstamp, name, state = self.snapshots[i]
+      self.assertEqual(store.find(tstamp), i)
+      self.assertEqual(store.find(tstamp[:10] + " 12"), i)
+      self.assertEqual(store.entry(i)[1], name)
+      self.assertEqual(store.load(i), state)
+    self.assertEqual(store.find("2026-09-30"), -1)
+    self.assertEqual(store.get("2026-09-30"), None)
+    self.assertFalse('dns' in store.get(self.snapshots[4][0]))
+    self.assertEqual(store.get(self.snapshots[1][0])['dns'], 'ok')
+
+
+  def test_appendAfterReopen(self):
+    store = SnapshotStore(self.folder, keyframe_interval=3)
+    tstamp, name, state = self.snapshots[-1]
+    state = copy.deepcopy(state)
+    state['meta']['tstamp'] = "2026-10-20 00:00:00.0+00:00"
+    state['nodes']['urn:node:B']['state'] = 'down'
+    store.append(state, "state_8.js")
+    self.assertEqual(SnapshotStore(self.folder).get(state['meta']['tstamp']),
+                     state)
+    self.assertEqual(SnapshotStore(self.folder).get(tstamp),
+                     self.snapshots[-1][2])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,163 @@
+'''
+Tests for d1state.solr requests and response decoding.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import json
+import unittest
+from StringIO import StringIO
+from d1state import solr
+from d1state.resilience import ServerError
+
+
+class FakeResponse(StringIO):
+
+  def __init__(self, content, status=200):
+    StringIO.__init__(self, content)
+    self.status = status
+
+
+class FakeClient(object):
+  '''Answers every GET with content and status.
+  '''
+
+  def __init__(self, content, status=200):
+    self.content = content
+    self.status = status
+    self.requests = []
+
+
+  def _rest_url(self, path):
+    return "https://cn.example.org/cn/v1/" + path
+
+
+  def GET(self, url, params):
+    self.requests.append([url, params])
+    return FakeResponse(self.content, self.status)
+
+
+class TestQuery(unittest.TestCase):
+
+  def test_serverErrorIsRaised(self):
+    client = FakeClient("<html>Service Unavailable</html>", status=503)
+    self.assertRaises(ServerError, solr.numFound, client)
+
+
+  def test_clientErrorIsRaised(self):
+    client = FakeClient("<html>Bad Request</html>", status=400)
+    self.assertRaises(IOError, solr.numFound, client)
+
+
+  def test_numFound(self):
+    client = FakeClient(json.dumps({'response': {'numFound': 12,
+                                                 'docs': []}}))
+    self.assertEqual(solr.numFound(client, fq="formatType:DATA"), 12)
+    url, params = client.requests[0]
+    self.assertEqual(url, "https://cn.example.org/cn/v1/query/solr/")
+    self.assertEqual(params['wt'], 'json')
+    self.assertEqual(params['fq'], "formatType:DATA")
+
+
+#A SOLR response holding facet fields, queries, pivots, ranges and stats,
+#with other content around them that decoding should skip
+CANNED = {
+  'responseHeader': {'status': 0, 'QTime': 12,
+                     'params': {'facet.field': 'formatType'}},
+  'response': {'numFound': 35, 'start': 0,
+               'docs': [{'id': 'a', 'size': 10}, {'id': 'b', 'size': 20}]},
+  'facet_counts': {
+    'facet_queries': {'size:[0 TO 100]': 30, 'size:[100 TO *]': 5},
+    'facet_fields': {'formatType': ['DATA', 20, 'METADATA', 10,
+                                    'RESOURCE', 5]},
+    'facet_pivot': {'formatType,formatId': [
+      {'field': 'formatType', 'value': 'DATA', 'count': 20,
+       'pivot': [{'field': 'formatId', 'value': 'text/csv', 'count': 15},
+                 {'field': 'formatId', 'value': 'image/png', 'count': 5}]},
+      {'field': 'formatType', 'value': 'METADATA', 'count': 10,
+       'pivot': [{'field': 'formatId', 'value': 'eml', 'count': 9}]}]},
+    'facet_ranges': {'dateUploaded': {
+      'counts': ['2026-10-16T00:00:00Z', 3, '2026-10-17T00:00:00Z', 0,
+                 '2026-10-18T00:00:00Z', 7],
+      'gap': '+1DAY', 'start': '2026-10-16T00:00:00Z',
+      'end': '2026-10-19T00:00:00Z'}}},
+  'stats': {'stats_fields': {'size': {'min': 1.0, 'max': 2048.0, 'count': 35,
+                                      'facets': {}}}},
+}
+
+
+def countAll(client):
+  return {'numFound': solr.numFound(client),
+          'facet': solr.countByFacet(client, 'formatType'),
+          'queries': solr.countByQueries(client, ['size:[0 TO 100]',
+                                                  'size:[100 TO *]']),
+          'pivot': solr.countByPivot(client, ['formatType', 'formatId']),
+          'range': solr.countByRange(client, 'dateUploaded',
+                                     '2026-10-16T00:00:00Z',
+                                     '2026-10-19T00:00:00Z', '+1DAY'),
+          'stats': solr.fieldStats(client, 'size'), }
+
+
+class TestDecode(unittest.TestCase):
+
+  def setUp(self):
+    self.ijson = solr.ijson
+    self.client = FakeClient(json.dumps(CANNED))
+
+
+  def tearDown(self):
+    solr.ijson = self.ijson
+
+
+  def decode(self, use_ijson, fields):
+    if not use_ijson:
+      solr.ijson = None
+    try:
+      return solr.decodeResponse(StringIO(json.dumps(CANNED)), fields=fields)
+    finally:
+      solr.ijson = self.ijson
+
+
+  def test_jsonCounts(self):
+    solr.ijson = None
+    res = countAll(self.client)
+    self.assertEqual(res['numFound'], 35)
+    self.assertEqual(res['facet'], {'DATA': 20, 'METADATA': 10,
+                                    'RESOURCE': 5})
+    self.assertEqual(res['queries'], {'size:[0 TO 100]': 30,
+                                      'size:[100 TO *]': 5})
+    self.assertEqual(res['pivot'],
+                     {'DATA': [20, {'text/csv': [15, {}],
+                                    'image/png': [5, {}]}],
+                      'METADATA': [10, {'eml': [9, {}]}]})
+    self.assertEqual(solr.checkPivot(res['pivot']), [['METADATA', 10, 9]])
+    self.assertEqual(res['range'], {'2026-10-16T00:00:00Z': 3,
+                                    '2026-10-17T00:00:00Z': 0,
+                                    '2026-10-18T00:00:00Z': 7})
+    self.assertEqual(res['stats']['max'], 2048.0)
+
+
+  @unittest.skipIf(solr.ijson is None, "ijson is not installed")
+  def test_ijsonMatchesJson(self):
+    streamed = countAll(self.client)
+    solr.ijson = None
+    self.assertEqual(streamed, countAll(self.client))
+
+
+  @unittest.skipIf(solr.ijson is None, "ijson is not installed")
+  def test_selectedFields(self):
+    fields = ['response.numFound', 'facet_counts.facet_pivot',
+              'facet_counts.facet_ranges', 'facet_counts.facet_fields',
+              'stats.stats_fields', 'facet_counts.missing']
+    streamed = self.decode(True, fields)
+    self.assertEqual(streamed, self.decode(False, fields))
+    self.assertEqual(sorted(streamed.keys()),
+                     ['facet_counts', 'response', 'stats'])
+    self.assertEqual(streamed['response'], {'numFound': 35})
+    self.assertEqual(sorted(streamed['facet_counts'].keys()),
+                     ['facet_fields', 'facet_pivot', 'facet_ranges'])
+    self.assertEqual(self.decode(True, None), CANNED)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,56 @@
+'''
+Tests for the deadline handling of d1state.workers.
+
+Run from the src folder with: python -m unittest discover tests
+'''
+
+import time
+import unittest
+import traceback
+from d1state import workers
+
+TIMED_OUT = -1000
+
+
+def _timedOut(item):
+  return TIMED_OUT
+
+
+def _fail(item):
+  raise ValueError("No route to {0}".format(item))
+
+
+def _sleep(item):
+  time.sleep(item)
+  return item
+
+
+class TestCallWithDeadline(unittest.TestCase):
+
+  def test_errorIsRaisedNotTimedOut(self):
+    try:
+      workers.callWithDeadline(_fail, "mn", timeout=5, on_timeout=_timedOut)
+    except ValueError as e:
+      self.assertEqual(str(e), "No route to mn")
+      #the traceback reaches into the worker
+      self.assertTrue("_fail" in traceback.format_exc())
+    else:
+      self.fail("ValueError not raised")
+
+
+  def test_timeout(self):
+    self.assertEqual(workers.callWithDeadline(_sleep, 1, timeout=0.05,
+                                              on_timeout=_timedOut),
+                     TIMED_OUT)
+    self.assertEqual(workers.callWithDeadline(_sleep, 0, timeout=5,
+                                              on_timeout=_timedOut), 0)
+
+
+  def test_mapConcurrentRecordsErrorsAsNone(self):
+    res = workers.mapConcurrent(lambda i: _fail(i) if i == 1 else i,
+                                [0, 1, 2], timeout=5, on_timeout=_timedOut)
+    self.assertEqual(res, [0, None, 2])
+
+
+if __name__ == "__main__":
+  unittest.main()
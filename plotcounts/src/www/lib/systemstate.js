@@ -4,6 +4,7 @@ var MAX_CHECKS = 10;
 var DATA_READY_CHECKS = 0;
 var VIZ_READY_CHECKS = 0;
 var CURRENT_DATA_PAGE_INDEX = 0;
+var ROLLUPS_RENDERED = false;
 
 try {
   google.setOnLoadCallback(visualizationReady);
@@ -80,6 +81,58 @@ function renderHistograms() {
       "Public Resource Maps (Log scales)", "KB", 1024, true);
 }
 
+/**
+ * Loads data/rollup_<interval>.js (interval is "day", "week" or "month"),
+ * which sets state_rollup, then calls success.
+ */
+function loadRollup(interval, success) {
+  $.getScript(DATA_FOLDER + "/rollup_" + interval + ".js", success).fail(
+      dataLoadError);
+}
+
+/**
+ * Uses the Google Visualization API to plot rollup series over time. series
+ * is an array of [series name, label], e.g.
+ * ["summary.counts.all.total", "All"].
+ */
+function renderRollupChart(series, targetdiv, title) {
+  var data = new google.visualization.DataTable();
+  data.addColumn('date', 'Date');
+  for ( var j = 0; j < series.length; j++) {
+    data.addColumn('number', series[j][1]);
+  }
+  for ( var i = 0; i < state_rollup.periods.length; i++) {
+    var p = state_rollup.periods[i].split("-");
+    var row = [ new Date(p[0], p[1] - 1, p[2]) ];
+    for ( var j = 0; j < series.length; j++) {
+      var values = state_rollup.series[series[j][0]];
+      row.push(typeof values == 'undefined' ? null : values[i]);
+    }
+    data.addRow(row);
+  }
+  var options = {
+    title : title,
+    interpolateNulls : true,
+    legend : {
+      position : 'bottom'
+    }
+  }
+  var chart = new google.visualization.LineChart(document
+      .getElementById(targetdiv));
+  chart.draw(data, options)
+}
+
+function renderRollups() {
+  loadRollup("week", function() {
+    renderRollupChart([
+        [ "summary.counts.all.total", "All" ],
+        [ "summary.counts.public.total", "Public" ],
+        [ "summary.counts.public_notobsolete.total",
+            "Public, not obsoleted" ] ], "rollup.counts",
+        "Total Objects (weekly)");
+  });
+}
+
 function doRenderVisualizations() {
   if (!isDataReady()) {
     VIZ_READY_CHECKS++;
@@ -90,6 +143,10 @@ function doRenderVisualizations() {
     }
   } else {
     renderHistograms();
+    if (!ROLLUPS_RENDERED) {
+      ROLLUPS_RENDERED = true;
+      renderRollups();
+    }
   }
 }
 
@@ -205,11 +262,16 @@ function renderDNSInfo() {
     return;
   }
   $("#d1_dns").show();
-  //TODO: Generalize this
   var target = $("[id=d1\\.dnsinfo]");
-  var prodips = env_state.dns['cn.dataone.org'].address;
+  //the round robin name is the host of the base URL, from version 19 the DNS
+  //section also lists member node hosts, which are not shown here
+  var rrhost = env_state.meta.baseurl.split("/")[2];
+  if (!(rrhost in env_state.dns)) {
+    rrhost = 'cn.dataone.org';
+  }
+  var prodips = env_state.dns[rrhost].address;
   for (var key in env_state.dns) {
-    if (key != 'cn.dataone.org') {
+    if (key != rrhost && env_state.dns[key].type != 'mn') {
       var entry = $("<span>");
       entry.addClass('spaced');
       entry.text(key.split(".")[0]);